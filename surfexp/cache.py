@@ -0,0 +1,736 @@
+"""Shared caches."""
+import contextlib
+import hashlib
+import json
+import os
+import shutil
+import socket
+import threading
+import time
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import numpy as np
+from deode.logs import logger
+
+# URL schemes fetched into the forcing input cache
+REMOTE_SCHEMES = ("http", "https", "ftp", "file")
+# Directory with the leases of the tasks using the forcing input cache
+LEASE_DIR = ".leases"
+# Seconds after which a lease is considered left behind
+LEASE_TIMEOUT = 24 * 3600
+# Bytes read at a time when hashing the content of a file
+DIGEST_CHUNK_SIZE = 16 * 1024**2
+
+
+def hash_key(settings):
+    """Create a content hash from settings.
+
+    Args:
+        settings (dict): JSON serializable settings describing the content.
+
+    Returns:
+        str: Hex digest
+
+    """
+    settings = json.dumps(settings, sort_keys=True, default=str)
+    return hashlib.sha256(settings.encode("utf-8")).hexdigest()
+
+
+def file_digest(fname):
+    """Create a hash of the content of a file.
+
+    Args:
+        fname (str): File
+
+    Returns:
+        str: Hex digest
+
+    """
+    digest = hashlib.sha256()
+    with open(fname, mode="rb") as fhandler:
+        for chunk in iter(lambda: fhandler.read(DIGEST_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def input_signature(files):
+    """Describe input files by path, modification time and size.
+
+    Args:
+        files (list): Input files.
+
+    Returns:
+        list: Signature for each file
+
+    """
+    signature = []
+    for fname in files:
+        stat = os.stat(fname)
+        signature.append([os.path.realpath(fname), stat.st_mtime_ns, stat.st_size])
+    return signature
+
+
+def directory_size(path):
+    """Get the total size of the files in a directory tree.
+
+    Args:
+        path (str): Directory
+
+    Returns:
+        int: Size in bytes
+
+    """
+    size = 0
+    for root, __, files in os.walk(path):
+        for fname in files:
+            with contextlib.suppress(FileNotFoundError):
+                size += os.lstat(os.path.join(root, fname)).st_size
+    return size
+
+
+def evict_lru(entries, max_size, keep_after=None):
+    """Remove the least recently used entries until the total size fits.
+
+    Entries removed by somebody else in the meantime are ignored.
+
+    Args:
+        entries (list): Paths to cache entries (files or directories).
+        max_size (int): Maximum total size in bytes.
+        keep_after (float, optional): Entries used at or after this time are
+                                      kept. Defaults to None.
+
+    Returns:
+        list: Removed entries
+
+    """
+    sizes = {}
+    last_used = {}
+    for entry in entries:
+        try:
+            # The modification time is set explicitly when an entry is used
+            stat = os.lstat(entry)
+        except FileNotFoundError:
+            continue
+        last_used[entry] = stat.st_mtime
+        if os.path.isdir(entry):
+            sizes[entry] = directory_size(entry)
+        else:
+            sizes[entry] = stat.st_size
+
+    total = sum(sizes.values())
+    removed = []
+    for entry in sorted(last_used, key=lambda x: last_used[x]):
+        if total <= max_size:
+            break
+        if keep_after is not None and last_used[entry] >= keep_after:
+            break
+        logger.info("Evict {} from cache", entry)
+        if os.path.isdir(entry):
+            shutil.rmtree(entry, ignore_errors=True)
+        else:
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(entry)
+        total -= sizes[entry]
+        removed.append(entry)
+    return removed
+
+
+def materialise(source, target, link="hardlink"):
+    """Make a cached file available at a target path.
+
+    Args:
+        source (str): Cached file
+        target (str): Target file
+        link (str, optional): "hardlink" or "copy". Hard links fall back to
+                              a copy across file systems. Defaults to "hardlink".
+
+    Raises:
+        NotImplementedError: Unknown link type
+
+    """
+    if os.path.lexists(target):
+        os.unlink(target)
+    if link == "hardlink":
+        try:
+            os.link(source, target)
+        except OSError:
+            shutil.copy2(source, target)
+    elif link == "copy":
+        shutil.copy2(source, target)
+    else:
+        raise NotImplementedError(link)
+
+
+class StaticDataCache:
+    """Content addressed cache for static data shared between experiments.
+
+    Each entry is a directory named from a hash of everything the content
+    depends on. The time stamp of the entry is updated when it is used and
+    the least recently used entries are evicted when the cache grows beyond
+    max_size.
+
+    """
+
+    def __init__(self, cache_dir, max_size=None, link="hardlink"):
+        """Construct the cache.
+
+        Args:
+            cache_dir (str): Cache directory.
+            max_size (int, optional): Maximum size in bytes. Defaults to None.
+            link (str, optional): How files are materialised. Defaults to "hardlink".
+
+        Raises:
+            NotImplementedError: Unknown link type
+
+        """
+        # Symbolic links would dangle in the experiments when entries are evicted
+        if link not in ("hardlink", "copy"):
+            raise NotImplementedError(link)
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.link = link
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def key(settings):
+        """Get the cache key for a set of settings.
+
+        Args:
+            settings (dict): Everything the cached content depends on.
+
+        Returns:
+            str: Cache key
+
+        """
+        return hash_key(settings)
+
+    def digest(self, fname):
+        """Get a hash of the content of a file.
+
+        The hash is remembered for the path, modification time and size of
+        the file, so large input shared by experiments is only read once.
+
+        Args:
+            fname (str): File
+
+        Returns:
+            str: Hex digest
+
+        """
+        memo = f"{self.cache_dir}/digests/{hash_key(input_signature([fname]))}"
+        try:
+            with open(memo, mode="r", encoding="utf-8") as fhandler:
+                return fhandler.read()
+        except FileNotFoundError:
+            pass
+        digest = file_digest(fname)
+        os.makedirs(os.path.dirname(memo), exist_ok=True)
+        tmp_memo = f"{memo}.tmp.{os.getpid()}"
+        with open(tmp_memo, mode="w", encoding="utf-8") as fhandler:
+            fhandler.write(digest)
+        os.replace(tmp_memo, memo)
+        return digest
+
+    def entry(self, key):
+        """Get the directory of a cache entry.
+
+        Args:
+            key (str): Cache key
+
+        Returns:
+            str: Entry directory
+
+        """
+        return f"{self.cache_dir}/{key[:2]}/{key}"
+
+    def entries(self):
+        """List all cache entries.
+
+        Returns:
+            list: Entry directories
+
+        """
+        entries = []
+        for prefix in os.listdir(self.cache_dir):
+            prefix_dir = f"{self.cache_dir}/{prefix}"
+            if len(prefix) == 2 and os.path.isdir(prefix_dir):
+                entries += [
+                    f"{prefix_dir}/{entry}"
+                    for entry in os.listdir(prefix_dir)
+                    if ".tmp." not in entry
+                ]
+        return entries
+
+    def fetch(self, key, targets):
+        """Materialise cached files.
+
+        Args:
+            key (str): Cache key
+            targets (list): Target files. The cached files have the same basenames.
+
+        Returns:
+            bool: True if all targets were found in the cache.
+
+        """
+        entry = self.entry(key)
+        sources = [f"{entry}/{os.path.basename(target)}" for target in targets]
+        if not all(os.path.exists(source) for source in sources):
+            logger.debug("Cache miss for {}", key)
+            return False
+
+        for source, target in zip(sources, targets):
+            logger.info("Use cached {} for {}", source, target)
+            materialise(source, target, link=self.link)
+        now = time.time()
+        os.utime(entry, (now, now))
+        return True
+
+    def store(self, key, files):
+        """Store files in the cache.
+
+        Args:
+            key (str): Cache key
+            files (list): Files to store
+
+        """
+        entry = self.entry(key)
+        if os.path.exists(entry):
+            return
+
+        tmp_entry = f"{entry}.tmp.{os.getpid()}"
+        os.makedirs(tmp_entry, exist_ok=True)
+        for fname in files:
+            logger.info("Store {} in cache {}", fname, entry)
+            materialise(fname, f"{tmp_entry}/{os.path.basename(fname)}", link=self.link)
+        try:
+            os.rename(tmp_entry, entry)
+        except OSError:
+            # Stored by somebody else in the meantime
+            shutil.rmtree(tmp_entry, ignore_errors=True)
+        if self.max_size is not None:
+            evict_lru(self.entries(), self.max_size)
+
+
+def get_static_data_cache(config, platform):
+    """Get the static data cache if configured.
+
+    Args:
+        config (ParsedConfig): Configuration
+        platform (Platform): Platform used for substitution
+
+    Returns:
+        StaticDataCache: The cache or None if not configured.
+
+    """
+    try:
+        cache_dir = config["pgd.cache.dir"]
+    except KeyError:
+        cache_dir = ""
+    if cache_dir is None or cache_dir == "":
+        return None
+    cache_dir = platform.substitute(cache_dir)
+
+    try:
+        max_size = config["pgd.cache.max_size"]
+    except KeyError:
+        max_size = None
+    if max_size is not None:
+        max_size = int(float(max_size) * 1024**3)
+    try:
+        link = config["pgd.cache.link"]
+    except KeyError:
+        link = "hardlink"
+    return StaticDataCache(cache_dir, max_size=max_size, link=link)
+
+
+def is_remote(pattern):
+    """Check if a file pattern is a URL.
+
+    Args:
+        pattern (str): File pattern
+
+    Returns:
+        bool: True if the pattern is a URL
+
+    """
+    return urllib.parse.urlparse(pattern).scheme in REMOTE_SCHEMES
+
+
+def bounding_box_window(lons, lats, geo, halo=2):
+    """Find the index window of an input grid covering a domain.
+
+    Args:
+        lons (np.ndarray): 2D longitudes of the input grid
+        lats (np.ndarray): 2D latitudes of the input grid
+        geo (Geo): Domain geometry
+        halo (int, optional): Extra grid points on each side. Defaults to 2.
+
+    Returns:
+        tuple: Start and stop of the rows and columns, or None if the input
+               does not cover the domain
+
+    """
+    with np.errstate(invalid="ignore"):
+        inside = (
+            (lons >= np.min(geo.lons))
+            & (lons <= np.max(geo.lons))
+            & (lats >= np.min(geo.lats))
+            & (lats <= np.max(geo.lats))
+        )
+    rows, cols = np.nonzero(inside)
+    if rows.size == 0:
+        return None
+    return (
+        (max(int(rows.min()) - halo, 0), min(int(rows.max()) + halo + 1, lons.shape[0])),
+        (max(int(cols.min()) - halo, 0), min(int(cols.max()) + halo + 1, lons.shape[1])),
+    )
+
+
+def copy_netcdf(source, target, window=None):
+    """Copy a netCDF file or OPeNDAP URL, optionally a window of it.
+
+    Args:
+        source (str): File or URL
+        target (str): Output file
+        window (dict, optional): Start and stop for dimensions. Defaults to None.
+
+    """
+    import netCDF4
+
+    if window is None:
+        window = {}
+    with netCDF4.Dataset(source, "r") as src, netCDF4.Dataset(
+        target, "w", format="NETCDF4"
+    ) as dst:
+        src.set_auto_maskandscale(False)
+        dst.set_auto_maskandscale(False)
+        dst.setncatts(src.__dict__)
+        for name, dim in src.dimensions.items():
+            size = None if dim.isunlimited() else len(dim)
+            if name in window:
+                size = window[name][1] - window[name][0]
+            dst.createDimension(name, size)
+        for name, var in src.variables.items():
+            attrs = var.__dict__.copy()
+            fill_value = attrs.pop("_FillValue", None)
+            out = dst.createVariable(
+                name, var.datatype, var.dimensions, fill_value=fill_value, zlib=True
+            )
+            out.setncatts(attrs)
+            if var.ndim == 0:
+                out.assignValue(var.getValue())
+            else:
+                index = tuple(
+                    slice(*window[dim]) if dim in window else slice(None)
+                    for dim in var.dimensions
+                )
+                out[...] = var[index]
+
+
+class ForcingInputCache:
+    """Read-through cache for remote forcing input.
+
+    Remote files are stored below the cache directory with the host and path
+    of their URL, so the input pattern is resolved against the cache by
+    replacing the URL prefix. OPeNDAP input is stored as the window covering
+    the domain if a geometry is given. The time stamp of a file is updated
+    when it is used and the least recently used files are evicted when the
+    cache grows beyond max_size.
+
+    """
+
+    def __init__(self, cache_dir, pattern, geo=None, max_size=None, workers=4):
+        """Construct the cache.
+
+        Args:
+            cache_dir (str): Cache directory.
+            pattern (str): Input URL pattern.
+            geo (Geo, optional): Domain for the OPeNDAP window. Defaults to None.
+            max_size (int, optional): Maximum size in bytes. Defaults to None.
+            workers (int, optional): Concurrent downloads. Defaults to 4.
+
+        """
+        self.cache_dir = cache_dir
+        self.pattern = pattern
+        self.max_size = max_size
+        self.workers = workers
+        self.opendap = "/dodsC/" in urllib.parse.urlparse(pattern).path
+        settings = {"pattern": pattern}
+        self.geo = None
+        if self.opendap and geo is not None:
+            self.geo = geo
+            settings.update({"domain": geo.json})
+        self.prefix = f"{cache_dir}/{hash_key(settings)[:16]}"
+        self.window_file = f"{self.prefix}/window.json"
+        self.window_lock = threading.Lock()
+        self.executor = None
+        self.prefetched = []
+        self.lease_dir = f"{cache_dir}/{LEASE_DIR}"
+        self.lease = None
+        os.makedirs(self.prefix, exist_ok=True)
+
+    def local_file(self, url):
+        """Get the cached file of a URL or pattern.
+
+        Args:
+            url (str): URL or URL pattern
+
+        Returns:
+            str: Cached file or pattern
+
+        """
+        parsed = urllib.parse.urlparse(url)
+        return f"{self.prefix}/{parsed.netloc}{parsed.path}"
+
+    def local_pattern(self):
+        """Get the input pattern resolved against the cache.
+
+        Returns:
+            str: Pattern of the cached files
+
+        """
+        return self.local_file(self.pattern)
+
+    def window(self, url):
+        """Get the window of the OPeNDAP input covering the domain.
+
+        The window is found from the first file and stored with the cache.
+
+        Args:
+            url (str): OPeNDAP URL
+
+        Returns:
+            dict: Start and stop for the dimensions
+
+        """
+        import netCDF4
+
+        with self.window_lock:
+            if os.path.exists(self.window_file):
+                with open(self.window_file, mode="r", encoding="utf-8") as fhandler:
+                    return json.load(fhandler)
+            window = {}
+            with netCDF4.Dataset(url, "r") as ncf:
+                coords = {}
+                for var in ncf.variables.values():
+                    standard_name = getattr(var, "standard_name", None)
+                    if standard_name in ("longitude", "latitude") and var.ndim == 2:
+                        coords[standard_name] = var
+                if len(coords) == 2:
+                    lon_var = coords["longitude"]
+                    indices = bounding_box_window(
+                        np.asarray(lon_var[:]),
+                        np.asarray(coords["latitude"][:]),
+                        self.geo,
+                    )
+                    if indices is not None:
+                        window = dict(zip(lon_var.dimensions, indices))
+                else:
+                    logger.warning("No 2D coordinates in {}. Fetch all", url)
+            tmp_file = f"{self.window_file}.tmp.{os.getpid()}"
+            with open(tmp_file, mode="w", encoding="utf-8") as fhandler:
+                json.dump(window, fhandler)
+            os.replace(tmp_file, self.window_file)
+            logger.info("Input window for the domain: {}", window)
+            return window
+
+    def fetch(self, url):
+        """Get the cached file of a URL, fetching it if needed.
+
+        Args:
+            url (str): URL
+
+        Returns:
+            str: Cached file
+
+        """
+        target = self.local_file(url)
+        now = time.time()
+        try:
+            os.utime(target, (now, now))
+        except FileNotFoundError:
+            pass
+        else:
+            return target
+
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        tmp_target = f"{target}.tmp.{os.getpid()}.{threading.get_ident()}"
+        logger.info("Fetch {}", url)
+        try:
+            if self.opendap:
+                window = None
+                if self.geo is not None:
+                    window = self.window(url)
+                copy_netcdf(url, tmp_target, window=window)
+            else:
+                with urllib.request.urlopen(url) as response, open(  # noqa: S310
+                    tmp_target, mode="wb"
+                ) as fhandler:
+                    shutil.copyfileobj(response, fhandler, 1024**2)
+            os.replace(tmp_target, target)
+        finally:
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(tmp_target)
+        return target
+
+    def fetch_all(self, urls, required=True):
+        """Fetch URLs concurrently.
+
+        Args:
+            urls (list): URLs
+            required (bool, optional): Raise if a URL could not be fetched.
+                                       Defaults to True.
+
+        Raises:
+            RuntimeError: A required URL could not be fetched
+
+        """
+        failed = []
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {executor.submit(self.fetch, url): url for url in urls}
+            for future, url in futures.items():
+                exc = future.exception()
+                if exc is not None:
+                    logger.warning("Could not fetch {}: {}", url, exc)
+                    failed.append(url)
+        if required and failed:
+            raise RuntimeError(f"Could not fetch forcing input {failed}")
+
+    def prefetch(self, urls):
+        """Start fetching URLs in the background.
+
+        Args:
+            urls (list): URLs
+
+        """
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.workers)
+        for url in urls:
+            self.prefetched.append((url, self.executor.submit(self.fetch, url)))
+
+    def wait(self):
+        """Wait for the prefetched URLs."""
+        if self.executor is None:
+            return
+        wait([future for __, future in self.prefetched])
+        for url, future in self.prefetched:
+            if future.exception() is not None:
+                logger.warning("Could not prefetch {}: {}", url, future.exception())
+        self.executor.shutdown()
+        self.executor = None
+        self.prefetched = []
+
+    def entries(self):
+        """List all cached files.
+
+        Returns:
+            list: Cached files
+
+        """
+        entries = []
+        for root, dirs, files in os.walk(self.cache_dir):
+            if root == self.cache_dir and LEASE_DIR in dirs:
+                dirs.remove(LEASE_DIR)
+            entries += [
+                os.path.join(root, fname)
+                for fname in files
+                if ".tmp." not in fname and fname != "window.json"
+            ]
+        return entries
+
+    def acquire(self):
+        """Take a lease protecting the files this task fetches from eviction."""
+        os.makedirs(self.lease_dir, exist_ok=True)
+        self.lease = f"{self.lease_dir}/{socket.gethostname()}.{os.getpid()}"
+        with open(self.lease, mode="w", encoding="utf-8"):
+            pass
+
+    def release(self):
+        """Release the lease of this task."""
+        if self.lease is not None:
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(self.lease)
+            self.lease = None
+
+    def leased_since(self):
+        """Get the start of the oldest lease of the running tasks.
+
+        Files used since then may still be read by a running task.
+
+        Returns:
+            float: Time or None if no task holds a lease
+
+        """
+        if not os.path.isdir(self.lease_dir):
+            return None
+        now = time.time()
+        starts = []
+        for fname in os.listdir(self.lease_dir):
+            try:
+                start = os.stat(f"{self.lease_dir}/{fname}").st_mtime
+            except FileNotFoundError:
+                continue
+            # Left behind by a task that did not finish
+            if now - start < LEASE_TIMEOUT:
+                starts.append(start)
+        if len(starts) == 0:
+            return None
+        return min(starts)
+
+    def evict(self):
+        """Evict the least recently used files if the cache is too large.
+
+        Files used since the oldest lease of the running tasks are kept.
+
+        Returns:
+            list: Removed files
+
+        """
+        if self.max_size is None:
+            return []
+        return evict_lru(self.entries(), self.max_size, keep_after=self.leased_since())
+
+
+def get_forcing_input_cache(config, platform, pattern, geo=None):
+    """Get the forcing input cache if configured.
+
+    Args:
+        config (ParsedConfig): Configuration
+        platform (Platform): Platform used for substitution
+        pattern (str): Input URL pattern
+        geo (Geo, optional): Domain geometry. Defaults to None.
+
+    Returns:
+        ForcingInputCache: The cache or None if not configured or the input is
+                           not remote.
+
+    """
+    try:
+        cache_dir = config["forcing.input_cache.dir"]
+    except KeyError:
+        cache_dir = ""
+    if cache_dir is None or cache_dir == "" or not is_remote(pattern):
+        return None
+    cache_dir = platform.substitute(cache_dir)
+
+    try:
+        max_size = config["forcing.input_cache.max_size"]
+    except KeyError:
+        max_size = None
+    if max_size is not None:
+        max_size = int(float(max_size) * 1024**3)
+    try:
+        workers = int(config["forcing.input_cache.workers"])
+    except KeyError:
+        workers = 4
+    try:
+        subset = config["forcing.input_cache.subset"]
+    except KeyError:
+        subset = True
+    if not subset:
+        geo = None
+    return ForcingInputCache(
+        cache_dir, pattern, geo=geo, max_size=max_size, workers=workers
+    )
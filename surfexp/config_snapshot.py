@@ -0,0 +1,101 @@
+"""Validated configuration snapshots for fast task startup."""
+import contextlib
+import hashlib
+import os
+import pickle
+import time
+from importlib.metadata import PackageNotFoundError, version
+
+from deode.config_parser import ConfigParserDefaults, ParsedConfig
+from deode.logs import logger
+
+# Configs loaded in this process by snapshot file
+_LOADED_CONFIGS = {}
+
+
+def snapshot_filename(config_file):
+    """Get the snapshot file of a config file.
+
+    The name contains a hash of the content of the config file and the
+    versions of deode and surfexp, so a changed config or a new installation
+    never uses an old snapshot.
+
+    Args:
+        config_file (str): Config file
+
+    Returns:
+        str: Snapshot file
+
+    """
+    digest = hashlib.sha256()
+    with open(config_file, mode="rb") as fhandler:
+        digest.update(fhandler.read())
+    for package in ("deode", "surfexp"):
+        with contextlib.suppress(PackageNotFoundError):
+            digest.update(version(package).encode("utf-8"))
+    return f"{config_file}.{digest.hexdigest()[:16]}.pickle"
+
+
+def write_config_snapshot(config, snapshot):
+    """Store a parsed config.
+
+    Args:
+        config (ParsedConfig): Parsed and validated config
+        snapshot (str): Snapshot file
+
+    """
+    tmp_snapshot = f"{snapshot}.tmp.{os.getpid()}"
+    try:
+        with open(tmp_snapshot, mode="wb") as fhandler:
+            pickle.dump(config, fhandler, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_snapshot, snapshot)
+    except (OSError, pickle.PicklingError, TypeError, AttributeError) as exc:
+        logger.warning("Could not store config snapshot {}: {}", snapshot, exc)
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(tmp_snapshot)
+
+
+def load_config(config_file):
+    """Load a config file through its snapshot.
+
+    The config is parsed and validated against the JSON schema only if no
+    snapshot exists, and the result is then stored as the snapshot. A config
+    already loaded in this process, e.g. by a task worker, is reused.
+
+    Args:
+        config_file (str): Config file
+
+    Returns:
+        ParsedConfig: Parsed and validated config
+
+    """
+    start = time.time()
+    snapshot = snapshot_filename(config_file)
+    if snapshot in _LOADED_CONFIGS:
+        return _LOADED_CONFIGS[snapshot]
+    if os.path.exists(snapshot):
+        try:
+            with open(snapshot, mode="rb") as fhandler:
+                config = pickle.load(fhandler)  # noqa: S301
+        except (
+            OSError,
+            EOFError,
+            pickle.UnpicklingError,
+            AttributeError,
+            ImportError,
+        ) as exc:
+            logger.warning("Could not read config snapshot {}: {}", snapshot, exc)
+        else:
+            logger.info(
+                "Loaded config snapshot {} in {:.3f} s", snapshot, time.time() - start
+            )
+            _LOADED_CONFIGS[snapshot] = config
+            return config
+
+    config = ParsedConfig.from_file(
+        config_file, json_schema=ConfigParserDefaults.MAIN_CONFIG_JSON_SCHEMA
+    )
+    logger.info("Parsed and validated {} in {:.3f} s", config_file, time.time() - start)
+    write_config_snapshot(config, snapshot)
+    _LOADED_CONFIGS[snapshot] = config
+    return config
@@ -0,0 +1,122 @@
+"""Lazily evaluated task context."""
+import copy
+import json
+from functools import cached_property, lru_cache
+
+from deode.logs import logger
+from pysurfex.configuration import Configuration
+from pysurfex.geo import ConfProj
+from pysurfex.platform_deps import SystemFilePaths
+
+from surfexp.experiment import get_nnco
+
+
+@lru_cache(maxsize=8)
+def conf_proj_geometry(conf_proj):
+    """Create a geometry once per process.
+
+    Args:
+        conf_proj (str): JSON encoded conf proj namelist settings
+
+    Returns:
+        ConfProj: Geometry
+
+    """
+    return ConfProj(json.loads(conf_proj))
+
+
+class TaskContext:
+    """Settings derived from the configuration of a task.
+
+    Each setting is computed on first access and then kept, so a task only
+    pays for the settings it uses.
+
+    """
+
+    def __init__(self, config, platform, basetime):
+        """Construct the context.
+
+        Args:
+            config (ParsedConfig): Configuration
+            platform (Platform): Platform used for substitution
+            basetime (datetime.datetime): Base time of the task
+
+        """
+        self.config = config
+        self.platform = platform
+        self.basetime = basetime
+
+    @cached_property
+    def geo(self):
+        """Domain geometry.
+
+        Returns:
+            ConfProj: Geometry
+
+        """
+        conf_proj = {
+            "nam_conf_proj_grid": {
+                "nimax": self.config["domain.nimax"],
+                "njmax": self.config["domain.njmax"],
+                "xloncen": self.config["domain.xloncen"],
+                "xlatcen": self.config["domain.xlatcen"],
+                "xdx": self.config["domain.xdx"],
+                "xdy": self.config["domain.xdy"],
+                "ilone": self.config["domain.ilone"],
+                "ilate": self.config["domain.ilate"],
+            },
+            "nam_conf_proj": {
+                "xlon0": self.config["domain.xlon0"],
+                "xlat0": self.config["domain.xlat0"],
+            },
+        }
+        return conf_proj_geometry(json.dumps(conf_proj, sort_keys=True))
+
+    @cached_property
+    def obs_types(self):
+        """Observation types.
+
+        Returns:
+            list: Observation types
+
+        """
+        return self.config["SURFEX.ASSIM.OBS.COBS_M"]
+
+    @cached_property
+    def nnco(self):
+        """Active observations for the base time.
+
+        Returns:
+            list: List with either 0 or 1
+
+        """
+        return get_nnco(self.config, basetime=self.basetime)
+
+    @cached_property
+    def sfx_config(self):
+        """SURFEX configuration with the active observations for the base time.
+
+        Returns:
+            Configuration: pysurfex configuration
+
+        """
+        cfg = copy.deepcopy(self.config["SURFEX"].dict())
+        cfg.setdefault("ASSIM", {}).setdefault("OBS", {}).update({"NNCO": self.nnco})
+        return Configuration({"SURFEX": cfg})
+
+    @cached_property
+    def exp_file_paths(self):
+        """System and platform paths after substitution.
+
+        Returns:
+            SystemFilePaths: Paths
+
+        """
+        exp_file_paths = {}
+        for section in ("system", "platform"):
+            for key, val in self.config[section].dict().items():
+                exp_file_paths.update(
+                    {self.platform.substitute(key): self.platform.substitute(val)}
+                )
+        logger.debug("exp_file_paths: {}", exp_file_paths)
+        return SystemFilePaths(exp_file_paths)
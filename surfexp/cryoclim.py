@@ -0,0 +1,295 @@
+"""Windowed CryoClim snow pseudo-observations."""
+import json
+import os
+
+import netCDF4
+import numpy as np
+from deode.logs import logger
+from pysurfex.interpolation import gridpos2points, inside_grid
+
+# Neighbourhood radii in grid points used by pysurfex
+CRYO_RADIUS = 2
+FG_SNOW_RADIUS = 3
+
+
+def neighbourhood_sum(field, radius):
+    """Sum up the points in a square neighbourhood.
+
+    Points outside the field do not contribute.
+
+    Args:
+        field (np.ndarray): 2D field
+        radius (int): Radius in grid points
+
+    Returns:
+        np.ndarray: Neighbourhood sums
+
+    """
+    pad = (radius + 1, radius)
+    padded = np.pad(np.asarray(field, dtype=np.float64), (pad, pad))
+    csum = padded.cumsum(axis=0).cumsum(axis=1)
+    size = 2 * radius + 1
+    return (
+        csum[size:, size:]
+        - csum[:-size, size:]
+        - csum[size:, :-size]
+        + csum[:-size, :-size]
+    )
+
+
+def domain_window(ncf, geo, step, halo, coarse=64):
+    """Find the index window of a CryoClim grid covering a domain.
+
+    The coordinates are first read on a coarse subgrid. The window is the
+    bounding box of the coarse points close to the domain, extended with the
+    coarse spacing and the halo. The start is aligned to step, so the thinned
+    points are the same as for the full grid.
+
+    Args:
+        ncf (netCDF4.Dataset): CryoClim file
+        geo (Geo): Domain geometry
+        step (int): Thinning step
+        halo (int): Halo in grid points
+        coarse (int, optional): Stride of the coarse subgrid. Defaults to 64.
+
+    Returns:
+        tuple: Row and column slices
+
+    """
+    n_x, n_y = ncf["lon"].shape
+    stride = max(1, min(coarse, n_x // 4, n_y // 4))
+    c_lons = np.ma.filled(ncf["lon"][::stride, ::stride].astype(np.float64), np.nan)
+    c_lats = np.ma.filled(ncf["lat"][::stride, ::stride].astype(np.float64), np.nan)
+    c_lons[np.abs(c_lons) > 180.0] = np.nan
+    c_lats[np.abs(c_lats) > 90.0] = np.nan
+
+    # Largest distance between coarse points in degrees
+    with np.errstate(invalid="ignore"):
+        d_lat = max(
+            np.nanmax(np.abs(np.diff(c_lats, axis=0)), initial=0.0),
+            np.nanmax(np.abs(np.diff(c_lats, axis=1)), initial=0.0),
+        )
+        d_lon = max(
+            np.nanmax(
+                np.abs((np.diff(c_lons, axis=0) + 180.0) % 360.0 - 180.0), initial=0.0
+            ),
+            np.nanmax(
+                np.abs((np.diff(c_lons, axis=1) + 180.0) % 360.0 - 180.0), initial=0.0
+            ),
+        )
+
+    lons = np.asarray(geo.lons)
+    lats = np.asarray(geo.lats)
+    with np.errstate(invalid="ignore"):
+        inside = (c_lats >= np.min(lats) - d_lat) & (c_lats <= np.max(lats) + d_lat)
+        lon_min = np.min(lons) - d_lon
+        lon_max = np.max(lons) + d_lon
+        if lon_max - lon_min < 360.0:
+            rel_lons = (c_lons - lon_min) % 360.0
+            inside = inside & (rel_lons <= lon_max - lon_min)
+    rows, cols = np.nonzero(inside)
+    if rows.size == 0:
+        return slice(0, 0), slice(0, 0)
+
+    margin = stride + halo
+    i_0 = max(rows.min() * stride - margin, 0)
+    j_0 = max(cols.min() * stride - margin, 0)
+    i_0 = i_0 - i_0 % step
+    j_0 = j_0 - j_0 % step
+    # pysurfex only uses int(n / step) points in each direction
+    i_1 = min(rows.max() * stride + margin + 1, (n_x // step) * step)
+    j_1 = min(cols.max() * stride + margin + 1, (n_y // step) * step)
+    return slice(i_0, i_1), slice(j_0, j_1)
+
+
+def read_cryoclim_window(filenames, geo, step, cryo_varname="classed_value_c"):
+    """Read the part of a CryoClim product covering a domain.
+
+    Args:
+        filenames (list): CryoClim files. The first existing file is used.
+        geo (Geo): Domain geometry
+        step (int): Thinning step
+        cryo_varname (str, optional): Variable name in cryo file.
+                                      Defaults to "classed_value_c"
+
+    Raises:
+        RuntimeError: No files were read properly
+
+    Returns:
+        tuple: Longitudes, latitudes and snow class of the window
+
+    """
+    for filename in filenames:
+        if not os.path.exists(filename):
+            logger.warning("File {} does not exist", filename)
+            continue
+        logger.info("Reading: {}", filename)
+        with netCDF4.Dataset(filename, "r") as ncf:
+            rows, cols = domain_window(ncf, geo, step, CRYO_RADIUS)
+            logger.info(
+                "Read window {}:{}, {}:{} of {}",
+                rows.start,
+                rows.stop,
+                cols.start,
+                cols.stop,
+                ncf["lon"].shape,
+            )
+            lons = np.ma.filled(ncf["lon"][rows, cols].astype(np.float64), np.nan)
+            lats = np.ma.filled(ncf["lat"][rows, cols].astype(np.float64), np.nan)
+            snow_class = np.ma.filled(ncf[cryo_varname][0, rows, cols], 0)
+        return lons, lats, snow_class
+    raise RuntimeError("No files were read properly")
+
+
+def cryoclim_pseudo_obs(
+    snow_class,
+    lons,
+    lats,
+    step,
+    fg_geo,
+    snow_fg,
+    gelevs_fg,
+    fg_threshold=0.4,
+    new_snow_depth=0.1,
+    glaf=None,
+    laf_threshold=0.1,
+):
+    """Create snow pseudo-observations from a CryoClim window.
+
+    Vectorized version of snow_pseudo_obs_cryoclim in pysurfex with
+    neighbourhood checks and without permanent snow and slope.
+
+    Args:
+        snow_class (np.ndarray): Snow class in the window
+        lons (np.ndarray): Longitudes in the window
+        lats (np.ndarray): Latitudes in the window
+        step (int): Thinning step. The window must start at a multiple of step.
+        fg_geo (Geo): Geometry of the first guess
+        snow_fg (np.ndarray): First guess snow depth
+        gelevs_fg (np.ndarray): First guess elevations
+        fg_threshold (float, optional): First guess threshold. Defaults to 0.4.
+        new_snow_depth (float, optional): New snow depth. Defaults to 0.1.
+        glaf (np.ndarray, optional): Land area fraction. Defaults to None.
+        laf_threshold (float, optional): Threshold to remove points.
+                                         Defaults to 0.1.
+
+    Returns:
+        dict: lon, lat, elev and value of the accepted pseudo-observations
+
+    """
+    snow_class = np.asarray(snow_class)
+    snow_cryo = neighbourhood_sum(snow_class == 2, CRYO_RADIUS)
+    # Same class mapping as pysurfex: 4, -1 and -4 count, other classes >= 0 not
+    extra = np.where(
+        np.isin(snow_class, (4, -1, -4)), 1, np.where(snow_class >= 0, 0, snow_class)
+    )
+    extra = neighbourhood_sum(extra, CRYO_RADIUS)
+
+    t_class = snow_class[::step, ::step]
+    t_lons = lons[::step, ::step]
+    t_lats = lats[::step, ::step]
+    with np.errstate(invalid="ignore"):
+        candidate = (
+            ((t_class == 1) | (t_class == 2))
+            & (t_lats < 90.0)
+            & (t_lats > -90.0)
+            & (t_lons < 180.0)
+            & (t_lons > -180.0)
+        )
+    res_lons = t_lons[candidate]
+    res_lats = t_lats[candidate]
+    p_class = t_class[candidate]
+    p_neighbours = (snow_cryo + extra)[::step, ::step][candidate]
+    logger.info("Candidate pseudo-observations: {}", res_lons.size)
+    if res_lons.size == 0:
+        return {"lon": res_lons, "lat": res_lats, "elev": res_lons, "value": res_lons}
+
+    p_fg = gridpos2points(fg_geo.lons, fg_geo.lats, res_lons, res_lats, snow_fg)
+    p_elevs = gridpos2points(fg_geo.lons, fg_geo.lats, res_lons, res_lats, gelevs_fg)
+    with np.errstate(invalid="ignore"):
+        fg_has_snow = np.asarray(snow_fg) > 0
+    p_having_snow = gridpos2points(
+        fg_geo.lons,
+        fg_geo.lats,
+        res_lons,
+        res_lats,
+        neighbourhood_sum(fg_has_snow, FG_SNOW_RADIUS),
+        operator="nearest",
+    )
+    in_grid = np.asarray(
+        inside_grid(
+            np.asarray(fg_geo.lons),
+            np.asarray(fg_geo.lats),
+            res_lons,
+            res_lats,
+            distance=2500.0,
+        ),
+        dtype=bool,
+    )
+
+    with np.errstate(invalid="ignore"):
+        use = ~np.isnan(p_fg) & in_grid
+        if glaf is not None:
+            p_laf = gridpos2points(fg_geo.lons, fg_geo.lats, res_lons, res_lats, glaf)
+            use = use & ~(p_laf < laf_threshold)
+
+        # Snow
+        below_threshold = np.ones(p_fg.shape, dtype=bool)
+        if fg_threshold is not None:
+            below_threshold = p_fg <= fg_threshold
+        snow_value = np.where(
+            p_fg > 0, np.where(below_threshold, p_fg, np.nan), new_snow_depth
+        )
+        check = (p_having_snow < (FG_SNOW_RADIUS * 2 + 1) ** 2) | (
+            p_neighbours < (CRYO_RADIUS * 2 + 1) ** 2
+        )
+        snow_value = np.where(check, snow_value, np.nan)
+
+        # No snow
+        no_snow_value = np.where((p_having_snow > 0) | (p_fg >= 0.0), 0.0, np.nan)
+
+        values = np.where(p_class == 2, snow_value, no_snow_value)
+        use = use & ~np.isnan(values)
+
+    logger.info("Pseudo-observations created: {}", np.count_nonzero(use))
+    return {
+        "lon": res_lons[use],
+        "lat": res_lats[use],
+        "elev": np.asarray(p_elevs)[use],
+        "value": values[use],
+    }
+
+
+def write_pseudo_obs_json(filename, validtime, columns, varname="totalSnowDepth"):
+    """Write pseudo-observations in the json format of pysurfex.
+
+    Args:
+        filename (str): Output file
+        validtime (datetime.datetime): Observation time
+        columns (dict): lon, lat, elev and value of the observations
+        varname (str, optional): Variable name. Defaults to "totalSnowDepth".
+
+    """
+    obstime = validtime.strftime("%Y%m%d%H%M%S")
+    data = {
+        i: {
+            "obstime": obstime,
+            "varname": varname,
+            "lon": lon,
+            "lat": lat,
+            "stid": "NA",
+            "elev": elev,
+            "value": value,
+            "sigmao": 1.0,
+        }
+        for i, (lon, lat, elev, value) in enumerate(
+            zip(
+                columns["lon"].tolist(),
+                columns["lat"].tolist(),
+                columns["elev"].tolist(),
+                columns["value"].tolist(),
+            )
+        )
+    }
+    with open(filename, mode="w", encoding="utf-8") as file_handler:
+        json.dump(data, file_handler)
@@ -0,0 +1,114 @@
+"""Cached loading of YAML/JSON definition files."""
+import contextlib
+import copy
+import hashlib
+import json
+import os
+import pickle
+
+import yaml
+from deode.logs import logger
+
+# Parsed definitions for this process, keyed by real path
+_DEFINITIONS = {}
+
+
+def file_signature(filename):
+    """Get a signature that changes when the file changes.
+
+    Args:
+        filename (str): File name
+
+    Returns:
+        tuple: Modification time in ns and size
+
+    """
+    stat = os.stat(filename)
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def parse_definitions(filename):
+    """Parse a YAML or JSON file.
+
+    Args:
+        filename (str): File name. Files ending with .json are read as JSON,
+                        everything else as YAML.
+
+    Returns:
+        any: Parsed content
+
+    """
+    with open(filename, mode="r", encoding="utf-8") as fhandler:
+        if filename.endswith(".json"):
+            return json.load(fhandler)
+        return yaml.safe_load(fhandler)
+
+
+def pickle_file(filename, cache_dir):
+    """Get the name of the pickled form of a definition file.
+
+    Args:
+        filename (str): Real path of definition file
+        cache_dir (str): Cache directory
+
+    Returns:
+        str: Pickle file name
+
+    """
+    digest = hashlib.sha256(filename.encode("utf-8")).hexdigest()[:16]
+    return f"{cache_dir}/{os.path.basename(filename)}.{digest}.pickle"
+
+
+def load_definitions(filename, cache_dir=None):
+    """Load definitions from a YAML or JSON file.
+
+    The parsed content is kept for the lifetime of the process and is re-read
+    if the modification time or size of the file changes. If cache_dir is
+    set, a pickled form is also stored on disk so a new process does not
+    need to parse the file again.
+
+    Args:
+        filename (str): File name
+        cache_dir (str, optional): Directory for pickled definitions.
+                                   Defaults to None.
+
+    Returns:
+        any: A copy of the parsed content which the caller is free to modify.
+
+    """
+    filename = os.path.realpath(filename)
+    signature = file_signature(filename)
+
+    cached = _DEFINITIONS.get(filename)
+    if cached is not None and cached[0] == signature:
+        logger.debug("Use definitions for {} from memory", filename)
+        return copy.deepcopy(cached[1])
+
+    data = None
+    pickled = None
+    if cache_dir is not None and cache_dir != "":
+        pickled = pickle_file(filename, cache_dir)
+        if os.path.exists(pickled):
+            with open(pickled, mode="rb") as fhandler:
+                pickled_signature, pickled_data = pickle.load(fhandler)  # noqa: S301
+            if pickled_signature == signature:
+                logger.debug("Use pickled definitions {}", pickled)
+                data = pickled_data
+
+    if data is None:
+        logger.debug("Parse definitions {}", filename)
+        data = parse_definitions(filename)
+        if pickled is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp_pickled = f"{pickled}.tmp.{os.getpid()}"
+            try:
+                with open(tmp_pickled, mode="wb") as fhandler:
+                    pickle.dump((signature, data), fhandler)
+                os.replace(tmp_pickled, pickled)
+            except OSError as exc:
+                logger.warning("Could not store pickled definitions {}: {}", pickled, exc)
+                with contextlib.suppress(FileNotFoundError):
+                    os.unlink(tmp_pickled)
+
+    _DEFINITIONS[filename] = (signature, data)
+    return copy.deepcopy(data)
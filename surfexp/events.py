@@ -0,0 +1,43 @@
+"""Events set by running tasks, e.g. to start the tasks triggered on them."""
+from deode.logs import logger
+
+# Sets an event of the running task. Installed by the template running the task.
+_EVENT_HANDLER = {"handler": None}
+
+
+def forcing_event(index):
+    """Get the event set when the forcing of a cycle in a batch is ready.
+
+    Args:
+        index (int): Index of the cycle in the forcing batch
+
+    Returns:
+        str: Event name
+
+    """
+    return f"forcing_{index}"
+
+
+def set_event_handler(handler):
+    """Set the handler setting the events of the running task.
+
+    Args:
+        handler (callable): Sets an event by name, or None to remove it.
+
+    """
+    _EVENT_HANDLER["handler"] = handler
+
+
+def set_event(name):
+    """Set an event of the running task.
+
+    Args:
+        name (str): Event name
+
+    """
+    handler = _EVENT_HANDLER["handler"]
+    if handler is None:
+        logger.info("No scheduler to set event {} in", name)
+        return
+    logger.info("Set event {}", name)
+    handler(name)
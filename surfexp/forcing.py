@@ -0,0 +1,492 @@
+"""Forcing time loops and in-place modification of forcing files."""
+import collections
+import itertools
+import multiprocessing
+import os
+import struct
+import time
+
+import numpy as np
+from deode.datetime_utils import as_timedelta
+from deode.logs import logger
+from pysurfex.cache import Cache
+from pysurfex.forcing import NetCDFOutput
+
+# Data types of the netCDF classic format
+CLASSIC_TYPES = {1: "i1", 2: "S1", 3: ">i2", 4: ">i4", 5: ">f4", 6: ">f8"}
+
+
+class TimeStepMemo:
+    """Input variable remembering the field of the last time step read.
+
+    The last time step of a cycle is the first time step of the next cycle,
+    so the field is read and interpolated once and written to both files.
+
+    """
+
+    def __init__(self, var_obj):
+        """Construct the memo.
+
+        Args:
+            var_obj (object): pysurfex input variable
+
+        """
+        self.var_obj = var_obj
+        self.this_time = None
+        self.field = None
+
+    def __getattr__(self, name):
+        """Use the attributes of the input variable."""
+        return getattr(self.var_obj, name)
+
+    def read_time_step(self, this_time, cache):
+        """Read a time step.
+
+        Args:
+            this_time (datetime.datetime): Time step
+            cache (Cache): pysurfex cache
+
+        Returns:
+            np.ndarray: Field
+
+        """
+        if self.this_time != this_time:
+            self.set_field(this_time, self.var_obj.read_time_step(this_time, cache))
+        return self.field
+
+    def set_field(self, this_time, field):
+        """Set the field of a time step read elsewhere.
+
+        Args:
+            this_time (datetime.datetime): Time step
+            field (np.ndarray): Field
+
+        """
+        self.this_time = this_time
+        self.field = field
+
+
+# State of the time step worker processes
+_WORKER_STATE = {}
+
+
+def _init_worker(var_objs, interpolators, cache_interval):
+    """Set up a time step worker.
+
+    The interpolators found by the parent are reused, but the open input
+    files are not shared with the parent.
+
+    Args:
+        var_objs (list): Input variables
+        interpolators (dict): Interpolators from the cache of the parent
+        cache_interval (int): Max age of cached fields
+
+    """
+    cache = Cache(cache_interval)
+    cache.interpolators = dict(interpolators)
+    _WORKER_STATE.update({"var_objs": var_objs, "cache": cache})
+
+
+def _read_time_step(this_time):
+    """Read and convert the input variables of a time step in a worker.
+
+    Args:
+        this_time (datetime.datetime): Time step
+
+    Returns:
+        list: Fields as written to the forcing
+
+    """
+    cache = _WORKER_STATE["cache"]
+    fields = [
+        np.asarray(var_obj.read_time_step(this_time, cache), dtype=np.float32)
+        for var_obj in _WORKER_STATE["var_objs"]
+    ]
+    cache.clean_fields(this_time)
+    return fields
+
+
+def parallel_time_steps(
+    var_objs, times, cache, cache_interval, processes, window, started=None
+):
+    """Read and convert time steps in a process pool.
+
+    The first time step is read in this process, so the interpolators are
+    set up once and inherited by the workers. At most window time steps are
+    pending, so memory does not grow with the length of the forcing.
+
+    The workers are forked, so no other threads may run in this process
+    until they are started. Threads can be started by the started callback.
+
+    Args:
+        var_objs (list): Input variables
+        times (list): Time steps
+        cache (Cache): pysurfex cache of this process
+        cache_interval (int): Max age of cached fields
+        processes (int): Worker processes
+        window (int): Maximum number of pending time steps
+        started (callable, optional): Called when the workers are started.
+                                      Defaults to None.
+
+    Yields:
+        tuple: Time step and fields in time order
+
+    """
+    yield times[0], [var_obj.read_time_step(times[0], cache) for var_obj in var_objs]
+
+    # Workers inherit the input variables instead of pickling them
+    context = multiprocessing.get_context("fork")
+    with context.Pool(
+        processes,
+        initializer=_init_worker,
+        initargs=(var_objs, cache.interpolators, cache_interval),
+    ) as pool:
+        if started is not None:
+            started()
+        steps = iter(times[1:])
+        pending = collections.deque(
+            (this_time, pool.apply_async(_read_time_step, (this_time,)))
+            for this_time in itertools.islice(steps, window)
+        )
+        while pending:
+            this_time, result = pending.popleft()
+            fields = result.get()
+            next_time = next(steps, None)
+            if next_time is not None:
+                pending.append(
+                    (next_time, pool.apply_async(_read_time_step, (next_time,)))
+                )
+            yield this_time, fields
+
+
+def run_batched_time_loop(
+    options,
+    var_objs,
+    att_objs,
+    cycles,
+    processes=1,
+    window=None,
+    started=None,
+    finished=None,
+):
+    """Create forcing files for consecutive cycles in one time loop.
+
+    Each input time step is read once. The cache with interpolation weights
+    and open input files is shared by all cycles. With several processes the
+    time steps are read and converted in a process pool while this process
+    writes them in time order.
+
+    Args:
+        options (dict): Options from pysurfex set_forcing_config
+        var_objs (list): Input variables
+        att_objs (list): Input attributes
+        cycles (list): Start, stop and output file of each cycle
+        processes (int, optional): Processes reading the input. Defaults to 1.
+        window (int, optional): Maximum number of time steps read ahead of the
+                                writer. Defaults to twice the processes.
+        started (callable, optional): Called when no more processes are forked,
+                                      e.g. to start threads. Defaults to None.
+        finished (callable, optional): Called with the index of a cycle when its
+                                       output is complete. Defaults to None.
+
+    Raises:
+        NotImplementedError: Output format is not netcdf
+
+    """
+    tic = time.time()
+    fmt = options["output_format"].lower()
+    if fmt not in ("netcdf", "nc4"):
+        raise NotImplementedError(options["output_format"])
+    timestep = as_timedelta(seconds=options["timestep"])
+    cache = Cache(options["cache_interval"])
+    memo_objs = [TimeStepMemo(var_obj) for var_obj in var_objs]
+
+    pending = []
+    for index, (start, stop, output_file) in enumerate(cycles):
+        if os.path.exists(output_file) and not options.get("force", False):
+            logger.info("Output already exists: {}", output_file)
+            if finished is not None:
+                finished(index)
+        else:
+            pending.append((index, start, stop, output_file))
+    if len(pending) == 0:
+        if started is not None:
+            started()
+        return
+
+    this_time = min(cycle[1] for cycle in pending)
+    last_time = max(cycle[2] for cycle in pending)
+    times = []
+    while this_time <= last_time:
+        times.append(this_time)
+        this_time = this_time + timestep
+    if processes > 1 and len(times) > 1:
+        if window is None or window < 1:
+            window = 2 * processes
+        steps = parallel_time_steps(
+            memo_objs,
+            times,
+            cache,
+            options["cache_interval"],
+            processes,
+            window,
+            started=started,
+        )
+    else:
+        steps = ((this_time, None) for this_time in times)
+        if started is not None:
+            started()
+
+    active = []
+    for this_time, fields in steps:
+        if fields is not None:
+            for memo_obj, field in zip(memo_objs, fields):
+                memo_obj.set_field(this_time, field)
+        for index, start, stop, output_file in pending:
+            if start == this_time:
+                ntimes = int((stop - start) / timestep) + 1
+                output = NetCDFOutput(
+                    start,
+                    options["geo_out"],
+                    output_file,
+                    ntimes,
+                    memo_objs,
+                    att_objs,
+                    start,
+                    cache,
+                    options["timestep"],
+                    fmt=fmt,
+                    diskless_write=options.get("diskless_write", False),
+                )
+                active.append((index, stop, output))
+        for __, __, output in active:
+            logger.info(
+                "Creating forcing for: {} time_step: {} in {}",
+                this_time.strftime("%Y%m%d%H"),
+                output.time_step,
+                output.fname,
+            )
+            output.write_forcing(memo_objs, this_time, cache)
+            output.time_step = output.time_step + 1
+            output.time_step_value = output.time_step
+        for index, stop, output in [item for item in active if item[1] == this_time]:
+            output.finalize()
+            active.remove((index, stop, output))
+            if finished is not None:
+                finished(index)
+        cache.clean_fields(this_time + timestep)
+    logger.info(
+        "Forcing generation for {} cycles with {} processes took {} seconds",
+        len(pending),
+        processes,
+        time.time() - tic,
+    )
+
+
+class ClassicHeader:
+    """Reader of the header of a classic (CDF-1/CDF-2) netCDF file."""
+
+    def __init__(self, fhandler):
+        """Construct the reader.
+
+        Args:
+            fhandler (file): File opened in binary mode
+
+        """
+        self.fhandler = fhandler
+
+    def read(self, fmt):
+        """Read big-endian values.
+
+        Args:
+            fmt (str): struct format without byte order
+
+        Returns:
+            tuple: Values
+
+        """
+        size = struct.calcsize(f">{fmt}")
+        return struct.unpack(f">{fmt}", self.fhandler.read(size))
+
+    def read_name(self):
+        """Read a padded name.
+
+        Returns:
+            str: Name
+
+        """
+        (nchars,) = self.read("I")
+        name = self.fhandler.read(nchars).decode("utf-8")
+        self.fhandler.read(-nchars % 4)
+        return name
+
+    def skip_attributes(self):
+        """Skip an attribute list."""
+        __, nattrs = self.read("II")
+        for __ in range(nattrs):
+            self.read_name()
+            nc_type, nelems = self.read("II")
+            nbytes = nelems * np.dtype(CLASSIC_TYPES[nc_type]).itemsize
+            self.fhandler.read(nbytes + (-nbytes % 4))
+
+
+def read_classic_layout(filename):
+    """Read where the variables of a classic netCDF file are stored.
+
+    Args:
+        filename (str): File name
+
+    Returns:
+        dict: Layout or None if the file is not in classic format
+
+    """
+    with open(filename, mode="rb") as fhandler:
+        magic = fhandler.read(4)
+        if magic not in (b"CDF\x01", b"CDF\x02"):
+            return None
+        header = ClassicHeader(fhandler)
+        (numrecs,) = header.read("I")
+        __, ndims = header.read("II")
+        dims = []
+        for __ in range(ndims):
+            name = header.read_name()
+            dims.append((name, header.read("I")[0]))
+        header.skip_attributes()
+        __, nvars = header.read("II")
+        variables = {}
+        for __ in range(nvars):
+            name = header.read_name()
+            (ndims,) = header.read("I")
+            dimids = header.read(f"{ndims}I")
+            header.skip_attributes()
+            nc_type, vsize = header.read("II")
+            (begin,) = header.read("Q" if magic == b"CDF\x02" else "I")
+            shape = [dims[dimid][1] for dimid in dimids]
+            record = len(shape) > 0 and shape[0] == 0
+            if record:
+                shape[0] = numrecs
+            variables[name] = {
+                "dtype": np.dtype(CLASSIC_TYPES[nc_type]),
+                "shape": tuple(shape),
+                "begin": begin,
+                "record": record,
+                "vsize": vsize,
+            }
+    record_vars = [var for var in variables.values() if var["record"]]
+    if len(record_vars) == 1:
+        # A single record variable is not padded
+        var = record_vars[0]
+        recsize = int(np.prod(var["shape"][1:])) * var["dtype"].itemsize
+    else:
+        recsize = sum(var["vsize"] for var in record_vars)
+    return {"variables": variables, "recsize": recsize}
+
+
+def map_time_step(filename, layout, name, time_step, mode="r"):
+    """Memory map one time step of a variable in a classic netCDF file.
+
+    Args:
+        filename (str): File name
+        layout (dict): Layout from read_classic_layout
+        name (str): Variable
+        time_step (int): Time step. Negative values count from the end.
+        mode (str, optional): Mode for np.memmap. Defaults to "r".
+
+    Raises:
+        IndexError: Time step is outside the variable
+
+    Returns:
+        np.memmap: The time step
+
+    """
+    var = layout["variables"][name]
+    ntimes = var["shape"][0]
+    if not -ntimes <= time_step < ntimes:
+        raise IndexError(f"Time step {time_step} outside {name} with {ntimes} steps")
+    time_step = time_step % ntimes
+    shape = var["shape"][1:]
+    if var["record"]:
+        offset = var["begin"] + time_step * layout["recsize"]
+    else:
+        offset = var["begin"] + time_step * int(np.prod(shape)) * var["dtype"].itemsize
+    return np.memmap(filename, dtype=var["dtype"], mode=mode, offset=offset, shape=shape)
+
+
+def read_time_step(filename, name, time_step):
+    """Read one time step of a variable without scaling or masking.
+
+    Args:
+        filename (str): File name
+        name (str): Variable
+        time_step (int): Time step. Negative values count from the end.
+
+    Returns:
+        np.ndarray: Values
+
+    """
+    layout = read_classic_layout(filename)
+    if layout is not None:
+        return np.array(map_time_step(filename, layout, name, time_step))
+
+    import netCDF4
+
+    with netCDF4.Dataset(filename, "r") as ncf:
+        ncf.set_auto_maskandscale(False)
+        return np.asarray(ncf[name][time_step, ...])
+
+
+def modify_time_steps(input_file, output_file, variables, input_time_step=-1):
+    """Copy a time step of variables into the first time step of a file.
+
+    Only the first time step of the output is touched, so the time does not
+    depend on the length of the forcing. Classic files are modified through
+    a memory map of the time step. Other files are modified with netCDF4,
+    which rewrites the chunks holding the first time step. The written
+    values are checked by reading back the same time step.
+
+    Args:
+        input_file (str): File with the values
+        output_file (str): File to modify
+        variables (list): Variables to modify
+        input_time_step (int, optional): Time step in the input. Defaults to -1.
+
+    Raises:
+        RuntimeError: Values read back differ from the input
+
+    """
+    values = {
+        name: read_time_step(input_file, name, input_time_step) for name in variables
+    }
+
+    layout = read_classic_layout(output_file)
+    if layout is not None:
+        for name in variables:
+            logger.info("Modify {} in place", name)
+            field = map_time_step(output_file, layout, name, 0, mode="r+")
+            field[...] = values[name].reshape(field.shape).astype(field.dtype)
+            field.flush()
+            del field
+    else:
+        import netCDF4
+
+        with netCDF4.Dataset(output_file, "r+") as ncf:
+            ncf.set_auto_maskandscale(False)
+            for name in variables:
+                chunking = ncf[name].chunking()
+                if chunking != "contiguous" and chunking[0] != 1:
+                    logger.warning(
+                        "{} is chunked with {} time steps. Chunks are rewritten",
+                        name,
+                        chunking[0],
+                    )
+                logger.info("Modify {}", name)
+                ncf[name][0, ...] = values[name]
+
+    for name in variables:
+        written = read_time_step(output_file, name, 0)
+        if not np.array_equal(
+            written.reshape(-1),
+            values[name].reshape(-1).astype(written.dtype),
+            equal_nan=written.dtype.kind == "f",
+        ):
+            raise RuntimeError(f"Modified {name} in {output_file} differs from input")
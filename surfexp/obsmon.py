@@ -0,0 +1,294 @@
+"""Obsmon SQLite files from QC output."""
+import sqlite3
+
+import numpy as np
+from deode.logs import logger
+from pysurfex.datetime_utils import as_datetime
+from pysurfex.netcdf import read_first_guess_netcdf_file
+from pysurfex.obsmon import calculate_statistics
+from pysurfex.titan import Departure
+
+from surfexp.qc import read_qc_dataset
+
+MODES = ["total", "land", "sea"]
+STAT_COLS = [
+    "nobs",
+    "fg_bias",
+    "fg_abs_bias",
+    "fg_rms",
+    "fg_dep",
+    "fg_uncorr",
+    "bc",
+    "an_bias",
+    "an_abs_bias",
+    "an_rms",
+    "an_dep",
+]
+OBNUMBER = 1
+OBNAME = "synop"
+SATNAME = "undef"
+LEVEL = 0
+
+
+def obsmon_filename(outdir, an_time, database="cycle"):
+    """Get the name of the obsmon SQLite file.
+
+    Args:
+        outdir (str): Output directory
+        an_time (datetime.datetime): Analysis time
+        database (str, optional): "cycle" for one file per cycle or "monthly"
+                                  for one file per month. Defaults to "cycle".
+
+    Raises:
+        NotImplementedError: Unknown database type
+
+    Returns:
+        str: File name
+
+    """
+    if database == "cycle":
+        return f"{outdir}/ecma_sfc/{an_time.strftime('%Y%m%d%H')}/ecma.db"
+    if database == "monthly":
+        return f"{outdir}/ecma_sfc/{an_time.strftime('%Y%m')}/ecma.db"
+    raise NotImplementedError(f"Obsmon database {database}")
+
+
+def usage_rows(dtg, varname, observations):
+    """Create the rows of the usage table.
+
+    Args:
+        dtg (int): Analysis time as YYYYMMDDHH
+        varname (str): Obsmon variable name
+        observations (QCDataSet): Observations with departures
+
+    Returns:
+        list: Row tuples
+
+    """
+    values = np.asarray(observations.values, dtype=np.float64)
+    fg_deps = np.asarray(observations.fg_dep, dtype=np.float64)
+    an_deps = np.asarray(observations.an_dep, dtype=np.float64)
+    lons = np.round(np.asarray(observations.lons, dtype=np.float64), 5)
+    lats = np.round(np.asarray(observations.lats, dtype=np.float64), 5)
+    flags = np.asarray(observations.flags, dtype=np.float64).astype(int)
+    status = np.where(flags == 0, 1, flags)
+    missing = np.isnan(values)
+
+    def nullable(values):
+        return [None if np.isnan(val) else float(val) for val in values]
+
+    fg_deps[missing] = np.nan
+    an_deps[missing] = np.nan
+    return list(
+        zip(
+            [dtg] * len(values),
+            [OBNUMBER] * len(values),
+            [OBNAME] * len(values),
+            [SATNAME] * len(values),
+            [varname] * len(values),
+            [LEVEL] * len(values),
+            lats.tolist(),
+            lons.tolist(),
+            [str(stid) for stid in observations.stids],
+            nullable(values),
+            nullable(fg_deps),
+            nullable(an_deps),
+            [0] * len(values),
+            [0] * len(values),
+            [0] * len(values),
+            [0] * len(values),
+            [0] * len(values),
+            status.tolist(),
+        )
+    )
+
+
+def nullable_statistic(value):
+    """Convert a statistic to a value stored in SQLite.
+
+    Args:
+        value (object): Statistic from calculate_statistics. Modes without
+                        observations give "NULL".
+
+    Returns:
+        float: Value or None for SQL NULL
+
+    """
+    if value is None or (isinstance(value, str) and value.upper() == "NULL"):
+        return None
+    value = float(value)
+    if np.isnan(value):
+        return None
+    return value
+
+
+class ObsmonWriter:
+    """Bulk writer of obsmon SQLite files.
+
+    One connection is used for all variables in a cycle. All inserts are done
+    with executemany in one transaction which is committed when the writer is
+    closed. The index on the usage table is created after the load. Existing
+    rows for the same cycle and variable are replaced, so the same file can
+    be used for many cycles.
+
+    """
+
+    def __init__(self, dbname, journal_mode="WAL", synchronous="NORMAL"):
+        """Construct the writer.
+
+        Args:
+            dbname (str): SQLite file
+            journal_mode (str, optional): SQLite journal mode. Defaults to "WAL".
+            synchronous (str, optional): SQLite synchronous setting.
+                                         Defaults to "NORMAL".
+
+        """
+        self.dbname = dbname
+        self.conn = sqlite3.connect(dbname, isolation_level=None)
+        self.conn.execute(f"PRAGMA journal_mode={journal_mode}")
+        self.conn.execute(f"PRAGMA synchronous={synchronous}")
+        self.conn.execute("BEGIN")
+        self.create_tables()
+
+    def __enter__(self):
+        """Enter context.
+
+        Returns:
+            ObsmonWriter: The writer
+
+        """
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Commit or roll back and close.
+
+        Args:
+            exc_type (type): Exception type
+            exc_value (Exception): Exception
+            traceback (traceback): Traceback
+
+        """
+        self.close(commit=exc_type is None)
+
+    def create_tables(self):
+        """Create the usage and obsmon tables."""
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS usage (DTG INT, obnumber INT, "
+            "obname CHAR(20), satname CHAR(20), varname CHAR(20), level INT, "
+            "latitude FLOAT, longitude FLOAT, statid CHAR(20), obsvalue FLOAT, "
+            "fg_dep FLOAT, an_dep FLOAT, biascrl FLOAT, active INT, rejected INT, "
+            "passive INT, blacklisted INT, anflag INT)"
+        )
+        stat_cols = ", ".join(
+            [f"{col}_{mode} FLOAT" for mode in MODES for col in STAT_COLS]
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS obsmon (DTG INT, obnumber INT, "
+            "obname CHAR(20), satname CHAR(20), varname CHAR(20), level INT, "
+            f"passive INT, {stat_cols})"
+        )
+
+    def add(self, dtg, varname, observations):
+        """Add the observations and statistics of one variable.
+
+        Args:
+            dtg (int): Analysis time as YYYYMMDDHH
+            varname (str): Obsmon variable name
+            observations (QCDataSet): Observations with departures
+
+        """
+        key = (dtg, OBNUMBER, OBNAME, varname, LEVEL)
+        self.conn.execute(
+            "DELETE FROM usage WHERE DTG=? AND obnumber=? AND obname=? "
+            "AND varname=? AND level=?",
+            key,
+        )
+        self.conn.execute(
+            "DELETE FROM obsmon WHERE DTG=? AND obnumber=? AND obname=? "
+            "AND varname=? AND level=?",
+            key,
+        )
+
+        rows = usage_rows(dtg, varname, observations)
+        self.conn.executemany(f"INSERT INTO usage VALUES({','.join(['?'] * 18)})", rows)
+
+        statistics = calculate_statistics(observations, MODES, STAT_COLS)
+        stats = [
+            nullable_statistic(statistics[f"{col}_{mode}"])
+            for mode in MODES
+            for col in STAT_COLS
+        ]
+        self.conn.execute(
+            f"INSERT INTO obsmon VALUES({','.join(['?'] * (7 + len(stats)))})",
+            (dtg, OBNUMBER, OBNAME, SATNAME, varname, LEVEL, 0, *stats),
+        )
+        logger.info("Added {} {} observations to {}", len(rows), varname, self.dbname)
+
+    def close(self, commit=True):
+        """Create the index, commit and close the connection.
+
+        Args:
+            commit (bool, optional): Commit the transaction. Defaults to True.
+
+        """
+        if commit:
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS obsmon_index on usage(DTG,obnumber,obname)"
+            )
+            self.conn.execute("COMMIT")
+        else:
+            self.conn.execute("ROLLBACK")
+        self.conn.close()
+
+    def write(self, dtg, qc, fg_file, an_file, varname, file_var, operator="bilinear"):
+        """Compute departures for one variable and add it.
+
+        Args:
+            dtg (datetime.datetime): Analysis time
+            qc (str): QC output from surfexp.qc.qc_filename
+            fg_file (str): First guess file
+            an_file (str): Analysis file
+            varname (str): Obsmon variable name
+            file_var (str): Variable name in the first guess and analysis files
+            operator (str, optional): Interpolation operator.
+                                      Defaults to "bilinear".
+
+        """
+        an_time = dtg
+        if isinstance(an_time, str):
+            an_time = as_datetime(an_time)
+
+        obs_titan = read_qc_dataset(an_time, qc, skip_flags=[150])
+        geo_in, __, an_field, __, __ = read_first_guess_netcdf_file(an_file, file_var)
+        geo_in, __, fg_field, __, __ = read_first_guess_netcdf_file(fg_file, file_var)
+        fg_dep = Departure(
+            operator, geo_in, obs_titan, fg_field, "first_guess"
+        ).get_departure()
+        an_dep = Departure(
+            operator, geo_in, obs_titan, an_field, "analysis"
+        ).get_departure()
+
+        obs_titan = read_qc_dataset(
+            an_time, qc, skip_flags=[150, 199], fg_dep=fg_dep, an_dep=an_dep
+        )
+        self.add(int(an_time.strftime("%Y%m%d%H")), varname, obs_titan)
+
+
+def write_obsmon_sqlite_file(
+    dtg, output, qc, fg_file, an_file, varname, file_var, operator="bilinear"
+):
+    """Write an obsmon SQLite file for one variable.
+
+    Args:
+        dtg (datetime.datetime): Analysis time
+        output (str): SQLite file
+        qc (str): QC output from surfexp.qc.qc_filename
+        fg_file (str): First guess file
+        an_file (str): Analysis file
+        varname (str): Obsmon variable name
+        file_var (str): Variable name in the first guess and analysis files
+        operator (str, optional): Interpolation operator. Defaults to "bilinear".
+
+    """
+    with ObsmonWriter(output) as writer:
+        writer.write(dtg, qc, fg_file, an_file, varname, file_var, operator=operator)
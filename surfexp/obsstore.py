@@ -0,0 +1,152 @@
+"""Store of decoded observations shared between tasks in a cycle."""
+import contextlib
+import fcntl
+import os
+
+import numpy as np
+from deode.logs import logger
+from pysurfex.bufr import BufrObservationSet
+from pysurfex.datetime_utils import as_datetime, as_timedelta
+from pysurfex.obs import ObservationSet
+from pysurfex.observation import Observation
+
+from surfexp.cache import hash_key, input_signature
+
+COLUMNS = ["obstime", "lon", "lat", "elev", "value", "stid", "varname", "sigmao"]
+
+
+def observations2columns(observations):
+    """Convert observations to columns.
+
+    Args:
+        observations (list): Observation objects
+
+    Returns:
+        dict: NumPy array for each column
+
+    """
+    return {
+        "obstime": np.array(
+            [obs.obstime.strftime("%Y%m%d%H%M%S") for obs in observations], dtype=str
+        ),
+        "lon": np.array([obs.lon for obs in observations], dtype=np.float64),
+        "lat": np.array([obs.lat for obs in observations], dtype=np.float64),
+        "elev": np.array([obs.elev for obs in observations], dtype=np.float64),
+        "value": np.array([obs.value for obs in observations], dtype=np.float64),
+        "stid": np.array([str(obs.stid) for obs in observations], dtype=str),
+        "varname": np.array([str(obs.varname) for obs in observations], dtype=str),
+        "sigmao": np.array([obs.sigmao for obs in observations], dtype=np.float64),
+    }
+
+
+class BufrObservationStore:
+    """Decoded BUFR observations for all variables used in a cycle.
+
+    The BUFR file is decoded once for all variables and stored as columns in
+    a NumPy file in the observation directory. Tasks for the single
+    variables read only the rows of their variable.
+
+    """
+
+    def __init__(self, obs_dir, bufrfile, variables, an_time, deltat=1800):
+        """Construct the store.
+
+        Args:
+            obs_dir (str): Observation directory
+            bufrfile (str): BUFR file
+            variables (list): All variables to decode
+            an_time (datetime): Analysis time
+            deltat (int, optional): Allowed time difference in seconds.
+                                    Defaults to 1800.
+
+        """
+        self.bufrfile = bufrfile
+        self.variables = sorted(set(variables))
+        self.an_time = an_time
+        self.deltat = deltat
+        key = hash_key(
+            {
+                "inputs": input_signature([bufrfile]),
+                "variables": self.variables,
+                "an_time": an_time,
+                "dt": deltat,
+            }
+        )
+        self.filename = f"{obs_dir}/bufr_{key[:16]}.npz"
+
+    def populate(self):
+        """Decode the BUFR file and store the observations if not done already."""
+        os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+        # Other tasks in the cycle wait here until the first one has decoded the file
+        with open(f"{self.filename}.lock", mode="w", encoding="utf-8") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if os.path.exists(self.filename):
+                return
+            logger.info("Decode {} for {}", self.bufrfile, self.variables)
+            obs_set = BufrObservationSet(
+                self.bufrfile,
+                self.variables,
+                self.an_time,
+                as_timedelta(seconds=self.deltat),
+            )
+            columns = observations2columns(obs_set.observations)
+            tmp_filename = f"{self.filename}.tmp.{os.getpid()}.npz"
+            np.savez(tmp_filename, **columns)
+            os.replace(tmp_filename, self.filename)
+            logger.info(
+                "Stored {} observations in {}", len(obs_set.observations), self.filename
+            )
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(f"{self.filename}.lock")
+
+    def read(self, varname):
+        """Read the observations of one variable.
+
+        Args:
+            varname (str): Variable name
+
+        Returns:
+            list: Observation objects
+
+        """
+        self.populate()
+        with np.load(self.filename) as data:
+            mask = data["varname"] == varname
+            columns = {column: data[column][mask] for column in COLUMNS}
+        logger.info(
+            "Read {} {} observations from {}",
+            np.count_nonzero(mask),
+            varname,
+            self.filename,
+        )
+        return [
+            Observation(
+                as_datetime(columns["obstime"][i]),
+                columns["lon"][i],
+                columns["lat"][i],
+                columns["value"][i],
+                elev=columns["elev"][i],
+                stid=str(columns["stid"][i]),
+                varname=str(columns["varname"][i]),
+                sigmao=columns["sigmao"][i],
+            )
+            for i in range(len(columns["value"]))
+        ]
+
+    def observation_set(self, varnames, label="bufr", sigmao=None):
+        """Create an observation set.
+
+        Args:
+            varnames (list): Variable names
+            label (str, optional): Label of set. Defaults to "bufr".
+            sigmao (float, optional): Observation error relative to normal background
+                                      error. Defaults to None.
+
+        Returns:
+            ObservationSet: Observation set
+
+        """
+        observations = []
+        for varname in varnames:
+            observations += self.read(varname)
+        return ObservationSet(observations, label=label, sigmao=sigmao)
@@ -0,0 +1,256 @@
+"""Spatially tiled horizontal OI."""
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from types import SimpleNamespace
+
+import numpy as np
+from deode.logs import logger
+from pysurfex.interpolation import horizontal_oi
+
+from surfexp.regrid import lonlat2xyz
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None  # noqa: N816
+
+# Distance in units of hlength where the Barnes correlation is negligible (0.0013)
+HALO_FACTOR = 3.64
+EARTH_RADIUS = 6.371e6
+
+OBS_ATTRIBUTES = ["lons", "lats", "stids", "elevs", "values", "epsilons", "lafs"]
+
+
+def grid_spacing(lons, lats):
+    """Estimate the smallest grid spacing of a grid.
+
+    Args:
+        lons (np.ndarray): Longitudes with shape (nx, ny)
+        lats (np.ndarray): Latitudes with shape (nx, ny)
+
+    Returns:
+        float: Grid spacing in meters
+
+    """
+    xyz = lonlat2xyz(lons, lats).reshape(*lons.shape, 3)
+    spacing = []
+    if lons.shape[0] > 1:
+        spacing.append(np.median(np.linalg.norm(xyz[1:, :] - xyz[:-1, :], axis=-1)))
+    if lons.shape[1] > 1:
+        spacing.append(np.median(np.linalg.norm(xyz[:, 1:] - xyz[:, :-1], axis=-1)))
+    return float(min(spacing)) * EARTH_RADIUS
+
+
+def subset_observations(observations, index):
+    """Make a subset of an observation set.
+
+    Args:
+        observations (QCDataSet): Observations
+        index (np.ndarray): Index of the observations to keep
+
+    Returns:
+        SimpleNamespace: Object with the attributes used by horizontal_oi
+
+    """
+    return SimpleNamespace(
+        **{
+            attr: np.asarray(getattr(observations, attr))[index]
+            for attr in OBS_ATTRIBUTES
+        }
+    )
+
+
+def make_tiles(n_x, n_y, tile_size, halo):
+    """Split a grid into tiles with halos.
+
+    Args:
+        n_x (int): Grid points in x direction
+        n_y (int): Grid points in y direction
+        tile_size (int): Tile size in grid points
+        halo (int): Halo in grid points
+
+    Returns:
+        list: Tile slices (x0, x1, y0, y1) and halo slices (hx0, hx1, hy0, hy1)
+
+    """
+    tiles = []
+    for x_0 in range(0, n_x, tile_size):
+        x_1 = min(x_0 + tile_size, n_x)
+        for y_0 in range(0, n_y, tile_size):
+            y_1 = min(y_0 + tile_size, n_y)
+            tiles.append(
+                (
+                    (x_0, x_1, y_0, y_1),
+                    (
+                        max(x_0 - halo, 0),
+                        min(x_1 + halo, n_x),
+                        max(y_0 - halo, 0),
+                        min(y_1 + halo, n_y),
+                    ),
+                )
+            )
+    return tiles
+
+
+def background_only(background, settings):
+    """Get the analysis for a tile without observations.
+
+    Args:
+        background (np.ndarray): Background field
+        settings (dict): Keyword arguments to horizontal_oi
+
+    Returns:
+        np.ndarray: Analysis field
+
+    """
+    field = np.array(background, dtype=np.float64)
+    if settings.get("minvalue") is not None:
+        field[field < settings["minvalue"]] = settings["minvalue"]
+    if settings.get("maxvalue") is not None:
+        field[field > settings["maxvalue"]] = settings["maxvalue"]
+    if settings.get("only_diff", False):
+        field[:] = np.nan
+    return field
+
+
+def tile_oi(lons, lats, background, gelevs, observations, settings):
+    """Do the horizontal OI for one tile.
+
+    Args:
+        lons (np.ndarray): Longitudes of the tile including the halo
+        lats (np.ndarray): Latitudes of the tile including the halo
+        background (np.ndarray): Background field of the tile including the halo
+        gelevs (np.ndarray): Elevations of the tile including the halo
+        observations (SimpleNamespace): Observations in the tile and its halo
+        settings (dict): Keyword arguments to horizontal_oi
+
+    Returns:
+        np.ndarray: Analysis of the tile including the halo
+
+    """
+    if len(observations.values) == 0:
+        return background_only(background, settings)
+    # horizontal_oi only uses the coordinates of the geometry
+    geo = SimpleNamespace(lons=lons, lats=lats)
+    return horizontal_oi(
+        geo, background, observations, gelevs=gelevs, interpol="bilinear", **settings
+    )
+
+
+def tiled_horizontal_oi(
+    geo, background, observations, gelevs, settings, tile_size=256, workers=1
+):
+    """Do the horizontal OI tile by tile.
+
+    The domain is split in tiles of tile_size x tile_size grid points. Each
+    tile is extended with a halo wide enough to hold every grid point and
+    observation that influences the tile, which is HALO_FACTOR times the
+    horizontal length scale. The observations for a tile are found from a
+    KD-tree over the observation locations. Only the interior of each tile
+    is kept in the stitched analysis.
+
+    Args:
+        geo (Geo): Geometry
+        background (np.ndarray): Background field with shape (nx, ny)
+        observations (QCDataSet): Quality controlled observations
+        gelevs (np.ndarray): Elevations with shape (nx, ny)
+        settings (dict): Keyword arguments to horizontal_oi
+        tile_size (int, optional): Tile size in grid points. Defaults to 256.
+        workers (int, optional): Number of worker processes. Defaults to 1.
+
+    Raises:
+        RuntimeError: scipy is not installed
+
+    Returns:
+        np.ndarray: Analysis field with shape (nx, ny)
+
+    """
+    if cKDTree is None:
+        raise RuntimeError("You need scipy for tiled OI. Install surfexp[scipy]")
+
+    lons = np.asarray(geo.lons)
+    lats = np.asarray(geo.lats)
+    background = np.asarray(background)
+    gelevs = np.asarray(gelevs)
+    n_x, n_y = lons.shape
+    hlength = settings.get("hlength", 10000.0)
+    halo_distance = HALO_FACTOR * hlength
+    halo = int(np.ceil(halo_distance / grid_spacing(lons, lats)))
+    tiles = make_tiles(n_x, n_y, tile_size, halo)
+
+    obs_xyz = lonlat2xyz(observations.lons, observations.lats)
+    tree = cKDTree(obs_xyz)
+    logger.info(
+        "Tiled OI with {} tiles of {} points, halo {} points and {} observations",
+        len(tiles),
+        tile_size,
+        halo,
+        obs_xyz.shape[0],
+    )
+
+    def jobs():
+        for __, (hx0, hx1, hy0, hy1) in tiles:
+            tile_xyz = lonlat2xyz(lons[hx0:hx1, hy0:hy1], lats[hx0:hx1, hy0:hy1])
+            center = tile_xyz.mean(axis=0)
+            center = center / np.linalg.norm(center)
+            radius = np.max(np.linalg.norm(tile_xyz - center, axis=1))
+            index = np.sort(tree.query_ball_point(center, radius))
+            yield (
+                lons[hx0:hx1, hy0:hy1],
+                lats[hx0:hx1, hy0:hy1],
+                background[hx0:hx1, hy0:hy1],
+                gelevs[hx0:hx1, hy0:hy1],
+                subset_observations(observations, index.astype(int)),
+                settings,
+            )
+
+    start = time.time()
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = bounded_map(executor, tile_oi, jobs(), 2 * workers)
+            field = stitch(tiles, results, (n_x, n_y))
+    else:
+        field = stitch(tiles, (tile_oi(*job) for job in jobs()), (n_x, n_y))
+    logger.info("Tiled OI took {:.1f} s", time.time() - start)
+    return field
+
+
+def bounded_map(executor, func, jobs, window):
+    """Map a function over jobs with a limited number of pending jobs.
+
+    Args:
+        executor (Executor): Executor
+        func (callable): Function
+        jobs (iterable): Arguments for each call
+        window (int): Maximum number of pending jobs
+
+    Yields:
+        any: Results in the order of the jobs
+
+    """
+    pending = deque()
+    for job in jobs:
+        pending.append(executor.submit(func, *job))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def stitch(tiles, results, shape):
+    """Stitch the interior of the tiles into one field.
+
+    Args:
+        tiles (list): Tile and halo slices from make_tiles
+        results (iterable): Analysis of each tile including the halo
+        shape (tuple): Shape of the field
+
+    Returns:
+        np.ndarray: Stitched field
+
+    """
+    field = np.full(shape, np.nan)
+    for ((x_0, x_1, y_0, y_1), (hx0, __, hy0, __)), result in zip(tiles, results):
+        field[x_0:x_1, y_0:y_1] = result[x_0 - hx0 : x_1 - hx0, y_0 - hy0 : y_1 - hy0]
+    return field
@@ -0,0 +1,234 @@
+"""Look-ahead of the cycle input."""
+import json
+import math
+import os
+import shutil
+import statistics
+import time
+
+from deode.logs import logger
+
+# Cycles the input may run ahead of the forecasts if nothing else is known
+DEFAULT_INPUT_CYCLES_AHEAD = 3
+# Number of recent records used for the estimates
+RECENT = 20
+
+
+def get_statistics_file(config, platform):
+    """Get the task statistics file if configured.
+
+    Args:
+        config (ParsedConfig): Configuration
+        platform (Platform): Platform used for substitution
+
+    Returns:
+        str: Statistics file or None if not configured.
+
+    """
+    try:
+        stats_file = config["suite_control.task_statistics"]
+    except KeyError:
+        stats_file = ""
+    if stats_file is None or stats_file == "":
+        return None
+    return platform.substitute(stats_file)
+
+
+def record_task(stats_file, task, basetime, **values):
+    """Append a record of a finished task.
+
+    Each record is a single appended line, so concurrent tasks do not
+    interfere.
+
+    Args:
+        stats_file (str): Statistics file. Nothing is recorded if None.
+        task (str): Task name
+        basetime (datetime.datetime): Base time of the task
+        values (dict): Measured values, e.g. seconds or size
+
+    """
+    if stats_file is None:
+        return
+    record = {"task": task, "basetime": basetime.isoformat(), "time": time.time()}
+    record.update(values)
+    try:
+        os.makedirs(os.path.dirname(stats_file) or ".", exist_ok=True)
+        with open(stats_file, mode="a", encoding="utf-8") as fhandler:
+            fhandler.write(json.dumps(record) + "\n")
+    except OSError as exc:
+        logger.warning("Could not record task statistics in {}: {}", stats_file, exc)
+
+
+def read_records(stats_file, task):
+    """Read the records of a task.
+
+    Args:
+        stats_file (str): Statistics file
+        task (str): Task name
+
+    Returns:
+        list: Records ordered by the time they were written
+
+    """
+    records = []
+    if not os.path.exists(stats_file):
+        return records
+    with open(stats_file, mode="r", encoding="utf-8") as fhandler:
+        for line in fhandler:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if record.get("task") == task:
+                records.append(record)
+    return records
+
+
+def recent_median(records, key):
+    """Get the median of a value in the recent records.
+
+    Args:
+        records (list): Records
+        key (str): Value
+
+    Returns:
+        float: Median or None if no records have the value
+
+    """
+    values = [record[key] for record in records if record.get(key) is not None]
+    if len(values) == 0:
+        return None
+    return statistics.median(values[-RECENT:])
+
+
+def cycle_interval(records):
+    """Estimate the time between finished forecasts.
+
+    Args:
+        records (list): Records of the task finishing a cycle
+
+    Returns:
+        float: Median interval in seconds or None if unknown
+
+    """
+    times = [record["time"] for record in records[-RECENT - 1 :]]
+    intervals = [t_1 - t_0 for t_0, t_1 in zip(times[:-1], times[1:]) if t_1 > t_0]
+    if len(intervals) == 0:
+        return None
+    return statistics.median(intervals)
+
+
+def free_disk_space(path):
+    """Get the free disk space for a path which might not exist yet.
+
+    Args:
+        path (str): Path
+
+    Returns:
+        int: Free space in bytes
+
+    """
+    path = os.path.abspath(path)
+    while not os.path.exists(path):
+        path = os.path.dirname(path)
+    return shutil.disk_usage(path).free
+
+
+def adaptive_cycles_ahead(
+    forcing_seconds,
+    cycle_seconds,
+    forcing_size,
+    disk_budget,
+    default=DEFAULT_INPUT_CYCLES_AHEAD,
+    maximum=None,
+):
+    """Size the look-ahead of the cycle input.
+
+    The input of the cycles ahead is created concurrently, so it keeps up
+    with the forecasts when the look-ahead is at least the forcing duration
+    divided by the time per cycle. One cycle is added as margin. The forcing
+    of the cycles ahead, the running cycle and the previous cycle must fit in
+    the disk budget.
+
+    Args:
+        forcing_seconds (float): Duration of a forcing task. None if unknown.
+        cycle_seconds (float): Time per forecast cycle. None if unknown.
+        forcing_size (float): Size of the forcing of a cycle. None if unknown.
+        disk_budget (float): Disk space for forcing in bytes. None if unlimited.
+        default (int, optional): Look-ahead if the durations are unknown.
+                                 Defaults to DEFAULT_INPUT_CYCLES_AHEAD.
+        maximum (int, optional): Largest look-ahead. Defaults to None.
+
+    Returns:
+        int: Number of cycles the input may run ahead
+
+    """
+    cycles_ahead = default
+    if forcing_seconds is not None and cycle_seconds is not None and cycle_seconds > 0:
+        cycles_ahead = math.ceil(forcing_seconds / cycle_seconds) + 1
+    if forcing_size is not None and forcing_size > 0 and disk_budget is not None:
+        cycles_ahead = min(cycles_ahead, int(disk_budget // forcing_size) - 2)
+    if maximum is not None:
+        cycles_ahead = min(cycles_ahead, maximum)
+    return max(1, cycles_ahead)
+
+
+def get_input_cycles_ahead(config):
+    """Get the number of cycles the input may run ahead of the forecasts.
+
+    The value is either set in suite_control.input_cycles_ahead or, if it is
+    "auto", sized from the recorded task durations and the disk budget for
+    forcing.
+
+    Args:
+        config (ParsedConfig): Configuration
+
+    Returns:
+        int: Number of cycles
+
+    """
+    try:
+        setting = config["suite_control.input_cycles_ahead"]
+    except KeyError:
+        setting = DEFAULT_INPUT_CYCLES_AHEAD
+    if str(setting).lower() != "auto":
+        return int(setting)
+
+    from deode.toolbox import Platform
+
+    platform = Platform(config)
+    try:
+        maximum = int(config["suite_control.max_input_cycles_ahead"])
+    except KeyError:
+        maximum = None
+    try:
+        disk_budget = config["suite_control.forcing_disk_budget"]
+    except KeyError:
+        disk_budget = ""
+    if disk_budget is None or disk_budget == "":
+        forcing_dir = platform.substitute(platform.get_system_value("forcing_dir"))
+        disk_budget = free_disk_space(forcing_dir)
+    else:
+        disk_budget = float(disk_budget) * 1024**3
+
+    forcing_seconds = None
+    cycle_seconds = None
+    forcing_size = None
+    stats_file = get_statistics_file(config, platform)
+    if stats_file is not None:
+        forcing = read_records(stats_file, "Forcing")
+        forcing_seconds = recent_median(forcing, "seconds")
+        forcing_size = recent_median(forcing, "size")
+        cycle_seconds = cycle_interval(read_records(stats_file, "LogProgress"))
+    cycles_ahead = adaptive_cycles_ahead(
+        forcing_seconds, cycle_seconds, forcing_size, disk_budget, maximum=maximum
+    )
+    logger.info(
+        "Input cycles ahead: {} (forcing {} s, cycle {} s, forcing size {}, budget {})",
+        cycles_ahead,
+        forcing_seconds,
+        cycle_seconds,
+        forcing_size,
+        disk_budget,
+    )
+    return cycles_ahead
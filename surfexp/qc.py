@@ -0,0 +1,601 @@
+"""Quality control of observations."""
+import contextlib
+import json
+import os
+import shutil
+import time
+from functools import cached_property
+
+import numpy as np
+from deode.logs import logger
+from pysurfex.datetime_utils import as_datetime
+from pysurfex.observation import Observation
+from pysurfex.titan import QCDataSet, TitanDataSet, dataset_from_file
+
+
+class VectorizedTitanDataSet(TitanDataSet):
+    """Titan QC data set with vectorized tests and timings.
+
+    The observations are converted to NumPy arrays once. The tests nometa,
+    plausibility, blacklist and redundancy are done as mask updates on the
+    arrays. The other tests are done by the pysurfex/titanlib implementations.
+    The flags are the same as from TitanDataSet.perform_tests.
+
+    """
+
+    def __init__(self, var, settings, tests, datasources, an_time, test_flags=None):
+        """Construct the data set.
+
+        Args:
+            var (str): Variable name.
+            settings (dict): Titan test/configuration settings
+            tests (list): Tests to perform in order.
+            datasources (list): List of observations sets.
+            an_time (datetime.datetime): Analysis time
+            test_flags (dict, optional): Dictionary to set custom test flags.
+                                         Defaults to None.
+
+        """
+        TitanDataSet.__init__(
+            self, var, settings, tests, datasources, an_time, test_flags=test_flags
+        )
+        self.flags = np.asarray(self.flags, dtype=np.float64)
+        self.columns = {
+            "lons": np.asarray(self.lons, dtype=np.float64),
+            "lats": np.asarray(self.lats, dtype=np.float64),
+            "elevs": np.asarray(self.elevs, dtype=np.float64),
+            "values": np.asarray(self.values, dtype=np.float64),
+            "stids": np.asarray([str(stid) for stid in self.stids]),
+        }
+        self.timings = {}
+
+    def test_settings(self, test, obs_set):
+        """Get the settings of a test for an observation set.
+
+        Args:
+            test (QualityControl): Test
+            obs_set (ObservationSet): Observation set
+
+        Raises:
+            RuntimeError: Observation set has no label
+
+        Returns:
+            dict: Test settings including do_test
+
+        """
+        if obs_set.label == "":
+            raise RuntimeError(
+                "Observations set for quality control are assumed to have a label"
+            )
+        do_test = self.settings.get("do_test", False)
+        if test.name in self.settings and "do_test" in self.settings[test.name]:
+            do_test = self.settings[test.name]["do_test"]
+        test_settings = {"do_test": do_test}
+        with contextlib.suppress(KeyError):
+            test_settings.update(self.settings["sets"][obs_set.label]["tests"][test.name])
+        return test_settings
+
+    def test_mask(self, test):
+        """Find the active observations for a test and set the test input.
+
+        Args:
+            test (QualityControl): Test
+
+        Returns:
+            np.ndarray: Index of the active observations
+
+        """
+        masks = []
+        findex = 0
+        for obs_set in self.datasources:
+            size = obs_set.size
+            test_settings = self.test_settings(test, obs_set)
+            if test_settings.pop("do_test"):
+                lmask = np.flatnonzero(self.flags[findex : findex + size] == 0)
+                masks.append(lmask + findex)
+                logger.debug(
+                    "Test {} size={} settings={}", test.name, len(lmask), test_settings
+                )
+                test.set_input(len(lmask), **test_settings)
+            else:
+                logger.info(
+                    "Test {} is de-activated for this data source {}",
+                    test.name,
+                    obs_set.label,
+                )
+            findex = findex + size
+        if len(masks) == 0:
+            return np.array([], dtype=int)
+        return np.concatenate(masks)
+
+    def nometa(self, mask, code):
+        """Flag observations without elevation.
+
+        Args:
+            mask (np.ndarray): Active observations
+            code (int): Flag
+
+        """
+        bad = mask[np.isnan(self.columns["elevs"][mask])]
+        self.flags[bad] = code
+
+    def plausibility(self, test, mask, code):
+        """Flag observations outside the plausible range.
+
+        Args:
+            test (Plausibility): Test with the limits set for the active observations
+            mask (np.ndarray): Active observations
+            code (int): Flag
+
+        """
+        values = self.columns["values"][mask]
+        minvals = np.asarray(test.minvals[: len(mask)], dtype=np.float64)
+        maxvals = np.asarray(test.maxvals[: len(mask)], dtype=np.float64)
+        bad = mask[(values < minvals) | (values > maxvals)]
+        bad = bad[self.flags[bad] == 0]
+        self.flags[bad] = code
+
+    def blacklist(self, test, mask, code):
+        """Flag blacklisted positions and stations.
+
+        Args:
+            test (Blacklist): Test with the blacklist
+            mask (np.ndarray): Active observations
+            code (int): Flag
+
+        """
+        lons = self.columns["lons"][mask]
+        lats = self.columns["lats"][mask]
+        positions = np.asarray(
+            [
+                Observation.format_lon(lon) + ":" + Observation.format_lat(lat)
+                for lon, lat in zip(lons, lats)
+            ]
+        )
+        bad = np.isin(positions, list(test.blacklist_pos)) | np.isin(
+            self.columns["stids"][mask], list(test.blacklist_stid)
+        )
+        self.flags[mask[bad]] = code
+
+    def redundancy(self, test, mask, code):
+        """Flag redundant observations in the same position.
+
+        Observations are indexed by their formatted position. For each
+        position the first observation is kept unless a later one is closer
+        to the analysis time.
+
+        Args:
+            test (Redundancy): Test
+            mask (np.ndarray): Active observations
+            code (int): Flag
+
+        """
+        lons = self.columns["lons"][mask]
+        lats = self.columns["lats"][mask]
+        positions = [f"{lon:10.5f}:{lat:10.5f}" for lon, lat in zip(lons, lats)]
+        __, inverse, counts = np.unique(
+            positions, return_inverse=True, return_counts=True
+        )
+        # Only positions with more than one observation need to be checked
+        duplicated = counts[inverse] > 1
+        data = {}
+        for i, pos in zip(mask[duplicated], np.asarray(positions)[duplicated]):
+            obstime1 = self.obstimes[i]
+            if pos in data:
+                obstime = data[pos]["obstime"]
+                if abs(test.an_time - obstime1) < abs(test.an_time - obstime):
+                    self.flags[data[pos]["index"]] = code
+                    # Same book keeping as the Redundancy test in pysurfex
+                    data.update({pos: {"obstime": obstime, "index": i}})
+                else:
+                    self.flags[i] = code
+            else:
+                data.update({pos: {"obstime": obstime1, "index": i}})
+
+    def perform_tests(self):
+        """Perform the tests."""
+        start = time.time()
+        summary = {}
+        for test in self.tests:
+            test_start = time.time()
+            logger.info("Test: {}", test.name)
+            mask = self.test_mask(test)
+
+            ok_obs = 0
+            bad = 0
+            outside = 0
+            if len(mask) > 0:
+                code = None
+                if self.test_flags is not None and test.name in self.test_flags:
+                    code = self.test_flags[test.name]
+
+                if test.name == "nometa":
+                    self.nometa(mask, 101 if code is None else code)
+                elif test.name == "plausibility":
+                    self.plausibility(test, mask, 102 if code is None else code)
+                elif test.name == "blacklist":
+                    self.blacklist(test, mask, 100 if code is None else code)
+                elif test.name == "redundancy":
+                    self.redundancy(test, mask, 115 if code is None else code)
+                else:
+                    kwargs = {}
+                    if code is not None:
+                        kwargs.update({"code": code})
+                    self.flags = np.asarray(
+                        test.test(self, mask.tolist(), **kwargs), dtype=np.float64
+                    )
+
+                flags = self.flags[mask]
+                for mask_ind in mask[flags == 0]:
+                    self.passed_tests[mask_ind].append(test.name)
+                # The titanlib vectors only accept Python integers as index
+                for mask_ind in mask[flags != 0].tolist():
+                    self.titan_dataset.flags[mask_ind] = 1
+                ok_obs = int(np.count_nonzero(flags == 0))
+                bad = int(np.count_nonzero(flags != 0))
+                outside = int(np.count_nonzero(flags == 199))
+
+            summary.update(
+                {
+                    test.name: {
+                        "tested": len(mask),
+                        "ok": ok_obs,
+                        "bad": bad,
+                        "outside": outside,
+                        "seconds": time.time() - test_start,
+                    }
+                }
+            )
+
+        kept = int(np.count_nonzero(self.flags == 0))
+        logger.info("Total number of observations: {}", len(self.flags))
+        logger.info("                        Kept: {}", kept)
+        logger.info(
+            "                     Flagged: {} (bad metadata: {})",
+            len(self.flags) - kept,
+            self.metadata,
+        )
+        for name, test_summary in summary.items():
+            logger.info(
+                "Test: {} tested: {} ok: {} bad: {} ({} exceeding max distance) "
+                "time: {:.3f} s",
+                name,
+                test_summary["tested"],
+                test_summary["ok"],
+                test_summary["bad"],
+                test_summary["outside"],
+                test_summary["seconds"],
+            )
+        self.timings = {
+            "observations": len(self.flags),
+            "kept": kept,
+            "seconds": time.time() - start,
+            "tests": summary,
+        }
+
+    def write_timings(self, filename):
+        """Write the timings and rejection counts of the tests.
+
+        Args:
+            filename (str): Filename
+
+        """
+        with open(filename, mode="w", encoding="utf-8") as fhandler:
+            json.dump(self.timings, fhandler, indent=2)
+
+
+def qc_data_set(engine, var, settings, tests, datasources, an_time, test_flags=None):
+    """Create the data set doing the quality control with an engine.
+
+    Args:
+        engine (str): "titan" or "vectorized"
+        var (str): Variable name.
+        settings (dict): Titan test/configuration settings
+        tests (list): Tests to perform in order.
+        datasources (list): List of observations sets.
+        an_time (datetime.datetime): Analysis time
+        test_flags (dict, optional): Dictionary to set custom test flags.
+                                     Defaults to None.
+
+    Raises:
+        NotImplementedError: Unknown engine
+
+    Returns:
+        TitanDataSet: Data set
+
+    """
+    if engine == "titan":
+        return TitanDataSet(
+            var, settings, tests, datasources, an_time, test_flags=test_flags
+        )
+    if engine == "vectorized":
+        return VectorizedTitanDataSet(
+            var, settings, tests, datasources, an_time, test_flags=test_flags
+        )
+    raise NotImplementedError(f"QC engine {engine}")
+
+
+QC_COLUMNS = [
+    "varname",
+    "obstime",
+    "lon",
+    "lat",
+    "stid",
+    "elev",
+    "value",
+    "flag",
+    "epsilon",
+    "laf",
+    "provider",
+    "fg_dep",
+    "an_dep",
+    "passed_tests",
+]
+
+
+def qc_filename(obsdir, var, output_format="json"):
+    """Get the name of a QC output file.
+
+    Args:
+        obsdir (str): Observation directory
+        var (str): Variable name
+        output_format (str, optional): "json" or "npy". Defaults to "json".
+
+    Raises:
+        NotImplementedError: Unknown format
+
+    Returns:
+        str: A json file or a directory with one npy file per column
+
+    """
+    if output_format == "json":
+        return f"{obsdir}/qc_{var}.json"
+    if output_format == "npy":
+        return f"{obsdir}/qc_{var}.npy.d"
+    raise NotImplementedError(f"QC output format {output_format}")
+
+
+def write_qc_npy(data_set, filename):
+    """Write QC data as one NumPy file per column.
+
+    Args:
+        data_set (QCDataSet): QC data set
+        filename (str): Output directory
+
+    """
+    nobs = len(data_set.lons)
+    columns = {
+        "varname": np.asarray([str(var) for var in data_set.varnames], dtype=str),
+        "obstime": np.asarray(
+            [obstime.strftime("%Y%m%d%H%M%S") for obstime in data_set.obstimes],
+            dtype=str,
+        ),
+        "lon": np.asarray(data_set.lons, dtype=np.float64),
+        "lat": np.asarray(data_set.lats, dtype=np.float64),
+        "stid": np.asarray([str(stid) for stid in data_set.stids], dtype=str),
+        "elev": np.asarray(data_set.elevs, dtype=np.float64),
+        "value": np.asarray(data_set.values, dtype=np.float64),
+        "flag": np.asarray(data_set.flags, dtype=np.float64),
+        "epsilon": np.asarray(data_set.epsilons, dtype=np.float64),
+        "laf": np.asarray(data_set.lafs, dtype=np.float64),
+        "provider": np.asarray([str(prov) for prov in data_set.providers], dtype=str),
+        "fg_dep": np.asarray(data_set.fg_dep, dtype=np.float64),
+        "an_dep": np.asarray(data_set.an_dep, dtype=np.float64),
+        "passed_tests": np.asarray(
+            [",".join(tests) for tests in data_set.passed_tests], dtype=str
+        ),
+    }
+    tmp_filename = f"{filename}.tmp.{os.getpid()}"
+    os.makedirs(tmp_filename, exist_ok=True)
+    for column, values in columns.items():
+        np.save(f"{tmp_filename}/{column}.npy", values.reshape(nobs))
+    if os.path.exists(filename):
+        shutil.rmtree(filename)
+    os.rename(tmp_filename, filename)
+
+
+def write_qc_output(data_set, filename, indent=None):
+    """Write QC output in the format given by the file name.
+
+    Args:
+        data_set (QCDataSet): QC data set
+        filename (str): Output file from qc_filename
+        indent (int, optional): Indentation for json. Defaults to None.
+
+    """
+    if filename.endswith(".npy.d"):
+        write_qc_npy(data_set, filename)
+    else:
+        data_set.write_output(filename, indent=indent)
+
+
+def read_qc_npy(filename):
+    """Read QC data written by write_qc_npy.
+
+    Args:
+        filename (str): Directory with one npy file per column
+
+    Returns:
+        dict: Memory mapped array for each column
+
+    """
+    return {
+        column: np.load(f"{filename}/{column}.npy", mmap_mode="r")
+        for column in QC_COLUMNS
+    }
+
+
+class ColumnDataSet(QCDataSet):
+    """QC data set holding its columns as arrays.
+
+    The OI, the departures and obsmon only use the column attributes of a
+    QC data set, so no Observation object is created per row.
+
+    """
+
+    def __init__(self, analysis_time, columns, passed_tests=None):
+        """Construct the data set.
+
+        Args:
+            analysis_time (datetime.datetime): Analysis time
+            columns (dict): Array for each column in QC_COLUMNS
+            passed_tests (list, optional): Tests passed by each observation.
+                                           Defaults to None.
+
+        """
+        self.analysis_time = analysis_time
+        nobs = len(columns["lon"])
+        # Observations share few distinct times
+        times, inverse = np.unique(np.asarray(columns["obstime"]), return_inverse=True)
+        obstimes = np.empty(len(times), dtype=object)
+        obstimes[:] = [as_datetime(str(obstime)) for obstime in times]
+        self.obstimes = obstimes[inverse]
+        self.lons = columns["lon"]
+        self.lats = columns["lat"]
+        self.elevs = columns["elev"]
+        self.stids = columns["stid"]
+        self.values = columns["value"]
+        self.varnames = columns["varname"]
+        self.epsilons = columns["epsilon"]
+        self.flags = columns["flag"]
+        self.metadata = 0
+        self.lafs = columns["laf"]
+        self.providers = columns["provider"]
+        if passed_tests is None:
+            passed_tests = [[] for __ in range(nobs)]
+        self.passed_tests = passed_tests
+        self.fg_dep = columns["fg_dep"]
+        self.an_dep = columns["an_dep"]
+
+    @cached_property
+    def index_pos(self):
+        """Index of the observations by position."""
+        lons = np.char.mod("%10.5f", np.asarray(self.lons, dtype=np.float64))
+        lats = np.char.mod("%10.5f", np.asarray(self.lats, dtype=np.float64))
+        positions = np.char.add(np.char.add(lons, ":"), lats)
+        return {pos: i for i, pos in enumerate(positions.tolist())}
+
+    @cached_property
+    def index_stid(self):
+        """Index of the observations by station ID."""
+        return {
+            stid: i
+            for i, stid in enumerate(np.asarray(self.stids).tolist())
+            if stid != "NA"
+        }
+
+    def perform_tests(self):
+        """Perform the tests.
+
+        Raises:
+            NotImplementedError: The data set is only read
+
+        """
+        raise NotImplementedError("Tests are not performed on stored QC data")
+
+
+def dataset_from_npy(
+    an_time, filename, qc_flag=None, skip_flags=None, fg_dep=None, an_dep=None
+):
+    """Create a QC data set from QC data written by write_qc_npy.
+
+    Selects the same observations as dataset_from_file in pysurfex. The
+    columns stay memory mapped if all observations are selected.
+
+    Args:
+        an_time (datetime.datetime): Analysis time.
+        filename (str): Directory with one npy file per column
+        qc_flag (int, optional): QC code to merge. Defaults to None.
+        skip_flags (list, optional): List of QC flags to skip. Defaults to None.
+        fg_dep (list, optional): First guess departures. Defaults to None.
+        an_dep (list, optional): Analysis departures. Defaults to None.
+
+    Returns:
+        ColumnDataSet: QC data set
+
+    """
+    columns = read_qc_npy(filename)
+    flags = columns["flag"]
+    add = np.ones(flags.shape, dtype=bool)
+    if qc_flag is not None:
+        add = flags == qc_flag
+    if skip_flags is not None:
+        for sfl in skip_flags:
+            add = add & (flags.astype(int) != int(sfl))
+    # Departures are given for the rows of the file
+    index = np.flatnonzero(add)
+    nobs = len(index)
+    if nobs < len(flags):
+        columns = {column: values[add] for column, values in columns.items()}
+
+    if fg_dep is not None:
+        if isinstance(fg_dep, float):
+            columns["fg_dep"] = np.full(nobs, fg_dep)
+        else:
+            columns["fg_dep"] = np.asarray(fg_dep, dtype=np.float64)[index]
+    if an_dep is not None:
+        if isinstance(an_dep, float):
+            columns["an_dep"] = np.full(nobs, an_dep)
+        else:
+            columns["an_dep"] = np.asarray(an_dep, dtype=np.float64)[index]
+
+    passed_tests = None
+    if nobs > 0:
+        passed_tests = [
+            [test for test in tests.split(",") if test != ""]
+            for tests in np.asarray(columns["passed_tests"]).tolist()
+        ]
+    return ColumnDataSet(an_time, columns, passed_tests=passed_tests)
+
+
+def read_qc_dataset(
+    an_time, filename, qc_flag=None, skip_flags=None, fg_dep=None, an_dep=None
+):
+    """Read QC output in the format given by the file name.
+
+    Args:
+        an_time (datetime.datetime): Analysis time.
+        filename (str): QC file from qc_filename
+        qc_flag (int, optional): QC code to merge. Defaults to None.
+        skip_flags (list, optional): List of QC flags to skip. Defaults to None.
+        fg_dep (list, optional): First guess departures. Defaults to None.
+        an_dep (list, optional): Analysis departures. Defaults to None.
+
+    Returns:
+        QCDataSet: QCDataSet
+
+    """
+    if filename.endswith(".npy.d"):
+        return dataset_from_npy(
+            an_time,
+            filename,
+            qc_flag=qc_flag,
+            skip_flags=skip_flags,
+            fg_dep=fg_dep,
+            an_dep=an_dep,
+        )
+    return dataset_from_file(
+        an_time,
+        filename,
+        qc_flag=qc_flag,
+        skip_flags=skip_flags,
+        fg_dep=fg_dep,
+        an_dep=an_dep,
+    )
+
+
+def get_qc_output_format(config):
+    """Get the configured QC output format.
+
+    Args:
+        config (ParsedConfig): Configuration
+
+    Returns:
+        str: "json" or "npy"
+
+    """
+    try:
+        output_format = config["observations.qc.output_format"]
+    except KeyError:
+        output_format = "json"
+    return output_format
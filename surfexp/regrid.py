@@ -0,0 +1,363 @@
+"""Regridding with interpolation weights cached on disk."""
+import hashlib
+import os
+import shutil
+
+import numpy as np
+from deode.logs import logger
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None  # noqa: N816
+
+
+def geo_hash(lons, lats):
+    """Create a hash of the coordinates of a geometry.
+
+    Args:
+        lons (np.ndarray): Longitudes
+        lats (np.ndarray): Latitudes
+
+    Returns:
+        str: Hex digest
+
+    """
+    digest = hashlib.sha256()
+    for values in (lons, lats):
+        coords = np.ascontiguousarray(values, dtype=np.float64)
+        digest.update(str(coords.shape).encode("utf-8"))
+        digest.update(coords.tobytes())
+    return digest.hexdigest()
+
+
+def lonlat2xyz(lons, lats):
+    """Convert longitudes and latitudes to points on the unit sphere.
+
+    Args:
+        lons (np.ndarray): Longitudes
+        lats (np.ndarray): Latitudes
+
+    Returns:
+        np.ndarray: Cartesian coordinates with shape (npoints, 3)
+
+    """
+    lons = np.radians(np.asarray(lons, dtype=np.float64).ravel())
+    lats = np.radians(np.asarray(lats, dtype=np.float64).ravel())
+    return np.column_stack(
+        (np.cos(lats) * np.cos(lons), np.cos(lats) * np.sin(lons), np.sin(lats))
+    )
+
+
+def nearest_neighbours(src_lons, src_lats, dst_lons, dst_lats):
+    """Find the nearest source point for each target point.
+
+    Args:
+        src_lons (np.ndarray): Source longitudes
+        src_lats (np.ndarray): Source latitudes
+        dst_lons (np.ndarray): Target longitudes
+        dst_lats (np.ndarray): Target latitudes
+
+    Raises:
+        RuntimeError: scipy is not installed
+
+    Returns:
+        np.ndarray: Flat index into the source grid for each target point
+
+    """
+    if cKDTree is None:
+        raise RuntimeError(
+            "You need scipy to compute interpolation weights. Install surfexp[scipy]"
+        )
+    tree = cKDTree(lonlat2xyz(src_lons, src_lats))
+    __, index = tree.query(lonlat2xyz(dst_lons, dst_lats))
+    return index
+
+
+def inverse_bilinear(corners, iterations=10):
+    """Find the position of the origin inside quadrilaterals.
+
+    Solves P(s, t) = 0 where P is the bilinear mapping of the unit square onto
+    each quadrilateral.
+
+    Args:
+        corners (np.ndarray): Corners p00, p10, p01, p11 with shape (npoints, 4, 2)
+        iterations (int, optional): Newton iterations. Defaults to 10.
+
+    Returns:
+        tuple: s and t for each quadrilateral
+
+    """
+    p00, p10, p01, p11 = (corners[:, k, :] for k in range(4))
+    a_vec = p10 - p00
+    b_vec = p01 - p00
+    c_vec = p11 - p10 - p01 + p00
+    s_par = np.full(corners.shape[0], 0.5)
+    t_par = np.full(corners.shape[0], 0.5)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for __ in range(iterations):
+            res = (
+                p00
+                + a_vec * s_par[:, None]
+                + b_vec * t_par[:, None]
+                + c_vec * (s_par * t_par)[:, None]
+            )
+            d_s = a_vec + c_vec * t_par[:, None]
+            d_t = b_vec + c_vec * s_par[:, None]
+            det = d_s[:, 0] * d_t[:, 1] - d_s[:, 1] * d_t[:, 0]
+            s_par = s_par - (res[:, 0] * d_t[:, 1] - res[:, 1] * d_t[:, 0]) / det
+            t_par = t_par - (d_s[:, 0] * res[:, 1] - d_s[:, 1] * res[:, 0]) / det
+    return s_par, t_par
+
+
+def compute_weights(src_lons, src_lats, dst_lons, dst_lats, method="bilinear"):
+    """Compute interpolation weights from a source grid to target points.
+
+    Args:
+        src_lons (np.ndarray): Source longitudes with shape (nx, ny)
+        src_lats (np.ndarray): Source latitudes with shape (nx, ny)
+        dst_lons (np.ndarray): Target longitudes
+        dst_lats (np.ndarray): Target latitudes
+        method (str, optional): "nearest" or "bilinear". Defaults to "bilinear".
+
+    Raises:
+        NotImplementedError: Unknown method
+
+    Returns:
+        tuple: Flat source index and weights, both with shape (npoints, 4)
+
+    """
+    if method not in ("nearest", "bilinear"):
+        raise NotImplementedError(method)
+
+    src_lons = np.asarray(src_lons, dtype=np.float64)
+    src_lats = np.asarray(src_lats, dtype=np.float64)
+    dst_lons = np.asarray(dst_lons, dtype=np.float64).ravel()
+    dst_lats = np.asarray(dst_lats, dtype=np.float64).ravel()
+    npoints = dst_lons.shape[0]
+
+    nearest = nearest_neighbours(src_lons, src_lats, dst_lons, dst_lats)
+    index = np.repeat(nearest[:, None], 4, axis=1)
+    weights = np.zeros((npoints, 4))
+    weights[:, 0] = 1.0
+    if method == "nearest" or src_lons.ndim != 2:
+        return index, weights
+
+    n_x, n_y = src_lons.shape
+    i_near, j_near = np.unravel_index(nearest, (n_x, n_y))
+    cos_lat = np.cos(np.radians(dst_lats))
+    found = np.zeros(npoints, dtype=bool)
+    eps = 1.0e-6
+    # Try the four cells sharing the nearest grid point
+    for d_i in (-1, 0):
+        for d_j in (-1, 0):
+            i_0 = i_near + d_i
+            j_0 = j_near + d_j
+            todo = ~found & (i_0 >= 0) & (i_0 < n_x - 1) & (j_0 >= 0) & (j_0 < n_y - 1)
+            if not np.any(todo):
+                continue
+            cell_i = np.column_stack((i_0, i_0 + 1, i_0, i_0 + 1))[todo]
+            cell_j = np.column_stack((j_0, j_0, j_0 + 1, j_0 + 1))[todo]
+            # Local plane centered on the target point
+            d_lon = (src_lons[cell_i, cell_j] - dst_lons[todo, None] + 180.0) % 360.0
+            d_lon = (d_lon - 180.0) * cos_lat[todo, None]
+            d_lat = src_lats[cell_i, cell_j] - dst_lats[todo, None]
+            s_par, t_par = inverse_bilinear(np.stack((d_lon, d_lat), axis=2))
+            inside = (
+                (s_par >= -eps)
+                & (s_par <= 1.0 + eps)
+                & (t_par >= -eps)
+                & (t_par <= 1.0 + eps)
+            )
+            s_par = np.clip(s_par[inside], 0.0, 1.0)
+            t_par = np.clip(t_par[inside], 0.0, 1.0)
+            points = np.flatnonzero(todo)[inside]
+            index[points] = np.ravel_multi_index(
+                (cell_i[inside], cell_j[inside]), (n_x, n_y)
+            )
+            weights[points] = np.column_stack(
+                (
+                    (1.0 - s_par) * (1.0 - t_par),
+                    s_par * (1.0 - t_par),
+                    (1.0 - s_par) * t_par,
+                    s_par * t_par,
+                )
+            )
+            found[points] = True
+
+    nmissing = npoints - np.count_nonzero(found)
+    if nmissing > 0:
+        logger.info(
+            "Use nearest neighbour for {} points outside the source grid", nmissing
+        )
+    return index, weights
+
+
+def regrid(field, index, weights):
+    """Apply interpolation weights to a field.
+
+    Args:
+        field (np.ndarray): Field on the source grid
+        index (np.ndarray): Flat source index with shape (npoints, 4)
+        weights (np.ndarray): Weights with shape (npoints, 4)
+
+    Returns:
+        np.ndarray: Values in the target points
+
+    """
+    field = np.asarray(field).ravel()
+    return np.sum(field[index] * weights, axis=1)
+
+
+def regrid_fields(fields, index, weights):
+    """Apply interpolation weights to several fields on the same source grid.
+
+    Args:
+        fields (list): Fields on the source grid
+        index (np.ndarray): Flat source index with shape (npoints, 4)
+        weights (np.ndarray): Weights with shape (npoints, 4)
+
+    Returns:
+        np.ndarray: Values in the target points with shape (nfields, npoints)
+
+    """
+    stack = np.stack([np.asarray(field).ravel() for field in fields])
+    return np.sum(stack[:, index] * weights, axis=2)
+
+
+class WeightCache:
+    """Interpolation weights stored as memory-mappable NumPy arrays.
+
+    Entries are keyed by a hash of the source coordinates, a hash of the
+    target coordinates and the interpolation method.
+
+    """
+
+    def __init__(self, cache_dir):
+        """Construct the cache.
+
+        Args:
+            cache_dir (str): Cache directory.
+
+        """
+        self.cache_dir = cache_dir
+        self.weights = {}
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def entry(self, src_lons, src_lats, dst_lons, dst_lats, method):
+        """Get the directory of a cache entry.
+
+        Args:
+            src_lons (np.ndarray): Source longitudes
+            src_lats (np.ndarray): Source latitudes
+            dst_lons (np.ndarray): Target longitudes
+            dst_lats (np.ndarray): Target latitudes
+            method (str): Interpolation method
+
+        Returns:
+            str: Entry directory
+
+        """
+        src = geo_hash(src_lons, src_lats)[:16]
+        dst = geo_hash(dst_lons, dst_lats)[:16]
+        return f"{self.cache_dir}/{src}_{dst}_{method}"
+
+    def get(self, src_lons, src_lats, dst_lons, dst_lats, method="bilinear"):
+        """Get interpolation weights, computing and storing them if needed.
+
+        Args:
+            src_lons (np.ndarray): Source longitudes with shape (nx, ny)
+            src_lats (np.ndarray): Source latitudes with shape (nx, ny)
+            dst_lons (np.ndarray): Target longitudes
+            dst_lats (np.ndarray): Target latitudes
+            method (str, optional): Interpolation method. Defaults to "bilinear".
+
+        Returns:
+            tuple: Flat source index and weights
+
+        """
+        entry = self.entry(src_lons, src_lats, dst_lons, dst_lats, method)
+        if entry in self.weights:
+            return self.weights[entry]
+
+        index_file = f"{entry}/index.npy"
+        weights_file = f"{entry}/weights.npy"
+        if os.path.exists(index_file) and os.path.exists(weights_file):
+            logger.info("Use cached interpolation weights {}", entry)
+            index = np.load(index_file, mmap_mode="r")
+            weights = np.load(weights_file, mmap_mode="r")
+        else:
+            logger.info("Compute {} interpolation weights for {}", method, entry)
+            index, weights = compute_weights(
+                src_lons, src_lats, dst_lons, dst_lats, method=method
+            )
+            tmp_entry = f"{entry}.tmp.{os.getpid()}"
+            os.makedirs(tmp_entry, exist_ok=True)
+            np.save(f"{tmp_entry}/index.npy", index)
+            np.save(f"{tmp_entry}/weights.npy", weights)
+            try:
+                os.rename(tmp_entry, entry)
+            except OSError:
+                # Stored by somebody else in the meantime
+                shutil.rmtree(tmp_entry, ignore_errors=True)
+
+        self.weights[entry] = (index, weights)
+        return index, weights
+
+    def regrid(self, field, src_lons, src_lats, dst_lons, dst_lats, method="bilinear"):
+        """Regrid a field using cached weights.
+
+        Args:
+            field (np.ndarray): Field on the source grid
+            src_lons (np.ndarray): Source longitudes with shape (nx, ny)
+            src_lats (np.ndarray): Source latitudes with shape (nx, ny)
+            dst_lons (np.ndarray): Target longitudes
+            dst_lats (np.ndarray): Target latitudes
+            method (str, optional): Interpolation method. Defaults to "bilinear".
+
+        Returns:
+            np.ndarray: Values in the target points
+
+        """
+        index, weights = self.get(src_lons, src_lats, dst_lons, dst_lats, method=method)
+        return regrid(field, index, weights)
+
+    def regrid_fields(
+        self, fields, src_lons, src_lats, dst_lons, dst_lats, method="bilinear"
+    ):
+        """Regrid several fields on the same source grid using cached weights.
+
+        Args:
+            fields (list): Fields on the source grid
+            src_lons (np.ndarray): Source longitudes with shape (nx, ny)
+            src_lats (np.ndarray): Source latitudes with shape (nx, ny)
+            dst_lons (np.ndarray): Target longitudes
+            dst_lats (np.ndarray): Target latitudes
+            method (str, optional): Interpolation method. Defaults to "bilinear".
+
+        Returns:
+            np.ndarray: Values in the target points with shape (nfields, npoints)
+
+        """
+        index, weights = self.get(src_lons, src_lats, dst_lons, dst_lats, method=method)
+        return regrid_fields(fields, index, weights)
+
+
+def get_weight_cache(config, platform):
+    """Get the interpolation weight cache if configured.
+
+    Args:
+        config (ParsedConfig): Configuration
+        platform (Platform): Platform used for substitution
+
+    Returns:
+        WeightCache: The cache or None if not configured.
+
+    """
+    try:
+        cache_dir = config["pysurfex.weights_cache_dir"]
+    except KeyError:
+        cache_dir = ""
+    if cache_dir is None or cache_dir == "":
+        return None
+    return WeightCache(platform.substitute(cache_dir))
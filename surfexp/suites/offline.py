@@ -11,7 +11,24 @@ from deode.suites.base import (
     SuiteDefinition,
 )
 
+from surfexp.events import forcing_event
 from surfexp.experiment import get_nnco, get_total_unique_cycle_list, setting_is
+from surfexp.pipeline import get_input_cycles_ahead
+
+
+class EcflowEvent:
+    """An event of a suite task, to trigger on."""
+
+    def __init__(self, task, name):
+        """Construct the event.
+
+        Args:
+            task (EcflowSuiteTask): Task setting the event
+            name (str): Event name
+
+        """
+        self.name = name
+        self.path = f"{task.path}:{name}"
 
 
 class SurfexSuiteDefinition(SuiteDefinition):
@@ -50,7 +67,7 @@ class SurfexSuiteDefinition(SuiteDefinition):
         if self.mode == "restart":
             self.do_prep = False
 
-        input_cycles_ahead = 3
+        input_cycles_ahead = get_input_cycles_ahead(config)
         unique_cycles = get_total_unique_cycle_list(config)
         basetime = as_datetime(config["general.times.basetime"])
         starttime = as_datetime(config["general.times.start"])
@@ -229,11 +246,25 @@ class SurfexSuiteDefinition(SuiteDefinition):
                 )
             static_complete = EcflowSuiteTrigger(static_data)
 
+        # One forcing task may create the forcing of several consecutive cycles
+        try:
+            forcing_cycles = int(config["forcing.cycles_per_task"])
+        except KeyError:
+            forcing_cycles = 1
+        # Start the forecast of a cycle on an event set by the forcing task
+        # of the batch when the forcing of the cycle is ready
+        try:
+            stream_forcing = config["forcing.stream"] and forcing_cycles > 1
+        except KeyError:
+            stream_forcing = False
+        modify_forcing = config["forcing.modify_forcing"]
+        forcing_complete = None
+
         prep_complete = None
         days = []
         cycle_input_nodes = {}
         prediction_nodes = {}
-        for cycle in cycles.values():
+        for icycle, cycle in enumerate(cycles.values()):
             cycle_day = cycle["day"]
             basetime = as_datetime(cycle["basetime"])
             c_index = basetime.strftime("%Y%m%d%H%M")
@@ -284,21 +315,40 @@ class SurfexSuiteDefinition(SuiteDefinition):
 
             triggers.add_triggers([prepare_cycle_complete])
 
-            cycle_input = EcflowSuiteFamily(
-                "CycleInput", time_family, self.ecf_files, trigger=triggers
-            )
+            first_in_batch = icycle % forcing_cycles == 0
+            cycle_input = None
+            if first_in_batch or modify_forcing:
+                cycle_input = EcflowSuiteFamily(
+                    "CycleInput", time_family, self.ecf_files, trigger=triggers
+                )
 
-            forcing = EcflowSuiteTask(
-                "Forcing",
-                cycle_input,
-                config,
-                self.task_settings,
-                self.ecf_files,
-                input_template=template,
-            )
-            triggers = EcflowSuiteTriggers([EcflowSuiteTrigger(forcing)])
-            if config["forcing.modify_forcing"]:
-                EcflowSuiteTask(
+            if first_in_batch:
+                variables = None
+                batch_cycles = min(forcing_cycles, len(cycles) - icycle)
+                if batch_cycles > 1:
+                    variables = {"ARGS": f"cycles={batch_cycles}"}
+                forcing = EcflowSuiteTask(
+                    "Forcing",
+                    cycle_input,
+                    config,
+                    self.task_settings,
+                    self.ecf_files,
+                    input_template=template,
+                    variables=variables,
+                )
+                forcing_complete = EcflowSuiteTrigger(forcing)
+                if stream_forcing:
+                    for index in range(batch_cycles):
+                        forcing.ecf_node.add_event(forcing_event(index))
+            forcing_ready = forcing_complete
+            if stream_forcing:
+                forcing_ready = EcflowSuiteTrigger(
+                    EcflowEvent(forcing, forcing_event(icycle % forcing_cycles)),
+                    mode="set",
+                )
+            triggers = EcflowSuiteTriggers([forcing_ready])
+            if modify_forcing:
+                modify = EcflowSuiteTask(
                     "ModifyForcing",
                     cycle_input,
                     config,
@@ -566,7 +616,13 @@ class SurfexSuiteDefinition(SuiteDefinition):
                         )
                         fetchobs_complete = EcflowSuiteTrigger(fetchobs)
 
+                    try:
+                        multi_oi = config["observations.oi.multi_variable"]
+                    except KeyError:
+                        multi_oi = False
+
                     triggers = []
+                    oi_variables = []
                     for var, active in an_variables.items():
                         if active:
                             variables = {"ARGS": f"var_name={var};"}
@@ -593,20 +649,46 @@ class SurfexSuiteDefinition(SuiteDefinition):
                                 trigger=qc_triggers,
                                 input_template=template,
                             )
-                            oi_triggers = EcflowSuiteTriggers(
-                                [EcflowSuiteTrigger(qc_task), EcflowSuiteTrigger(fg4oi)]
-                            )
-                            EcflowSuiteTask(
-                                "OptimalInterpolation",
-                                an_var_fam,
-                                config,
-                                self.task_settings,
-                                self.ecf_files,
-                                trigger=oi_triggers,
-                                input_template=template,
-                            )
+                            if multi_oi:
+                                oi_variables.append(var)
+                            else:
+                                oi_triggers = EcflowSuiteTriggers(
+                                    [
+                                        EcflowSuiteTrigger(qc_task),
+                                        EcflowSuiteTrigger(fg4oi),
+                                    ]
+                                )
+                                EcflowSuiteTask(
+                                    "OptimalInterpolation",
+                                    an_var_fam,
+                                    config,
+                                    self.task_settings,
+                                    self.ecf_files,
+                                    trigger=oi_triggers,
+                                    input_template=template,
+                                )
                             triggers.append(EcflowSuiteTrigger(an_var_fam))
 
+                    if len(oi_variables) > 0:
+                        # One task analyses all variables after their quality control
+                        variables = {"ARGS": f"var_names={','.join(oi_variables)};"}
+                        oi_family = EcflowSuiteFamily(
+                            "MultiOI",
+                            analysis,
+                            self.ecf_files,
+                            trigger=EcflowSuiteTriggers([*triggers, fg4oi_complete]),
+                            variables=variables,
+                        )
+                        EcflowSuiteTask(
+                            "MultiOptimalInterpolation",
+                            oi_family,
+                            config,
+                            self.task_settings,
+                            self.ecf_files,
+                            input_template=template,
+                        )
+                        triggers = [EcflowSuiteTrigger(oi_family)]
+
                     oi2soda_complete = None
                     if len(triggers) > 0:
                         triggers = EcflowSuiteTriggers(triggers)
@@ -666,8 +748,18 @@ class SurfexSuiteDefinition(SuiteDefinition):
                     )
 
             self.do_prep = False
+            if cycle_input is None:
+                # Forcing is created by the forcing task of an earlier cycle
+                cycle_input_complete = forcing_ready
+            elif stream_forcing:
+                # The forcing task of the batch may still be running
+                cycle_input_complete = forcing_ready
+                if modify_forcing:
+                    cycle_input_complete = EcflowSuiteTrigger(modify)
+            else:
+                cycle_input_complete = EcflowSuiteTrigger(cycle_input)
             triggers = EcflowSuiteTriggers(
-                [EcflowSuiteTrigger(cycle_input), EcflowSuiteTrigger(initialization)]
+                [cycle_input_complete, EcflowSuiteTrigger(initialization)]
             )
             prediction = EcflowSuiteFamily(
                 "Prediction", time_family, self.ecf_files, trigger=triggers
@@ -699,6 +791,21 @@ class SurfexSuiteDefinition(SuiteDefinition):
                 "PostProcessing", time_family, self.ecf_files, trigger=triggers
             )
 
+            try:
+                clean_forcing = config["forcing.cleanup"]
+            except KeyError:
+                clean_forcing = False
+            if clean_forcing:
+                # Forcing of the previous cycle is no longer used
+                EcflowSuiteTask(
+                    "CleanForcing",
+                    pp_fam,
+                    config,
+                    self.task_settings,
+                    self.ecf_files,
+                    input_template=template,
+                )
+
             log_pp_trigger = None
             if analysis is not None:
                 qc2obsmon = EcflowSuiteTask(
@@ -1,12 +1,15 @@
 """Forcing task."""
 import json
 import os
+import shutil
+import time
 
 import pysurfex
-import yaml
 from deode.logs import logger
-from pysurfex.forcing import modify_forcing, run_time_loop, set_forcing_config
 
+from surfexp.cache import directory_size, get_forcing_input_cache
+from surfexp.events import forcing_event, set_event
+from surfexp.pipeline import get_statistics_file, record_task
 from surfexp.tasks.tasks import PySurfexBaseTask
 
 
@@ -30,6 +33,109 @@ class Forcing(PySurfexBaseTask):
         except KeyError:
             user_config = None
         self.user_config = user_config
+        # Number of consecutive cycles created by the task
+        try:
+            self.cycles = int(self.config["task.args.cycles"])
+        except KeyError:
+            self.cycles = 1
+        # The suite starts the forecast of a cycle on an event of this task
+        try:
+            self.stream = (
+                self.config["forcing.stream"]
+                and int(self.config["forcing.cycles_per_task"]) > 1
+            )
+        except KeyError:
+            self.stream = False
+        # Processes reading the input. 0 uses the available cores
+        try:
+            self.processes = int(self.config["forcing.processes"])
+        except KeyError:
+            self.processes = 1
+        if self.processes < 1:
+            self.processes = len(os.sched_getaffinity(0))
+        try:
+            self.window = int(self.config["forcing.window"])
+        except KeyError:
+            self.window = None
+
+    def input_urls(self, input_cache, timestep, first, last):
+        """Get the input files of a period.
+
+        Args:
+            input_cache (ForcingInputCache): Forcing input cache
+            timestep (int): Forcing time step in seconds
+            first (datetime): First time
+            last (datetime): Last time
+
+        Returns:
+            list: Input files
+
+        """
+        from deode.datetime_utils import as_timedelta
+        from pysurfex.util import parse_filepattern
+
+        step = as_timedelta(seconds=timestep)
+        times = []
+        this_time = first
+        while this_time <= last:
+            times.append(this_time)
+            this_time = this_time + step
+        return [parse_filepattern(input_cache.pattern, t, t) for t in times]
+
+    def fetch_input(self, input_cache, timestep):
+        """Fetch the input of the task.
+
+        Args:
+            input_cache (ForcingInputCache): Forcing input cache
+            timestep (int): Forcing time step in seconds
+
+        """
+        from deode.datetime_utils import as_timedelta
+
+        step = as_timedelta(seconds=timestep)
+        dtg_stop = self.dtg + self.fcint * self.cycles
+        # The step before the start is only used by some converters
+        input_cache.fetch_all(
+            self.input_urls(input_cache, timestep, self.dtg - step, self.dtg - step),
+            required=False,
+        )
+        input_cache.fetch_all(self.input_urls(input_cache, timestep, self.dtg, dtg_stop))
+
+    def prefetch_input(self, input_cache, timestep):
+        """Fetch the input of the next cycles in the background.
+
+        Args:
+            input_cache (ForcingInputCache): Forcing input cache
+            timestep (int): Forcing time step in seconds
+
+        """
+        from deode.datetime_utils import as_timedelta
+
+        try:
+            prefetch_cycles = int(self.config["forcing.input_cache.prefetch_cycles"])
+        except KeyError:
+            prefetch_cycles = 1
+        if prefetch_cycles > 0:
+            step = as_timedelta(seconds=timestep)
+            dtg_stop = self.dtg + self.fcint * self.cycles
+            input_cache.prefetch(
+                self.input_urls(
+                    input_cache,
+                    timestep,
+                    dtg_stop + step,
+                    dtg_stop + self.fcint * prefetch_cycles,
+                )
+            )
+
+    def forcing_ready(self, index):
+        """Set the event of a cycle when its forcing is ready.
+
+        Args:
+            index (int): Index of the cycle in the task
+
+        """
+        if self.stream:
+            set_event(forcing_event(index))
 
     def execute(self):
         """Execute the forcing task.
@@ -38,10 +144,11 @@ class Forcing(PySurfexBaseTask):
             NotImplementedError: _description_
 
         """
+        from pysurfex.forcing import run_time_loop, set_forcing_config
+
         kwargs = {}
         if self.user_config is not None:
-            with open(self.user_config, mode="r", encoding="utf-8") as fh:
-                user_config = yaml.safe_load(fh)
+            user_config = self.load_definitions(self.user_config)
             kwargs.update({"user_config": user_config})
 
         domain_json = self.geo.json
@@ -58,23 +165,27 @@ class Forcing(PySurfexBaseTask):
             global_config = (
                 f"{os.path.dirname(pysurfex.__path__[0])}/pysurfex/cfg/config.yml"
             )
-        with open(global_config, mode="r", encoding="utf-8") as file_handler:
-            global_config = yaml.safe_load(file_handler)
+        global_config = self.load_definitions(global_config)
         kwargs.update({"config": global_config})
 
+        dtg_stop = self.dtg + self.fcint * self.cycles
         kwargs.update({"dtg_start": self.dtg.strftime("%Y%m%d%H")})
-        kwargs.update({"dtg_stop": (self.dtg + self.fcint).strftime("%Y%m%d%H")})
-
-        forcing_dir = self.platform.get_system_value("forcing_dir")
-        forcing_dir = self.platform.substitute(forcing_dir, basetime=self.dtg)
-        os.makedirs(forcing_dir, exist_ok=True)
+        kwargs.update({"dtg_stop": dtg_stop.strftime("%Y%m%d%H")})
 
         output_format = self.config["SURFEX.IO.CFORCING_FILETYPE"].lower()
-        if output_format == "netcdf":
-            output = forcing_dir + "/FORCING.nc"
-        else:
+        if output_format != "netcdf":
             raise NotImplementedError(output_format)
 
+        # Each cycle has its own forcing directory
+        cycles = []
+        forcing_dir_pattern = self.platform.get_system_value("forcing_dir")
+        for icycle in range(self.cycles):
+            basetime = self.dtg + self.fcint * icycle
+            forcing_dir = self.platform.substitute(forcing_dir_pattern, basetime=basetime)
+            os.makedirs(forcing_dir, exist_ok=True)
+            cycles.append((basetime, basetime + self.fcint, forcing_dir + "/FORCING.nc"))
+        output = cycles[0][2]
+
         kwargs.update({"of": output})
         kwargs.update({"output_format": output_format})
 
@@ -101,6 +212,13 @@ class Forcing(PySurfexBaseTask):
         timestep = self.config["forcing.timestep"]
         interpolation = self.config["forcing.interpolation"]
 
+        input_cache = get_forcing_input_cache(
+            self.config, self.platform, pattern, geo=self.geo
+        )
+        if input_cache is not None and not analysis:
+            logger.warning("Forcing input cache is only used for analysis input")
+            input_cache = None
+
         kwargs.update({"input_format": input_format})
         kwargs.update({"pattern": pattern})
         kwargs.update({"zref": zref})
@@ -123,11 +241,61 @@ class Forcing(PySurfexBaseTask):
         kwargs.update({"analysis": analysis})
         kwargs.update({"interpolation": interpolation})
 
-        if os.path.exists(output):
+        if all(os.path.exists(cycle[2]) for cycle in cycles):
             logger.info("Output already exists: {}", output)
+            for index in range(self.cycles):
+                self.forcing_ready(index)
         else:
-            options, var_objs, att_objs = set_forcing_config(**kwargs)
-            run_time_loop(options, var_objs, att_objs)
+            start = time.time()
+            try:
+                if input_cache is not None:
+                    # Protects what this task fetches from eviction by other tasks
+                    input_cache.acquire()
+                    self.fetch_input(input_cache, timestep)
+                    kwargs.update({"pattern": input_cache.local_pattern()})
+                    logger.info(
+                        "Read forcing input from the cache: {}", kwargs["pattern"]
+                    )
+                options, var_objs, att_objs = set_forcing_config(**kwargs)
+
+                def prefetch():
+                    if input_cache is not None:
+                        self.prefetch_input(input_cache, timestep)
+
+                if self.cycles == 1 and self.processes == 1:
+                    prefetch()
+                    run_time_loop(options, var_objs, att_objs)
+                    self.forcing_ready(0)
+                else:
+                    from surfexp.forcing import run_batched_time_loop
+
+                    # The download threads must not run while the readers are forked
+                    run_batched_time_loop(
+                        options,
+                        var_objs,
+                        att_objs,
+                        cycles,
+                        processes=self.processes,
+                        window=self.window,
+                        started=prefetch,
+                        finished=self.forcing_ready,
+                    )
+            finally:
+                # A lease left behind would keep everything newer from eviction
+                if input_cache is not None:
+                    input_cache.wait()
+                    input_cache.release()
+            # Per cycle, as the look-ahead is sized per cycle
+            size = sum(directory_size(os.path.dirname(cycle[2])) for cycle in cycles)
+            record_task(
+                get_statistics_file(self.config, self.platform),
+                self.name,
+                self.dtg,
+                seconds=(time.time() - start) / self.cycles,
+                size=size / self.cycles,
+            )
+        if input_cache is not None:
+            input_cache.evict()
 
 
 class ModifyForcing(PySurfexBaseTask):
@@ -150,23 +318,59 @@ class ModifyForcing(PySurfexBaseTask):
 
     def execute(self):
         """Execute the forcing task."""
+        from surfexp.forcing import modify_time_steps
+
         dtg = self.dtg
         dtg_prev = dtg - self.fcint
         logger.debug("modify forcing dtg={} dtg_prev={}", dtg, dtg_prev)
         forcing_dir = self.platform.get_system_value("forcing_dir")
         input_dir = self.platform.substitute(forcing_dir, basetime=dtg_prev)
         output_dir = self.platform.substitute(forcing_dir, basetime=dtg)
-        input_file = input_dir + "FORCING.nc"
-        output_file = output_dir + "FORCING.nc"
-        time_step = -1
-        variables = ["LWdown", "DIR_SWdown"]
-        kwargs = {}
-
-        kwargs.update({"input_file": input_file})
-        kwargs.update({"output_file": output_file})
-        kwargs.update({"time_step": time_step})
-        kwargs.update({"variables": variables})
+        input_file = input_dir + "/FORCING.nc"
+        output_file = output_dir + "/FORCING.nc"
+        try:
+            variables = self.config["forcing.modify.variables"]
+        except KeyError:
+            variables = ["LWdown", "DIR_SWdown"]
+        try:
+            time_step = int(self.config["forcing.modify.input_time_step"])
+        except KeyError:
+            time_step = -1
         if os.path.exists(output_file) and os.path.exists(input_file):
-            modify_forcing(**kwargs)
+            modify_time_steps(
+                input_file, output_file, list(variables), input_time_step=time_step
+            )
         else:
             logger.info("Output or input is missing: {}", output_file)
+
+
+class CleanForcing(PySurfexBaseTask):
+    """Remove the forcing of the previous cycle."""
+
+    def __init__(self, config):
+        """Construct the clean forcing task.
+
+        Args:
+            config (ParsedObject): Parsed configuration
+
+        """
+        PySurfexBaseTask.__init__(self, config, "CleanForcing")
+
+    def execute(self):
+        """Execute the clean forcing task.
+
+        The forcing of the previous cycle is used by its forecast and by
+        ModifyForcing and the perturbed runs of this cycle, which have all
+        finished when the forecast of this cycle is done.
+
+        """
+        forcing_dir = self.platform.get_system_value("forcing_dir")
+        prev_dir = self.platform.substitute(forcing_dir, basetime=self.fg_dtg)
+        this_dir = self.platform.substitute(forcing_dir, basetime=self.dtg)
+        if os.path.realpath(prev_dir) == os.path.realpath(this_dir):
+            logger.warning("Forcing is not stored per cycle. Keep {}", prev_dir)
+        elif os.path.exists(prev_dir):
+            logger.info("Remove forcing {}", prev_dir)
+            shutil.rmtree(prev_dir)
+        else:
+            logger.info("No forcing to remove in {}", prev_dir)
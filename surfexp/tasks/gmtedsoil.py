@@ -1,25 +1,44 @@
 """GMTED and SOILGRID."""
 
+import json
 import os
 import shutil
 import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
 
-import netCDF4
+import numpy as np
 from deode.geo_utils import Projection, Projstring
 from deode.logs import logger
 from deode.os_utils import Search, deodemakedirs
 from deode.tasks.base import Task
 
-try:
-    from osgeo import gdal
-except ImportError as error:
-    MSG = "Cannot use the installed gdal library, "
-    MSG += "or there is no gdal library installed. "
-    MSG += "If you have not installed it, you may want to try running"
-    MSG += " 'pip install pygdal==\"`gdal-config --version`.*\"' "
-    MSG += "or, if you use conda,"
-    MSG += " 'conda install -c conda-forge gdal'."
-    raise ImportError(MSG) from error
+from surfexp.cache import get_static_data_cache, input_signature
+
+
+def get_gdal():
+    """Import gdal when it is needed.
+
+    Raises:
+    ------
+        ImportError: gdal is not installed
+
+    Returns:
+    -------
+        module: osgeo.gdal
+
+    """
+    try:
+        from osgeo import gdal
+    except ImportError as error:
+        msg = "Cannot use the installed gdal library, "
+        msg += "or there is no gdal library installed. "
+        msg += "If you have not installed it, you may want to try running"
+        msg += " 'pip install pygdal==\"`gdal-config --version`.*\"' "
+        msg += "or, if you use conda,"
+        msg += " 'conda install -c conda-forge gdal'."
+        raise ImportError(msg) from error
+    return gdal
 
 
 def modify_ncfile(ncfile, var_name, fact=1):
@@ -32,6 +51,8 @@ def modify_ncfile(ncfile, var_name, fact=1):
         fact (int, optional): Scale factor in file. Defaults to 1.
 
     """
+    import netCDF4
+
     nc = netCDF4.Dataset(ncfile, mode="a")  # pylint: disable=no-member
     nc.renameDimension("lon", "lons")
     nc.renameDimension("lat", "lats")
@@ -40,6 +61,58 @@ def modify_ncfile(ncfile, var_name, fact=1):
     nc.renameVariable("Band1", var_name)
     nc[var_name].setncattr("fact", fact)
     nc[var_name].setncattr("multitype", 0)
+    nc.close()
+
+
+def soilgrid_product(soilgrid_tif, proj_win, output, gfmt, output_type, var_name, fact):
+    """Cut, convert and rename one SoilGrids product.
+
+    This is a module level function so it can be run in a process pool.
+
+    Args:
+    ----
+        soilgrid_tif (str): SoilGrids tif file in the working directory
+        proj_win (list): Cut window [west, north, east, south]
+        output (str): Output file
+        gfmt (str): GDAL output format
+        output_type (int): GDAL output data type
+        var_name (str): Variable name in NetCDF output
+        fact (int): Scale factor in NetCDF output
+
+    Returns:
+    -------
+        dict: Geometry of the cut data set and elapsed time
+
+    """
+    gdal = get_gdal()
+    tic = time.perf_counter()
+    soilgrid_tif_subarea = soilgrid_tif.replace(".tif", "_subarea.tif")
+    ds = gdal.Open(soilgrid_tif)
+    ds = gdal.Translate(soilgrid_tif_subarea, ds, projWin=proj_win)
+
+    # Get number of rows, columns and corners
+    gt = ds.GetGeoTransform()
+    geometry = {
+        "rows": ds.RasterYSize,
+        "cols": ds.RasterXSize,
+        "west": gt[0],
+        "north": gt[3],
+        "east": gt[0] + ds.RasterXSize * gt[1],
+        "south": gt[3] + ds.RasterYSize * gt[5],
+    }
+    ds = None
+
+    if os.path.exists(output):
+        logger.info("Output {} already exists", output)
+    else:
+        ds = gdal.Open(soilgrid_tif_subarea)
+        ds = gdal.Translate(output, ds, format=gfmt, outputType=output_type)
+        ds = None
+        if gfmt == "NetCDF":
+            modify_ncfile(output, var_name, fact=fact)
+
+    geometry.update({"elapsed": time.perf_counter() - tic})
+    return geometry
 
 
 class Gmted(Task):
@@ -183,23 +256,53 @@ class Gmted(Task):
         return tif_files, hdr_east, hdr_west, hdr_south, hdr_north
 
     @staticmethod
-    def tif2bin(gd, bin_file) -> None:
+    def tif2bin(gd, bin_file, nodata=-32768) -> float:
         """Convert tif file to binary file used by surfex.
 
+        The raster is read in strips of the natural GDAL block height over the
+        full width. Nodata values are replaced with zero and the values are
+        converted to big-endian int16 directly into a preallocated
+        memory-mapped output file.
+
         Args:
         ----
             gd: gdal dataset
             bin_file (str): Binary file
+            nodata (int, optional): Nodata value in input. Defaults to -32768.
+
+        Returns:
+        -------
+            float: Throughput in MB/s
 
         """
+        tic = time.perf_counter()
         band = gd.GetRasterBand(1)
-
-        with open(bin_file, "wb") as f:
-            for iy in range(gd.RasterYSize):
-                data = band.ReadAsArray(0, iy, gd.RasterXSize, 1)
-                sel = data == -32768
-                data[sel] = 0
-                data.byteswap().astype("int16").tofile(f)
+        nx = gd.RasterXSize
+        ny = gd.RasterYSize
+        __, block_rows = band.GetBlockSize()
+        block_rows = max(1, block_rows)
+
+        output = np.memmap(bin_file, dtype=">i2", mode="w+", shape=(ny, nx))
+        for iy in range(0, ny, block_rows):
+            nrows = min(block_rows, ny - iy)
+            data = band.ReadAsArray(0, iy, nx, nrows)
+            data[data == nodata] = 0
+            np.copyto(output[iy : iy + nrows, :], data, casting="unsafe")
+        output.flush()
+        del output
+
+        elapsed = max(time.perf_counter() - tic, 1.0e-9)
+        mbytes = nx * ny * 2 / 1.0e6
+        throughput = mbytes / elapsed
+        logger.info(
+            "Converted {}x{} raster to {} in {:.2f}s ({:.1f} MB/s)",
+            nx,
+            ny,
+            bin_file,
+            elapsed,
+            throughput,
+        )
+        return throughput
 
     @staticmethod
     def write_gmted_header_file(
@@ -233,7 +336,13 @@ class Gmted(Task):
         """Run task.
 
         Define run sequence.
+
+        Raises:
+        ------
+            NotImplementedError: If the output format is not supported.
+
         """
+        gdal = get_gdal()
         climdir = self.platform.get_system_value("climdir")
         unix_group = self.platform.get_platform_value("unix_group")
         deodemakedirs(climdir, unixgroup=unix_group)
@@ -248,30 +357,50 @@ class Gmted(Task):
             domain_properties
         )
 
-        # Output merged GMTED file to working directory as file gmted_mea075.tif
-        options = gdal.WarpOptions(
-            format="GTiff", creationOptions=["COMPRESS=LZW", "TILED=YES"]
-        )
-        gd = gdal.Warp("gmted_mea075.tif", tif_files, options=options)
-
         fmt = self.config["pgd.zs_format"]
+        if fmt == "netcdf":
+            outputs = [f"{climdir}/gmted2010.nc"]
+        elif fmt == "direct":
+            outputs = [f"{climdir}/gmted2010.dir", f"{climdir}/gmted2010.hdr"]
+        else:
+            raise NotImplementedError(fmt)
+
+        cache = get_static_data_cache(self.config, self.platform)
+        if cache is not None:
+            key = cache.key(
+                {
+                    "task": "Gmted",
+                    "domain": self.config["domain"].dict(),
+                    "inputs": input_signature(tif_files),
+                    "zs_format": fmt,
+                }
+            )
+            if cache.fetch(key, outputs):
+                return
+
+        # Mosaic the GMTED tiles in a virtual raster. The VRT is only an XML
+        # description so the tiles are streamed directly into the output.
+        gd = gdal.BuildVRT("gmted_mea075.vrt", tif_files)
+
         if fmt == "netcdf":
             output = f"{climdir}/gmted2010.nc"
             if os.path.exists(output):
                 logger.info("Output {} already exists", output)
             else:
-                gdal.Translate(output, "gmted_mea075.tif", format="NetCDF")
+                gdal.Translate(output, gd, format="NetCDF")
                 modify_ncfile(output, "ZS")
         elif fmt == "direct":
-            Gmted.tif2bin(gd, "gmted_mea075.bin")
-            shutil.move("gmted_mea075.bin", f"{climdir}/gmted2010.dir")
+            output = f"{climdir}/gmted2010.dir"
+            if os.path.exists(output):
+                logger.info("Output {} already exists", output)
+            else:
+                Gmted.tif2bin(gd, "gmted_mea075.bin")
+                shutil.move("gmted_mea075.bin", output)
 
             # Get number of rows and columns
             hdr_rows = gd.RasterYSize
             hdr_cols = gd.RasterXSize
 
-            gd = None
-
             # Create the header file
             header_file = f"{climdir}/gmted2010.hdr"
             logger.debug("Write header file {}", header_file)
@@ -284,11 +413,63 @@ class Gmted(Task):
                 hdr_rows,
                 hdr_cols,
             )
+        gd = None
+
+        if cache is not None:
+            cache.store(key, outputs)
 
 
 class Soil(Task):
     """Prepare soil data task for PGD."""
 
+    # SoilGrids products identified by the prefix of the tif file
+    products = {
+        "SNDPPT": {
+            "name": "SAND_SOILGRID",
+            "format": "pgd.sand_format",
+            "var_name": "SAND",
+            "fact": 100,
+            "output_type": "GDT_Byte",
+            "soiltype": "Sand",
+            "nodata": 0,
+            "bits": 8,
+            "write_fact": False,
+        },
+        "CLYPPT": {
+            "name": "CLAY_SOILGRID",
+            "format": "pgd.clay_format",
+            "var_name": "CLAY",
+            "fact": 100,
+            "output_type": "GDT_Byte",
+            "soiltype": "Clay",
+            "nodata": 0,
+            "bits": 8,
+            "write_fact": False,
+        },
+        "SOC_TOP": {
+            "name": "soc_top",
+            "format": "pgd.soc_format",
+            "var_name": "SOC_TOP",
+            "fact": 10,
+            "output_type": "GDT_Int16",
+            "soiltype": "soc_top",
+            "nodata": -9999,
+            "bits": 16,
+            "write_fact": True,
+        },
+        "SOC_SUB": {
+            "name": "soc_sub",
+            "format": "pgd.soc_format",
+            "var_name": "SOC_SUB",
+            "fact": 10,
+            "output_type": "GDT_Int16",
+            "soiltype": "soc_sub",
+            "nodata": -9999,
+            "bits": 16,
+            "write_fact": True,
+        },
+    }
+
     def __init__(self, config):
         """Construct soil data object.
 
@@ -437,6 +618,7 @@ class Soil(Task):
         Raises:
         ------
             FileNotFoundError: If no tif files are found.
+            NotImplementedError: If the output format is not supported.
 
         """
         logger.debug("Running soil task")
@@ -470,168 +652,122 @@ class Soil(Task):
             domain_properties
         )
 
-        # Cut soilgrid tifs
-        soilgrid_tif_subarea_files = []
-        find_size_and_corners = True
-        for soilgrid_tif in soilgrid_tifs:
-            soilgrid_tif_basename = os.path.basename(soilgrid_tif)
-            soilgrid_tif_subarea = soilgrid_tif_basename.replace(".tif", "_subarea.tif")
-            soilgrid_tif_subarea_files.append(soilgrid_tif_subarea)
-            ds = gdal.Open(soilgrid_tif_basename)
-            ds = gdal.Translate(
-                soilgrid_tif_subarea,
-                ds,
-                projWin=[cut_lon, cut_north, cut_east, cut_south],
-            )
-            if find_size_and_corners:
-                # Get number of rows and columns
-                hdr_rows = ds.RasterYSize
-                hdr_cols = ds.RasterXSize
-                # Get corners
-                gt = ds.GetGeoTransform()
-                hdr_west = gt[0]
-                hdr_north = gt[3]
-                hdr_east = hdr_west + hdr_cols * gt[1]
-                hdr_south = hdr_north + hdr_rows * gt[5]
-                find_size_and_corners = False
-            ds = None
-
         climdir = self.platform.get_system_value("climdir")
         unix_group = self.platform.get_platform_value("unix_group")
         deodemakedirs(climdir, unixgroup=unix_group)
 
-        for subarea_file in soilgrid_tif_subarea_files:
-            fact = 10
-            if subarea_file.startswith("SNDPPT"):
-                fact = 100
-                fmt = self.config["pgd.sand_format"]
-                if fmt == "direct":
-                    gfmt = "EHdr"
-                    output = f"{climdir}/SAND_SOILGRID.dir"
-                    output_type = gdal.GDT_Byte
-                elif fmt == "netcdf":
-                    gfmt = "NetCDF"
-                    output = f"{climdir}/SAND_SOILGRID.nc"
-                    output_type = 0
-
-                if os.path.exists(output):
-                    logger.info("Output {} already exists", output)
-                else:
-                    ds = gdal.Open(subarea_file)
-                    ds = gdal.Translate(
-                        output,
-                        ds,
-                        format=gfmt,
-                        outputType=output_type,
-                    )
-                    ds = None
-                    if fmt == "netcdf":
-                        modify_ncfile(output, "SAND", fact=fact)
-            elif subarea_file.startswith("CLYPPT"):
-                fact = 100
-                fmt = self.config["pgd.clay_format"]
-                if fmt == "direct":
-                    gfmt = "EHdr"
-                    output = f"{climdir}/CLAY_SOILGRID.dir"
-                    output_type = gdal.GDT_Byte
-                elif fmt == "netcdf":
-                    gfmt = "NetCDF"
-                    output = f"{climdir}/CLAY_SOILGRID.nc"
-                    output_type = 0
-
-                if os.path.exists(output):
-                    logger.info("Output {} already exists", output)
-                else:
-                    ds = gdal.Open(subarea_file)
-                    ds = gdal.Translate(
+        proj_win = [cut_lon, cut_north, cut_east, cut_south]
+        products = {}
+        for soilgrid_tif in soilgrid_tifs:
+            soilgrid_tif_basename = os.path.basename(soilgrid_tif)
+            product = None
+            for prefix in self.products:
+                if soilgrid_tif_basename.startswith(prefix):
+                    product = prefix
+            if product is None:
+                logger.warning("Unknown soilgrid tif file: {}", soilgrid_tif_basename)
+            else:
+                products.update({product: soilgrid_tif_basename})
+
+        try:
+            workers = int(self.config["pgd.soil_workers"])
+        except KeyError:
+            workers = 1
+
+        # Cut, convert and rename each product. They are independent of each other.
+        jobs = {}
+        for product, soilgrid_tif in products.items():
+            settings = self.products[product]
+            fmt = self.config[settings["format"]]
+            if fmt == "direct":
+                gfmt = "EHdr"
+                output = f"{climdir}/{settings['name']}.dir"
+                output_type = getattr(get_gdal(), settings["output_type"])
+            elif fmt == "netcdf":
+                gfmt = "NetCDF"
+                output = f"{climdir}/{settings['name']}.nc"
+                output_type = 0
+            else:
+                raise NotImplementedError(fmt)
+            jobs.update(
+                {
+                    product: (
+                        soilgrid_tif,
+                        proj_win,
                         output,
-                        ds,
-                        format=gfmt,
-                        outputType=output_type,
+                        gfmt,
+                        output_type,
+                        settings["var_name"],
+                        settings["fact"],
                     )
-                    ds = None
-                    if fmt == "netcdf":
-                        modify_ncfile(output, "CLAY", fact=fact)
-            elif subarea_file.startswith(("SOC_TOP", "SOC_SUB")):
-                if subarea_file.startswith("SOC_SUB"):
-                    soc_type = "soc_sub"
-                elif subarea_file.startswith("SOC_TOP"):
-                    soc_type = "soc_top"
-                fact = 10
-                fmt = self.config["pgd.soc_format"]
-                if fmt == "direct":
-                    gfmt = "EHdr"
-                    output = f"{climdir}/{soc_type}.dir"
-                    output_type = gdal.GDT_Int16
-                elif fmt == "netcdf":
-                    gfmt = "NetCDF"
-                    output = f"{climdir}/{soc_type}.nc"
-                    output_type = 0
-
-                if os.path.exists(output):
-                    logger.info("Output {} already exists", output)
-                else:
-                    ds = gdal.Open(subarea_file)
-                    ds = gdal.Translate(output, ds, format=gfmt, outputType=output_type)
-                    ds = None
-                    if fmt == "netcdf":
-                        modify_ncfile(output, soc_type.upper(), fact=fact)
-            else:
-                logger.warning("Unknown soilgrid tif file: {}", subarea_file)
-
-        if fmt == "direct":
-            # Compose headers in surfex/pgd format
-            self.write_soil_header_file(
-                climdir + "/CLAY_SOILGRID.hdr",
-                "Clay",
-                hdr_north,
-                hdr_south,
-                hdr_west,
-                hdr_east,
-                hdr_rows,
-                hdr_cols,
-                nodata=0,
-                bits=8,
-                write_fact=False,
+                }
             )
-            self.write_soil_header_file(
-                climdir + "/SAND_SOILGRID.hdr",
-                "Sand",
-                hdr_north,
-                hdr_south,
-                hdr_west,
-                hdr_east,
-                hdr_rows,
-                hdr_cols,
-                nodata=0,
-                bits=8,
-                write_fact=False,
-            )
-            self.write_soil_header_file(
-                climdir + "/soc_top.hdr",
-                "soc_top",
-                hdr_north,
-                hdr_south,
-                hdr_west,
-                hdr_east,
-                hdr_rows,
-                hdr_cols,
-                nodata=-9999,
-                bits=16,
-                write_fact=True,
-            )
-            self.write_soil_header_file(
-                climdir + "/soc_sub.hdr",
-                "soc_sub",
-                hdr_north,
-                hdr_south,
-                hdr_west,
-                hdr_east,
-                hdr_rows,
-                hdr_cols,
-                nodata=-9999,
-                bits=16,
-                write_fact=True,
+
+        outputs = []
+        for product, args in jobs.items():
+            outputs.append(args[2])
+            if args[3] == "EHdr":
+                outputs.append(f"{climdir}/{self.products[product]['name']}.hdr")
+
+        cache = get_static_data_cache(self.config, self.platform)
+        if cache is not None:
+            key = cache.key(
+                {
+                    "task": "Soil",
+                    "domain": self.config["domain"].dict(),
+                    "inputs": input_signature(products.values()),
+                    "formats": {product: args[3] for product, args in jobs.items()},
+                }
             )
+            if cache.fetch(key, outputs):
+                return
 
+        results = {}
+        if workers > 1 and len(jobs) > 1:
+            logger.info(
+                "Process {} soilgrid products with {} workers", len(jobs), workers
+            )
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = {
+                    product: executor.submit(soilgrid_product, *args)
+                    for product, args in jobs.items()
+                }
+                for product, future in futures.items():
+                    results.update({product: future.result()})
+        else:
+            for product, args in jobs.items():
+                results.update({product: soilgrid_product(*args)})
+
+        timings = {}
+        for product, result in results.items():
+            logger.info("Processed {} in {:.2f}s", product, result["elapsed"])
+            timings.update({product: result["elapsed"]})
+        with open(f"{self.wdir}/soil_timings.json", mode="w", encoding="utf8") as fh:
+            json.dump(timings, fh, indent=2)
+
+        if len(results) == 0:
+            raise FileNotFoundError(f"No known soilgrid products under {soilgrid_path}")
+
+        # All products share the geometry of the first cut data set
+        geometry = results[next(iter(results))]
+        for product in results:
+            settings = self.products[product]
+            if jobs[product][3] == "EHdr":
+                # Compose headers in surfex/pgd format
+                self.write_soil_header_file(
+                    f"{climdir}/{settings['name']}.hdr",
+                    settings["soiltype"],
+                    geometry["north"],
+                    geometry["south"],
+                    geometry["west"],
+                    geometry["east"],
+                    geometry["rows"],
+                    geometry["cols"],
+                    nodata=settings["nodata"],
+                    bits=settings["bits"],
+                    write_fact=settings["write_fact"],
+                )
+
+        if cache is not None:
+            cache.store(key, outputs)
         logger.debug("Finished soil task")
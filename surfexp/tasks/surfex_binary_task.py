@@ -1,17 +1,15 @@
 """Tasks running surfex binaries."""
-import json
 import os
+from functools import cached_property
 
-import yaml
 from deode.datetime_utils import as_datetime, get_decade
 from deode.logs import logger
 from pysurfex.binary_input import InputDataFromNamelist, JsonOutputData
-from pysurfex.configuration import Configuration
 from pysurfex.file import PGDFile, PREPFile, SURFFile, SurfFileTypeExtension
 from pysurfex.namelist import NamelistGenerator
-from pysurfex.platform_deps import SystemFilePaths
 from pysurfex.run import BatchJob, PerturbedOffline, SURFEXBinary
 
+from surfexp.cache import get_static_data_cache
 from surfexp.experiment import setting_is
 from surfexp.tasks.tasks import PySurfexBaseTask
 
@@ -47,30 +45,6 @@ class SurfexBinaryTask(PySurfexBaseTask):
         self.perturbed = False
         self.soda = False
         self.namelist = None
-        # SURFEX config added to general config
-        cfg = self.config["SURFEX"].dict()
-        sfx_config = {"SURFEX": cfg}
-        self.sfx_config = Configuration(sfx_config)
-
-        # TODO get all needed paths
-        system_paths = self.config["system"].dict()
-        platform_paths = self.config["platform"].dict()
-        exp_file_paths = {}
-        for key, val in system_paths.items():
-            lkey = self.platform.substitute(key)
-            lval = self.platform.substitute(val)
-            exp_file_paths.update({lkey: lval})
-        for key, val in platform_paths.items():
-            lkey = self.platform.substitute(key)
-            lval = self.platform.substitute(val)
-            exp_file_paths.update({lkey: lval})
-        obs_dir = self.platform.get_system_value("obs_dir")
-        # To sub EEE/RRR
-        obs_dir = self.platform.substitute(obs_dir)
-
-        logger.debug("exp_file_paths: {}", exp_file_paths)
-        self.exp_file_paths = SystemFilePaths(exp_file_paths)
-
         kwargs = self.config["task.args"].dict()
         logger.debug("kwargs: {}", kwargs)
         print_namelist = kwargs.get("print_namelist")
@@ -125,36 +99,24 @@ class SurfexBinaryTask(PySurfexBaseTask):
         self.binary_input_files = self.platform.get_system_value("binary_input_files")
         self.archive = self.platform.get_system_value("archive_dir")
 
+    @cached_property
+    def exp_file_paths(self):
+        """System and platform paths after substitution."""
+        return self.context.exp_file_paths
+
     def execute(self):
         """Execute task."""
         logger.debug("Using empty class execute")
 
-    def execute_binary(
-        self,
-        binary,
-        output,
-        pgd_file_path=None,
-        prep_file_path=None,
-        archive_data=None,
-        prep_file=None,
-        prep_pgdfile=None,
-    ):
-        """Execute the surfex binary.
+    def update_binary_settings(self, prep_file=None, prep_pgdfile=None):
+        """Update the settings of the binary before its namelist is generated.
 
         Args:
-        ----------------------------------------------------------------------------------------
-            binary (str): Full path to binary
-            output (str): Full path to output file
-            pgd_file_path (str, optional): _description_. Defaults to None.
-            prep_file_path (str, optional): _description_. Defaults to None.
-            archive_data (surfex.OutputDataFromSurfexBinaries, optional):
-                A mapping of produced files and where to archive them. Defaults to None.
-            prep_file (_type_, optional): _description_. Defaults to None.
-            prep_pgdfile (_type_, optional): _description_. Defaults to None.
+        ----------------------------------------------------------------------------
+            prep_file (str, optional): PREP input file. Defaults to None.
+            prep_pgdfile (str, optional): PGD of the PREP input file. Defaults to None.
 
         """
-        rte = os.environ
-
         if self.mode == "pgd":
             self.pgd = True
             self.need_pgd = False
@@ -189,9 +151,16 @@ class SurfexBinaryTask(PySurfexBaseTask):
                     nvar += 1
             self.sfx_config.update_setting("SURFEX#SODA#NVAR", nvar)
 
+    def binary_input(self):
+        """Generate the namelist and the input data of the binary.
+
+        Returns:
+        -----------------------------------------------------------------------
+            tuple: Namelist settings and input data
+
+        """
         # TODO file handling should be in pysurfex
-        with open(self.namelist_defs, mode="r", encoding="utf-8") as fhandler:
-            definitions = yaml.safe_load(fhandler)
+        definitions = self.load_definitions(self.namelist_defs)
         namelist = NamelistGenerator(self.mode, self.sfx_config, definitions)
         assemble = namelist.namelist_blocks()
         consistency = True
@@ -223,8 +192,7 @@ class SurfexBinaryTask(PySurfexBaseTask):
         if self.mode == "pgd":
             settings = self.geo.update_namelist(settings)
 
-        with open(self.binary_input_files, mode="r", encoding="utf-8") as fhandler:
-            input_data = json.load(fhandler)
+        input_data = self.load_definitions(self.binary_input_files)
 
         if self.mode == "pgd" and self.config["pgd.one_decade"]:
 
@@ -248,6 +216,41 @@ class SurfexBinaryTask(PySurfexBaseTask):
             basetime=self.dtg,
             validtime=self.dtg,
         )
+        return settings, input_data
+
+    def execute_binary(
+        self,
+        binary,
+        output,
+        pgd_file_path=None,
+        prep_file_path=None,
+        archive_data=None,
+        prep_file=None,
+        prep_pgdfile=None,
+        binary_input=None,
+    ):
+        """Execute the surfex binary.
+
+        Args:
+        ----------------------------------------------------------------------------------------
+            binary (str): Full path to binary
+            output (str): Full path to output file
+            pgd_file_path (str, optional): _description_. Defaults to None.
+            prep_file_path (str, optional): _description_. Defaults to None.
+            archive_data (surfex.OutputDataFromSurfexBinaries, optional):
+                A mapping of produced files and where to archive them. Defaults to None.
+            prep_file (_type_, optional): _description_. Defaults to None.
+            prep_pgdfile (_type_, optional): _description_. Defaults to None.
+            binary_input (tuple, optional): Namelist settings and input data from
+                binary_input. Defaults to None.
+
+        """
+        rte = os.environ
+
+        self.update_binary_settings(prep_file=prep_file, prep_pgdfile=prep_pgdfile)
+        if binary_input is None:
+            binary_input = self.binary_input()
+        settings, input_data = binary_input
 
         batch = BatchJob(rte, wrapper=self.wrapper)
 
@@ -378,7 +381,51 @@ class OfflinePgd(SurfexBinaryTask):
         binary = self.get_binary("PGD" + self.xyz)
 
         if not os.path.exists(output) or self.force:
-            SurfexBinaryTask.execute_binary(self, binary=binary, output=output)
+            self.update_binary_settings()
+            settings, input_data = self.binary_input()
+            cache = get_static_data_cache(self.config, self.platform)
+            if cache is not None:
+                pgd_settings = self.config["pgd"].dict()
+                pgd_settings.pop("cache", None)
+                pgd_settings.pop("soil_workers", None)
+                # Keyed on content, as the paths differ between experiments
+                inputs = [self.namelist_defs, self.binary_input_files]
+                if os.path.exists(binary):
+                    inputs.append(binary)
+                # The PGD input data files the binary reads by their local names
+                data = {}
+                for target, mapping in input_data.data.items():
+                    source = mapping
+                    command = None
+                    if isinstance(mapping, dict):
+                        source, command = next(iter(mapping.items()))
+                    digest = None
+                    if os.path.isfile(source):
+                        digest = cache.digest(source)
+                    data.update({target: [digest, command]})
+                key = cache.key(
+                    {
+                        "task": "OfflinePgd",
+                        "domain": self.config["domain"].dict(),
+                        "pgd": pgd_settings,
+                        "surfex": self.config["SURFEX"].dict(),
+                        "namelist": settings,
+                        "inputs": [cache.digest(fname) for fname in inputs],
+                        "data": data,
+                        "decade": decade,
+                    }
+                )
+                if not self.force and cache.fetch(key, [output]):
+                    return
+
+            SurfexBinaryTask.execute_binary(
+                self,
+                binary=binary,
+                output=output,
+                binary_input=(settings, input_data),
+            )
+            if cache is not None:
+                cache.store(key, [output])
         else:
             logger.warning("Output already exists: ", output)
 
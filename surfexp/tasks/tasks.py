@@ -1,35 +1,28 @@
 """General task module."""
 
 import contextlib
+import copy
 import json
 import os
 import shutil
+from concurrent.futures import ProcessPoolExecutor
+from functools import cached_property
+from types import SimpleNamespace
 
 import numpy as np
 import pysurfex
-import yaml
 from deode.datetime_utils import as_datetime, as_timedelta
 from deode.logs import InterceptHandler, logger, logging
 from deode.tasks.base import Task
 from pysurfex.cache import Cache
-from pysurfex.configuration import Configuration
 from pysurfex.file import SurfFileTypeExtension
-from pysurfex.geo import ConfProj, get_geo_object
-from pysurfex.input_methods import get_datasources
-from pysurfex.interpolation import horizontal_oi
-from pysurfex.netcdf import (
-    create_netcdf_first_guess_template,
-    oi2soda,
-    read_first_guess_netcdf_file,
-    write_analysis_netcdf_file,
-)
-from pysurfex.obsmon import write_obsmon_sqlite_file
-from pysurfex.pseudoobs import CryoclimObservationSet
-from pysurfex.read import ConvertedInput, Converter
+from pysurfex.geo import get_geo_object
 from pysurfex.run import BatchJob
-from pysurfex.titan import TitanDataSet, dataset_from_file, define_quality_control
+from pysurfex.util import parse_filepattern
 
-from surfexp.experiment import get_nnco
+from surfexp.context import TaskContext
+from surfexp.definitions import load_definitions
+from surfexp.pipeline import get_statistics_file, record_task
 
 
 class PySurfexBaseTask(Task):
@@ -47,35 +40,15 @@ class PySurfexBaseTask(Task):
         Task.__init__(self, config, name)
         logging.basicConfig(handlers=[InterceptHandler()], level=0, force=True)
 
-        # Domain/geo
-        conf_proj = {
-            "nam_conf_proj_grid": {
-                "nimax": self.config["domain.nimax"],
-                "njmax": self.config["domain.njmax"],
-                "xloncen": self.config["domain.xloncen"],
-                "xlatcen": self.config["domain.xlatcen"],
-                "xdx": self.config["domain.xdx"],
-                "xdy": self.config["domain.xdy"],
-                "ilone": self.config["domain.ilone"],
-                "ilate": self.config["domain.ilate"],
-            },
-            "nam_conf_proj": {
-                "xlon0": self.config["domain.xlon0"],
-                "xlat0": self.config["domain.xlat0"],
-            },
-        }
-
-        self.geo = ConfProj(conf_proj)
         self.dtg = as_datetime(self.config["general.times.basetime"])
-        self.fcint = as_timedelta("PT6H")
+        # Geometry, observation settings and SURFEX settings are set up on first use
+        self.context = TaskContext(self.config, self.platform, self.dtg)
 
         self.translation = {
             "t2m": "air_temperature_2m",
             "rh2m": "relative_humidity_2m",
             "sd": "surface_snow_thickness",
         }
-        self.obs_types = self.config["SURFEX.ASSIM.OBS.COBS_M"]
-        self.nnco = get_nnco(self.config, basetime=self.dtg)
 
         self.fgint = as_timedelta(self.config["general.times.cycle_length"])
         self.fcint = as_timedelta(self.config["general.times.cycle_length"])
@@ -86,12 +59,25 @@ class PySurfexBaseTask(Task):
         self.fg_guess_sfx = self.wrk + "/first_guess_sfx"
         self.fc_start_sfx = self.wrk + "/fc_start_sfx"
 
-        cfg = self.config["SURFEX"].dict()
-        sfx_config = {"SURFEX": cfg}
-        self.sfx_config = Configuration(sfx_config)
-        update = {"SURFEX": {"ASSIM": {"OBS": {"NNCO": self.nnco}}}}
-        self.config = self.config.copy(update=update)
-        logger.debug("NNCO: {}", self.nnco)
+    @cached_property
+    def geo(self):
+        """Domain geometry."""
+        return self.context.geo
+
+    @cached_property
+    def obs_types(self):
+        """Observation types."""
+        return self.context.obs_types
+
+    @cached_property
+    def nnco(self):
+        """Active observations for the cycle."""
+        return self.context.nnco
+
+    @cached_property
+    def sfx_config(self):
+        """SURFEX configuration with the active observations for the cycle."""
+        return self.context.sfx_config
 
     def substitute(self, pattern, basetime=None, validtime=None):
         fpattern = self.platform.substitute(
@@ -106,6 +92,26 @@ class PySurfexBaseTask(Task):
                 fpattern = fpattern.replace("@HH_FG@", basetime.strftime("%H"))
         return fpattern
 
+    def load_definitions(self, filename):
+        """Load a YAML/JSON definition file through the definitions cache.
+
+        Args:
+        -----------------------------------
+            filename (str): Definition file
+
+        Returns:
+        ---------------------------------------
+            any: Parsed definitions
+
+        """
+        try:
+            cache_dir = self.config["pysurfex.definitions_cache_dir"]
+        except KeyError:
+            cache_dir = None
+        if cache_dir is not None and cache_dir != "":
+            cache_dir = self.platform.substitute(cache_dir)
+        return load_definitions(filename, cache_dir=cache_dir)
+
     def get_binary(self, binary):
         """Determine binary path from task or system config section.
 
@@ -183,8 +189,77 @@ class QualityControl(PySurfexBaseTask):
         except KeyError:
             self.var_name = None
 
+    def get_datasources(self, an_time, sets, obsdir):
+        """Get the observation data sources.
+
+        If observations.bufr_store is set, the BUFR file is decoded once for
+        all the variables used in the cycle and shared between the tasks.
+
+        Args:
+        --------------------------------------------------
+            an_time (as_datetime): Analysis time
+            sets (dict): Observation set settings
+            obsdir (str): Observation directory
+
+        Returns:
+        --------------------------------------------------
+            list: Observation sets
+
+        """
+        from pysurfex.input_methods import get_datasources
+
+        from surfexp.obsstore import BufrObservationStore
+
+        try:
+            bufr_store = self.config["observations.bufr_store"]
+        except KeyError:
+            bufr_store = False
+        if not bufr_store:
+            return get_datasources(an_time, sets)
+
+        variables = []
+        for var_name, bufr_var in [
+            ("t2m", "airTemperatureAt2M"),
+            ("rh2m", "relativeHumidityAt2M"),
+            ("sd", "totalSnowDepth"),
+        ]:
+            if self.config[f"observations.synop_obs_{var_name}"]:
+                variables.append(bufr_var)
+
+        datasources = []
+        for label, obs_set in sets.items():
+            if obs_set["filetype"].lower() == "bufr":
+                filename = parse_filepattern(obs_set["filepattern"], an_time, an_time)
+                if not os.path.exists(filename):
+                    logger.warning("Filename {} not found. Not added.", filename)
+                    continue
+                store = BufrObservationStore(
+                    obsdir,
+                    filename,
+                    variables + obs_set["varname"],
+                    an_time,
+                    deltat=obs_set.get("dt", 1800),
+                )
+                datasources.append(
+                    store.observation_set(
+                        obs_set["varname"], label=label, sigmao=obs_set.get("sigmao")
+                    )
+                )
+            else:
+                datasources += get_datasources(an_time, {label: obs_set})
+        return datasources
+
     def execute(self):
         """Execute."""
+        from pysurfex.titan import define_quality_control
+
+        from surfexp.qc import (
+            get_qc_output_format,
+            qc_data_set,
+            qc_filename,
+            write_qc_output,
+        )
+
         an_time = self.dtg
 
         obsdir = self.platform.get_system_value("obs_dir")
@@ -351,7 +426,9 @@ class QualityControl(PySurfexBaseTask):
 
         logger.debug("Settings {}", json.dumps(settings, indent=2, sort_keys=True))
 
-        output = obsdir + "/qc_" + self.translation[self.var_name] + ".json"
+        output = qc_filename(
+            obsdir, self.translation[self.var_name], get_qc_output_format(self.config)
+        )
         lname = self.var_name.lower()
 
         try:
@@ -369,12 +446,131 @@ class QualityControl(PySurfexBaseTask):
             tests, settings, an_time, domain_geo=self.geo, blacklist=blacklist
         )
 
-        datasources = get_datasources(an_time, settings["sets"])
-        data_set = TitanDataSet(self.var_name, settings, tests, datasources, an_time)
+        datasources = self.get_datasources(an_time, settings["sets"], obsdir)
+        try:
+            engine = self.config["observations.qc.engine"]
+        except KeyError:
+            engine = "titan"
+        data_set = qc_data_set(
+            engine, self.var_name, settings, tests, datasources, an_time
+        )
         data_set.perform_tests()
 
         logger.debug("Write to {}", output)
-        data_set.write_output(output, indent=indent)
+        write_qc_output(data_set, output, indent=indent)
+        if engine == "vectorized":
+            timings = obsdir + "/qc_" + self.translation[self.var_name] + "_timings.json"
+            logger.info("Write test timings to {}", timings)
+            data_set.write_timings(timings)
+
+
+def get_oi_settings(config, var_name):
+    """Get the OI settings for a variable.
+
+    Args:
+    --------------------------------------------------
+        config (ParsedObject): Parsed configuration
+        var_name (str): Variable name
+
+    Returns:
+    --------------------------------------------------
+        dict: Keyword arguments to horizontal_oi
+
+    """
+    # Keyword argument, config setting and default value
+    defaults = [
+        ("hlength", "hlength", 30000),
+        ("vlength", "vlength", 100000),
+        ("wlength", "wlength", 0.5),
+        ("elev_gradient", "gradient", 0),
+        ("max_locations", "max_locations", 20),
+        ("epsilon", "epsilon", 0.25),
+        ("only_diff", "only_diff", False),
+        ("minvalue", "minvalue", None),
+        ("maxvalue", "maxvalue", None),
+    ]
+    lname = var_name.lower()
+    settings = {}
+    for kwarg, setting, default in defaults:
+        try:
+            settings[kwarg] = config[f"observations.oi.{lname}.{setting}"]
+        except KeyError:  # noqa: PERF203
+            settings[kwarg] = default
+    return settings
+
+
+def read_background(input_file, var):
+    """Read a first guess field.
+
+    Args:
+    --------------------------------------------------
+        input_file (str): First guess file
+        var (str): Variable name in file
+
+    Returns:
+    --------------------------------------------------
+        np.ndarray: Background field, as read by read_first_guess_netcdf_file
+
+    """
+    import netCDF4
+
+    with netCDF4.Dataset(input_file) as file_handler:
+        n_y, n_x = file_handler["longitude"].shape
+        background = file_handler[var][:]
+        background = np.array(np.reshape(background, [n_x * n_y]))
+        background = np.transpose(np.reshape(background, [n_y, n_x]))
+        fill_value = file_handler.variables[var].getncattr("_FillValue")
+    background[background == fill_value] = np.nan
+    return background
+
+
+def optimal_interpolation(
+    geo, background, gelevs, an_time, obs_file, settings, tile_size=0, workers=1
+):
+    """Do the horizontal OI for one variable.
+
+    Args:
+    --------------------------------------------------
+        geo (Geo): Geometry. Only the coordinates are used.
+        background (np.ndarray): Background field
+        gelevs (np.ndarray): Elevations
+        an_time (datetime): Analysis time
+        obs_file (str): File with quality controlled observations
+        settings (dict): Keyword arguments to horizontal_oi
+        tile_size (int, optional): Tile size in grid points for tiled OI.
+                                   Defaults to 0 which means no tiling.
+        workers (int, optional): Worker processes for tiled OI. Defaults to 1.
+
+    Returns:
+    --------------------------------------------------
+        np.ndarray: Analysis field
+
+    """
+    from pysurfex.interpolation import horizontal_oi
+
+    from surfexp.oi import tiled_horizontal_oi
+    from surfexp.qc import read_qc_dataset
+
+    logger.info("Obs file: {}", obs_file)
+    observations = read_qc_dataset(an_time, obs_file, qc_flag=0)
+    if tile_size > 0:
+        return tiled_horizontal_oi(
+            geo,
+            background,
+            observations,
+            gelevs,
+            settings,
+            tile_size=tile_size,
+            workers=workers,
+        )
+    return horizontal_oi(
+        geo,
+        background,
+        observations,
+        gelevs=gelevs,
+        interpol="bilinear",
+        **settings,
+    )
 
 
 class OptimalInterpolation(PySurfexBaseTask):
@@ -396,59 +592,31 @@ class OptimalInterpolation(PySurfexBaseTask):
         """
         PySurfexBaseTask.__init__(self, config, "OptimalInterpolation")
         self.var_name = self.config["task.args.var_name"]
+        try:
+            self.tile_size = int(self.config["observations.oi.tile_size"])
+        except KeyError:
+            self.tile_size = 0
+        try:
+            self.workers = int(self.config["observations.oi.workers"])
+        except KeyError:
+            self.workers = 1
 
     def execute(self):
         """Execute."""
+        from pysurfex.netcdf import (
+            read_first_guess_netcdf_file,
+            write_analysis_netcdf_file,
+        )
+
+        from surfexp.qc import get_qc_output_format, qc_filename
+
         archive = self.platform.get_system_value("archive_dir")
         if self.var_name in self.translation:
             var = self.translation[self.var_name]
         else:
             raise KeyError(f"No translation for {self.var_name}")
 
-        lname = self.var_name.lower()
-        try:
-            hlength = self.config[f"observations.oi.{lname}.hlength"]
-        except KeyError:
-            hlength = 30000
-
-        try:
-            vlength = self.config[f"observations.oi.{lname}.vlength"]
-        except KeyError:
-            vlength = 100000
-
-        try:
-            wlength = self.config[f"observations.oi.{lname}.wlength"]
-        except KeyError:
-            wlength = 0.5
-
-        try:
-            elev_gradient = self.config[f"observations.oi.{lname}.gradient"]
-        except KeyError:
-            elev_gradient = 0
-
-        try:
-            max_locations = self.config[f"observations.oi.{lname}.max_locations"]
-        except KeyError:
-            max_locations = 20
-
-        try:
-            epsilon = self.config[f"observations.oi.{lname}.epsilon"]
-        except KeyError:
-            epsilon = 0.25
-
-        try:
-            only_diff = self.config[f"observations.oi.{lname}.only_diff"]
-        except KeyError:
-            only_diff = False
-
-        try:
-            minvalue = self.config[f"observations.oi.{lname}.minvalue"]
-        except KeyError:
-            minvalue = None
-        try:
-            maxvalue = self.config[f"observations.oi.{lname}.maxvalue"]
-        except KeyError:
-            maxvalue = None
+        settings = get_oi_settings(self.config, self.var_name)
         input_file = archive + "/raw_" + var + ".nc"
         output_file = archive + "/an_" + var + ".nc"
 
@@ -461,24 +629,20 @@ class OptimalInterpolation(PySurfexBaseTask):
         # TODO
         an_time = an_time.replace(tzinfo=None)
         # Read OK observations
-        obs_file = f"{self.platform.get_system_value('obs_dir')}/qc_{var}.json"
-        logger.info("Obs file: {}", obs_file)
-        observations = dataset_from_file(an_time, obs_file, qc_flag=0)
-        field = horizontal_oi(
+        obs_file = qc_filename(
+            self.platform.get_system_value("obs_dir"),
+            var,
+            get_qc_output_format(self.config),
+        )
+        field = optimal_interpolation(
             geo,
             background,
-            observations,
-            gelevs=gelevs,
-            hlength=hlength,
-            vlength=vlength,
-            wlength=wlength,
-            max_locations=max_locations,
-            elev_gradient=elev_gradient,
-            epsilon=epsilon,
-            minvalue=minvalue,
-            maxvalue=maxvalue,
-            interpol="bilinear",
-            only_diff=only_diff,
+            gelevs,
+            an_time,
+            obs_file,
+            settings,
+            tile_size=self.tile_size,
+            workers=self.workers,
         )
         logger.info("Write output file {}", output_file)
         if os.path.exists(output_file):
@@ -488,6 +652,112 @@ class OptimalInterpolation(PySurfexBaseTask):
         )
 
 
+class MultiOptimalInterpolation(PySurfexBaseTask):
+    """Creates horizontal OI analyses for several variables in one task.
+
+    The variables are given as a comma separated list in the task argument
+    var_names. The geometry and elevations are read once from the first
+    guess of the first variable. The analyses of the variables run in
+    observations.oi.workers processes, unless observations.oi.tile_size is
+    set, in which case the tiles of each analysis run in parallel instead.
+
+    """
+
+    def __init__(self, config):
+        """Construct the MultiOptimalInterpolation task.
+
+        Args:
+        --------------------------------------------------
+            config (ParsedObject): Parsed configuration
+
+        """
+        PySurfexBaseTask.__init__(self, config, "MultiOptimalInterpolation")
+        self.var_names = self.config["task.args.var_names"].split(",")
+        try:
+            self.tile_size = int(self.config["observations.oi.tile_size"])
+        except KeyError:
+            self.tile_size = 0
+        try:
+            self.workers = int(self.config["observations.oi.workers"])
+        except KeyError:
+            self.workers = 1
+
+    def execute(self):
+        """Execute."""
+        from pysurfex.netcdf import (
+            read_first_guess_netcdf_file,
+            write_analysis_netcdf_file,
+        )
+
+        from surfexp.qc import get_qc_output_format, qc_filename
+
+        archive = self.platform.get_system_value("archive_dir")
+        obs_dir = self.platform.get_system_value("obs_dir")
+        variables = []
+        for var_name in self.var_names:
+            if var_name not in self.translation:
+                raise KeyError(f"No translation for {var_name}")
+            variables.append((var_name, self.translation[var_name]))
+
+        # Shared input fields are read from the first variable
+        var = variables[0][1]
+        geo, validtime, background, glafs, gelevs = read_first_guess_netcdf_file(
+            archive + "/raw_" + var + ".nc", var
+        )
+        backgrounds = {var: background}
+        for __, var in variables[1:]:
+            backgrounds.update(
+                {var: read_background(archive + "/raw_" + var + ".nc", var)}
+            )
+
+        an_time = validtime.replace(tzinfo=None)
+        qc_format = get_qc_output_format(self.config)
+        jobs = {}
+        for var_name, var in variables:
+            jobs.update(
+                {
+                    var: (
+                        backgrounds[var],
+                        gelevs,
+                        an_time,
+                        qc_filename(obs_dir, var, qc_format),
+                        get_oi_settings(self.config, var_name),
+                    )
+                }
+            )
+
+        workers = min(self.workers, len(jobs))
+        if self.tile_size > 0:
+            # Parallelize over the tiles instead of the variables
+            workers = 1
+        logger.info("Analyse {} with {} workers", list(jobs), workers)
+        if workers > 1:
+            # horizontal_oi only uses the coordinates of the geometry
+            coords = SimpleNamespace(lons=geo.lons, lats=geo.lats)
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = {
+                    var: executor.submit(optimal_interpolation, coords, *job)
+                    for var, job in jobs.items()
+                }
+                fields = {var: future.result() for var, future in futures.items()}
+        else:
+            fields = {
+                var: optimal_interpolation(
+                    geo, *job, tile_size=self.tile_size, workers=self.workers
+                )
+                for var, job in jobs.items()
+            }
+
+        for var, field in fields.items():
+            output_file = archive + "/an_" + var + ".nc"
+            logger.info("Write output file {}", output_file)
+            if os.path.exists(output_file):
+                os.unlink(output_file)
+            write_analysis_netcdf_file(
+                output_file, field, var, validtime, gelevs, glafs, new_file=True, geo=geo
+            )
+
+
 class FirstGuess(PySurfexBaseTask):
     """Find first guess.
 
@@ -571,6 +841,15 @@ class CryoClim2json(PySurfexBaseTask):
 
     def execute(self):
         """Execute."""
+        from pysurfex.netcdf import read_first_guess_netcdf_file
+        from pysurfex.pseudoobs import CryoclimObservationSet
+
+        from surfexp.cryoclim import (
+            cryoclim_pseudo_obs,
+            read_cryoclim_window,
+            write_pseudo_obs_json,
+        )
+
         archive = self.platform.get_system_value("archive_dir")
         var = "surface_snow_thickness"
         input_file = archive + "/raw_" + var + ".nc"
@@ -602,20 +881,44 @@ class CryoClim2json(PySurfexBaseTask):
             cryo_varname = self.config["observations.cryo_varname"]
         except AttributeError:
             cryo_varname = None
-        obs_set = CryoclimObservationSet(
-            [obs_file],
-            validtime,
-            geo,
-            background,
-            gelevs,
-            step=step,
-            fg_threshold=fg_threshold,
-            new_snow_depth=new_snow_depth,
-            glaf=glafs,
-            laf_threshold=laf_threshold,
-            cryo_varname=cryo_varname,
-        )
-        obs_set.write_json_file(f"{self.platform.get_system_value('obs_dir')}/cryo.json")
+        try:
+            windowed = self.config["observations.cryo_windowed"]
+        except KeyError:
+            windowed = True
+        output = f"{self.platform.get_system_value('obs_dir')}/cryo.json"
+        if windowed:
+            lons, lats, snow_class = read_cryoclim_window(
+                obs_file, geo, step, cryo_varname=cryo_varname or "classed_value_c"
+            )
+            columns = cryoclim_pseudo_obs(
+                snow_class,
+                lons,
+                lats,
+                step,
+                geo,
+                background,
+                gelevs,
+                fg_threshold=fg_threshold,
+                new_snow_depth=new_snow_depth,
+                glaf=glafs,
+                laf_threshold=laf_threshold,
+            )
+            write_pseudo_obs_json(output, validtime, columns)
+        else:
+            obs_set = CryoclimObservationSet(
+                [obs_file],
+                validtime,
+                geo,
+                background,
+                gelevs,
+                step=step,
+                fg_threshold=fg_threshold,
+                new_snow_depth=new_snow_depth,
+                glaf=glafs,
+                laf_threshold=laf_threshold,
+                cryo_varname=cryo_varname,
+            )
+            obs_set.write_json_file(output)
 
 
 class CycleFirstGuess(FirstGuess):
@@ -676,6 +979,8 @@ class Oi2soda(PySurfexBaseTask):
 
     def execute(self):
         """Execute."""
+        from pysurfex.netcdf import oi2soda
+
         yy2 = self.dtg.strftime("%y")
         mm2 = self.dtg.strftime("%m")
         dd2 = self.dtg.strftime("%d")
@@ -757,16 +1062,40 @@ class Qc2obsmon(PySurfexBaseTask):
 
     def execute(self):
         """Execute."""
+        from surfexp.obsmon import ObsmonWriter, obsmon_filename
+
         archive = self.platform.get_system_value("archive_dir")
         extrarch = self.platform.get_system_value("extrarch_dir")
         obsdir = self.platform.get_system_value("obs_dir")
-        outdir = extrarch + "/ecma_sfc/" + self.dtg.strftime("%Y%m%d%H") + "/"
-        os.makedirs(outdir, exist_ok=True)
-        output = outdir + "/ecma.db"
+        try:
+            database = self.config["observations.obsmon.database"]
+        except KeyError:
+            database = "cycle"
+        try:
+            journal_mode = self.config["observations.obsmon.journal_mode"]
+        except KeyError:
+            journal_mode = "WAL"
+        output = obsmon_filename(extrarch, self.dtg, database)
+        os.makedirs(os.path.dirname(output), exist_ok=True)
 
         logger.debug("Write to {}", output)
-        if os.path.exists(output):
+        if database == "cycle" and os.path.exists(output):
             os.unlink(output)
+        with ObsmonWriter(output, journal_mode=journal_mode) as writer:
+            self.write_obsmon(writer, archive, obsdir)
+
+    def write_obsmon(self, writer, archive, obsdir):
+        """Write the analysed variables.
+
+        Args:
+        --------------------------------------------------
+            writer (ObsmonWriter): Obsmon writer
+            archive (str): Archive directory
+            obsdir (str): Observation directory
+
+        """
+        from surfexp.qc import get_qc_output_format, qc_filename
+
         obs_types = self.obs_types
         for ivar, val in enumerate(self.nnco):
             if val == 1 and len(obs_types) > ivar:
@@ -781,18 +1110,10 @@ class Qc2obsmon(PySurfexBaseTask):
 
                 if var_in != "sd":
                     var_name = self.translation[var_in]
-                    q_c = obsdir + "/qc_" + var_name + ".json"
+                    q_c = qc_filename(obsdir, var_name, get_qc_output_format(self.config))
                     fg_file = archive + "/raw_" + var_name + ".nc"
                     an_file = archive + "/an_" + var_name + ".nc"
-                    write_obsmon_sqlite_file(
-                        dtg=self.dtg,
-                        output=output,
-                        qc=q_c,
-                        fg_file=fg_file,
-                        an_file=an_file,
-                        varname=var_in,
-                        file_var=var_name,
-                    )
+                    writer.write(self.dtg, q_c, fg_file, an_file, var_in, var_name)
 
 
 class FirstGuess4OI(PySurfexBaseTask):
@@ -870,6 +1191,24 @@ class FirstGuess4OI(PySurfexBaseTask):
                 os.unlink(target)
             os.symlink(linkfile, target)
 
+    def get_fg4oi_setting(self, var, setting):
+        """Get a first guess setting for a variable.
+
+        Args:
+        --------------------------------------------------------
+            var (str): Variable
+            setting (str): Setting
+
+        Returns:
+        --------------------------------------------------------
+            any: The variable specific setting if present, else the common one.
+
+        """
+        try:
+            return self.config[f"initial_conditions.fg4oi.{var.lower()}.{setting}"]
+        except KeyError:
+            return self.config[f"initial_conditions.fg4oi.{setting}"]
+
     def write_file(self, output, variables, geo, validtime, cache=None):
         """Write the first guess file.
 
@@ -887,116 +1226,192 @@ class FirstGuess4OI(PySurfexBaseTask):
             RuntimeError: No valid data read
 
         """
-        f_g = None
-        for var in variables:
-            lvar = var.lower()
-            try:
-                identifier = "initial_conditions.fg4oi." + lvar + "."
-                inputfile = self.config[identifier + "inputfile"]
-            except KeyError:
-                identifier = "initial_conditions.fg4oi."
-                inputfile = self.config[identifier + "inputfile"]
+        from pysurfex.netcdf import create_netcdf_first_guess_template
+
+        from surfexp.regrid import get_weight_cache
+
+        try:
+            config_file = self.config["pysurfex.first_guess_yml_file"]
+        except KeyError:
+            config_file = None
+        if config_file is None or config_file == "":
+            config_file = (
+                f"{os.path.dirname(pysurfex.__path__[0])}/pysurfex/cfg/first_guess.yml"
+            )
+        logger.info("config_file={}", config_file)
+        first_guess_config = self.load_definitions(config_file)
+
+        if cache is None:
+            cache = Cache(3600)
 
+        # Group the variables by source so each source is set up and read once
+        sources = {}
+        for var in variables:
+            inputfile = self.get_fg4oi_setting(var, "inputfile")
             logger.info("inputfile0={}", inputfile)
             inputfile = self.substitute(
                 inputfile, basetime=self.fg_dtg, validtime=self.dtg
             )
             logger.info("inputfile1={}", inputfile)
-
-            try:
-                identifier = "initial_conditions.fg4oi." + lvar + "."
-                fileformat = self.config[identifier + "fileformat"]
-            except KeyError:
-                identifier = "initial_conditions.fg4oi."
-                fileformat = self.config[identifier + "fileformat"]
             fileformat = self.platform.substitute(
-                fileformat, basetime=self.fg_dtg, validtime=self.dtg
+                self.get_fg4oi_setting(var, "fileformat"),
+                basetime=self.fg_dtg,
+                validtime=self.dtg,
             )
-
-            try:
-                identifier = "initial_conditions.fg4oi." + lvar + "."
-                converter = self.config[identifier + "converter"]
-            except KeyError:
-                identifier = "initial_conditions.fg4oi."
-                converter = self.config[identifier + "converter"]
-
-            try:
-                identifier = "initial_conditions.fg4oi." + lvar + "."
-                input_geo_file = self.config[identifier + "input_geo_file"]
-            except KeyError:
-                identifier = "initial_conditions.fg4oi."
-                input_geo_file = self.config[identifier + "input_geo_file"]
-
+            converter = self.get_fg4oi_setting(var, "converter")
+            input_geo_file = self.get_fg4oi_setting(var, "input_geo_file")
             logger.info("inputfile={}, fileformat={}", inputfile, fileformat)
             logger.info("converter={}, input_geo_file={}", converter, input_geo_file)
 
-            try:
-                config_file = self.config["pysurfex.first_guess_yml_file"]
-            except KeyError:
-                config_file = None
-            if config_file is None or config_file == "":
-                config_file = f"{os.path.dirname(pysurfex.__path__[0])}/pysurfex/cfg/first_guess.yml"
-            with open(config_file, mode="r", encoding="utf-8") as file_handler:
-                config = yaml.safe_load(file_handler)
-            logger.info("config_file={}", config_file)
-            defs = config[fileformat]
-            geo_input = None
-            if input_geo_file != "":
-                with open(input_geo_file, mode="r", encoding="utf-8") as fh:
-                    geo_dict = json.load(fh)
-                geo_input = get_geo_object(geo_dict)
-            defs.update({"filepattern": inputfile, "geo_input": geo_input})
-
-            converter_conf = config[var][fileformat]["converter"]
-            if converter not in config[var][fileformat]["converter"]:
+            if converter not in first_guess_config[var][fileformat]["converter"]:
                 raise KeyError(
                     f"No converter {converter} definition found in {config_file}!"
                 )
-
-            defs.update({"fcint": self.fcint.total_seconds()})
-            initial_basetime = validtime - self.fgint
-            logger.debug("Converter={}", str(converter))
-            logger.debug("Converter_conf={}", str(converter_conf))
-            logger.debug("Defs={}", defs)
-            logger.debug(
-                "valitime={} fcint={} initial_basetime={}",
-                str(validtime),
-                str(self.fcint),
-                str(initial_basetime),
+            source = (inputfile, fileformat, input_geo_file)
+            sources.setdefault(source, []).append((var, converter))
+
+        weight_cache = get_weight_cache(self.config, self.platform)
+        fields = {}
+        for source, source_variables in sources.items():
+            fields.update(
+                self.read_first_guess_source(
+                    source,
+                    source_variables,
+                    first_guess_config,
+                    geo,
+                    validtime,
+                    cache,
+                    weight_cache,
+                )
             )
-            logger.debug("Fileformat: {}", fileformat)
 
+        # Create file
+        n_x = geo.nlons
+        n_y = geo.nlats
+        f_g = create_netcdf_first_guess_template(variables, n_x, n_y, output)
+        f_g.variables["time"][:] = float(validtime.strftime("%s"))
+        f_g.variables["longitude"][:] = np.transpose(geo.lons)
+        f_g.variables["latitude"][:] = np.transpose(geo.lats)
+        f_g.variables["x"][:] = [range(n_x)]
+        f_g.variables["y"][:] = [range(n_y)]
+        for var in variables:
+            field = fields[var]
+            if var == "altitude":
+                field[field < 0] = 0
+            f_g.variables[var][:] = np.transpose(field)
+        f_g.close()
+
+    def read_first_guess_source(
+        self,
+        source,
+        source_variables,
+        first_guess_config,
+        geo,
+        validtime,
+        cache,
+        weight_cache=None,
+    ):
+        """Read the first guess variables from one source.
+
+        The reader definitions and the input geometry are set up once. All
+        variables are read through the same cache, which keeps the open file
+        and the interpolator. With a weight cache and an input geometry the
+        fields are read on the input grid and regridded together.
+
+        Args:
+        --------------------------------------------------------
+            source (tuple): Input file, file format and input geometry file
+            source_variables (list): Variables and their converter names
+            first_guess_config (dict): First guess definitions
+            geo (Geo): Geometry
+            validtime (as_datetime): Validtime
+            cache (Cache): Cache
+            weight_cache (WeightCache, optional): Interpolation weights.
+                                                  Defaults to None.
+
+        Raises:
+        ---------------------------------------------
+            RuntimeError: No valid data read
+
+        Returns:
+        --------------------------------------------------------
+            dict: Fields on the geometry for each variable
+
+        """
+        from pysurfex.read import ConvertedInput, Converter
+
+        inputfile, fileformat, input_geo_file = source
+        logger.info(
+            "Read {} from {} ({})",
+            [var for var, __ in source_variables],
+            inputfile,
+            fileformat,
+        )
+        defs = copy.deepcopy(first_guess_config[fileformat])
+        geo_input = None
+        if input_geo_file != "":
+            with open(input_geo_file, mode="r", encoding="utf-8") as fh:
+                geo_dict = json.load(fh)
+            geo_input = get_geo_object(geo_dict)
+        defs.update(
+            {
+                "filepattern": inputfile,
+                "geo_input": geo_input,
+                "fcint": self.fcint.total_seconds(),
+            }
+        )
+        initial_basetime = validtime - self.fgint
+        logger.debug("Defs={}", defs)
+        logger.debug(
+            "valitime={} fcint={} initial_basetime={}",
+            str(validtime),
+            str(self.fcint),
+            str(initial_basetime),
+        )
+
+        # Read on the input grid and regrid with cached weights
+        regrid_input = weight_cache is not None and geo_input is not None
+        read_geo = geo_input if regrid_input else geo
+        fields = {}
+        interpolations = {}
+        for var, converter_name in source_variables:
+            converter_conf = first_guess_config[var][fileformat]["converter"]
             logger.info(
-                "Set up converter. defs={} converter_conf={}", defs, converter_conf
+                "Set up converter {} for var={}. converter_conf={}",
+                converter_name,
+                var,
+                converter_conf,
             )
             converter = Converter(
-                converter, initial_basetime, defs, converter_conf, fileformat
+                converter_name, initial_basetime, defs, converter_conf, fileformat
             )
             logger.info("Read converted input for var={} validtime={}", var, validtime)
-            field = ConvertedInput(geo, var, converter).read_time_step(validtime, cache)
-            field = np.reshape(field, [geo.nlons, geo.nlats])
+            fields[var] = ConvertedInput(read_geo, var, converter).read_time_step(
+                validtime, cache
+            )
+            if regrid_input:
+                try:
+                    interpolation = self.get_fg4oi_setting(var, "interpolation")
+                except KeyError:
+                    interpolation = "bilinear"
+                interpolations.setdefault(interpolation, []).append(var)
+
+        for interpolation, interpolation_variables in interpolations.items():
+            values = weight_cache.regrid_fields(
+                [fields[var] for var in interpolation_variables],
+                geo_input.lons,
+                geo_input.lats,
+                geo.lons,
+                geo.lats,
+                method=interpolation,
+            )
+            fields.update(zip(interpolation_variables, values))
 
-            if np.all(np.isnan(field)):
+        for var, field in fields.items():
+            fields[var] = np.reshape(field, [geo.nlons, geo.nlats])
+            if np.all(np.isnan(fields[var])):
                 raise RuntimeError("All data read are undefined!")
-
-            # Create file
-            if f_g is None:
-                n_x = geo.nlons
-                n_y = geo.nlats
-                f_g = create_netcdf_first_guess_template(variables, n_x, n_y, output)
-                f_g.variables["time"][:] = float(validtime.strftime("%s"))
-                f_g.variables["longitude"][:] = np.transpose(geo.lons)
-                f_g.variables["latitude"][:] = np.transpose(geo.lats)
-                f_g.variables["x"][:] = [range(n_x)]
-                f_g.variables["y"][:] = [range(n_y)]
-
-            if var == "altitude":
-                field[field < 0] = 0
-
-            f_g.variables[var][:] = np.transpose(field)
-
-        if f_g is not None:
-            f_g.close()
+        return fields
 
 
 class LogProgress(PySurfexBaseTask):
@@ -1020,6 +1435,8 @@ class LogProgress(PySurfexBaseTask):
 
     def execute(self):
         """Execute."""
+        # The time between cycles sizes the look-ahead of the cycle input
+        record_task(get_statistics_file(self.config, self.platform), self.name, self.dtg)
 
 
 class LogProgressPP(PySurfexBaseTask):
@@ -1,10 +1,8 @@
 """Entry point to execute a task in a template"""
 import json
+import os
 import sys
 
-from .ecflow.default import default_main
-from .stand_alone import stand_alone_main
-
 
 def execute_task(argv=None):
     if argv is None:
@@ -16,9 +14,23 @@ def execute_task(argv=None):
     template = kwargs.get("template")
     if template is None:
         template = "ecflow"
+    # Only import what the template needs
     if template == "ecflow":
+        from .worker import WORKER_SOCKET, submit_task
+
+        # Run in a warm worker on the node if there is one
+        worker_socket = os.environ.get(WORKER_SOCKET)
+        if worker_socket:
+            exit_code = submit_task(worker_socket, kwargs)
+            if exit_code is not None:
+                sys.exit(exit_code)
+
+        from .ecflow.default import default_main
+
         default_main(**kwargs)
     elif template == "stand_alone":
+        from .stand_alone import stand_alone_main
+
         task_name = kwargs["STAND_ALONE_TASK_NAME"]
         config = kwargs["STAND_ALONE_TASK_CONFIG"]
         deode_home = kwargs["STAND_ALONE_DEODE_HOME"]
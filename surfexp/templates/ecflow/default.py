@@ -1,15 +1,10 @@
 """Default ecflow container."""
 
 import os
+import sys
+import time
 
-from deode.config_parser import ConfigParserDefaults, ParsedConfig
-from deode.derived_variables import derived_variables
-from deode.logs import LogDefaults, LoggerHandlers, logger
-from deode.scheduler import EcflowClient, EcflowServer, EcflowTask
-from deode.submission import ProcessorLayout
-from deode.tasks.discover_task import get_task
-
-logger.enable("deode")
+from surfexp.templates.worker import WORKER_SOCKET, submit_task
 
 
 def parse_ecflow_vars():
@@ -34,10 +29,19 @@ def parse_ecflow_vars():
 
 def default_main(**kwargs):
     """Ecflow container default method."""
-    config = kwargs.get("CONFIG")
-    config = ParsedConfig.from_file(
-        config, json_schema=ConfigParserDefaults.MAIN_CONFIG_JSON_SCHEMA
-    )
+    # Imported here so a job served by a worker does not pay for them
+    from deode.derived_variables import derived_variables
+    from deode.logs import LogDefaults, LoggerHandlers, logger
+    from deode.scheduler import EcflowClient, EcflowServer, EcflowTask
+    from deode.submission import ProcessorLayout
+    from deode.tasks.discover_task import get_task
+
+    from surfexp.config_snapshot import load_config
+    from surfexp.events import set_event_handler
+
+    logger.enable("deode")
+    start = time.time()
+    config = load_config(kwargs.get("CONFIG"))
 
     # Reset loglevel according to (in order of priority):
     #     (a) Configs in ECFLOW UI
@@ -84,12 +88,16 @@ def default_main(**kwargs):
     task = EcflowTask(ecf_name, ecf_tryno, ecf_pass, ecf_rid, ecf_timeout=ecf_timeout)
 
     # This will also handle call to sys.exit(), i.e. Client.__exit__ will still be called.
-    with EcflowClient(server, task):
+    ecf_client = EcflowClient(server, task)
+    with ecf_client:
+        # Events set by the task, e.g. when the forcing of a cycle is ready
+        set_event_handler(ecf_client.client.child_event)
         processor_layout = ProcessorLayout(kwargs)
         update = derived_variables(config, processor_layout=processor_layout)
         config = config.copy(update=update)
 
         # TODO Add wrapper to config
+        logger.info("Task startup took {:.3f} s", time.time() - start)
         logger.info("Running task {}", task.ecf_name)
         get_task(task.ecf_task, config).run()
         logger.info("Finished task {}", task.ecf_name)
@@ -99,7 +107,15 @@ if __name__ == "__main__":
     # Get ecflow variables
     kwargs_main = parse_ecflow_vars()
 
-    default_main(**kwargs_main)
+    # Run in a warm worker on the node if there is one
+    exit_code = None
+    worker_socket = os.environ.get(WORKER_SOCKET)
+    if worker_socket:
+        exit_code = submit_task(worker_socket, kwargs_main)
+    if exit_code is None:
+        default_main(**kwargs_main)
+    else:
+        sys.exit(exit_code)
 
 """    # noqa
 %end"  # noqa
@@ -0,0 +1,555 @@
+"""Run a suite locally without an ecflow server.
+
+The dependency graph is read from the ecflow definition of the suite, so the
+local run has the same triggers as the ecflow suite, including the cycles
+run ahead for input. Tasks with fulfilled triggers run concurrently, each in
+its own process with the stand_alone template. Events set by a task are
+sent back to the runner, so tasks triggered on them start while it runs.
+
+"""
+import argparse
+import multiprocessing
+import multiprocessing.connection
+import os
+import re
+import sys
+import tempfile
+
+from deode.logs import logger
+
+COMPLETE = "complete"
+ABORTED = "aborted"
+ACTIVE = "active"
+QUEUED = "queued"
+SET = "set"
+CLEAR = "clear"
+# Variables passed on to the tasks
+TASK_VARIABLES = ("BASETIME", "VALIDTIME", "ARGS")
+COMPARISONS = ("==", "!=", "eq", "ne")
+TOKENS = re.compile(r"\(|\)|==|!=|&&|\|\||!|[^\s()=!&|]+")
+
+
+class SuiteNode:
+    """A suite, family or task in a suite definition."""
+
+    def __init__(self, name, kind, parent=None):
+        """Construct the node.
+
+        Args:
+            name (str): Name
+            kind (str): suite, family or task
+            parent (SuiteNode, optional): Parent. Defaults to None.
+
+        """
+        self.name = name
+        self.kind = kind
+        self.parent = parent
+        self.children = []
+        self.trigger = None
+        self.defstatus = None
+        self.variables = {}
+        if parent is not None:
+            parent.children.append(self)
+
+    @property
+    def path(self):
+        """Absolute path of the node."""
+        if self.parent is None:
+            return f"/{self.name}"
+        return f"{self.parent.path}/{self.name}"
+
+    def ancestors(self):
+        """Get the node and its ancestors from the top.
+
+        Returns:
+            list: Nodes
+        """
+        nodes = []
+        node = self
+        while node is not None:
+            nodes.insert(0, node)
+            node = node.parent
+        return nodes
+
+    def add_trigger(self, expression):
+        """Add a trigger line.
+
+        Args:
+            expression (str): Trigger as in the definition file, with -a or -o
+                              for an additional trigger.
+        """
+        operator = "and"
+        if expression.startswith(("-a ", "-o ")):
+            operator = "and" if expression[1] == "a" else "or"
+            expression = expression[3:]
+        if self.trigger is None:
+            self.trigger = expression
+        else:
+            self.trigger = f"({self.trigger}) {operator} ({expression})"
+
+    def resolve(self, path):
+        """Get the absolute path of a path in a trigger of this node.
+
+        Args:
+            path (str): Absolute or relative path
+
+        Returns:
+            str: Absolute path
+        """
+        if path.startswith("/"):
+            return path
+        parts = self.parent.path.split("/")[1:] if self.parent is not None else []
+        for part in path.split("/"):
+            if part == "..":
+                parts.pop()
+            elif part not in ("", "."):
+                parts.append(part)
+        return "/" + "/".join(parts)
+
+
+def read_suite_definition(def_file):
+    """Read an ecflow definition file.
+
+    Only the nodes, triggers, default states and variables are used.
+
+    Args:
+        def_file (str): Definition file
+
+    Returns:
+        list: Top level nodes
+
+    """
+    suites = []
+    families = []
+    node = None
+    with open(def_file, mode="r", encoding="utf-8") as fhandler:
+        for raw_line in fhandler:
+            line = raw_line.strip()
+            if not line or line.startswith("#"):
+                continue
+            keyword, __, rest = line.partition(" ")
+            rest = rest.strip()
+            if keyword in ("suite", "family", "task"):
+                parent = families[-1] if families else None
+                node = SuiteNode(rest.split()[0], keyword, parent)
+                if keyword == "suite":
+                    suites.append(node)
+                if keyword != "task":
+                    families.append(node)
+            elif keyword in ("endsuite", "endfamily"):
+                families.pop()
+                node = families[-1] if families else None
+            elif node is None:
+                continue
+            elif keyword == "trigger":
+                node.add_trigger(rest)
+            elif keyword == "defstatus":
+                node.defstatus = rest
+            elif keyword == "edit":
+                name, __, value = rest.partition(" ")
+                value = value.strip()
+                if len(value) > 1 and value[0] == value[-1] and value[0] in "'\"":
+                    value = value[1:-1]
+                node.variables.update({name: value})
+    return suites
+
+
+class TriggerExpression:
+    """Evaluate an ecflow trigger expression for node states."""
+
+    def __init__(self, expression, node, get_state):
+        """Construct the expression.
+
+        Args:
+            expression (str): Trigger expression
+            node (SuiteNode): Node with the trigger
+            get_state (callable): Returns the state of an absolute path
+
+        """
+        self.tokens = TOKENS.findall(expression)
+        self.node = node
+        self.get_state = get_state
+        self.pos = 0
+
+    def evaluate(self):
+        """Evaluate the expression.
+
+        Raises:
+            ValueError: Could not parse the expression
+
+        Returns:
+            bool: True if the trigger is fulfilled
+
+        """
+        self.pos = 0
+        value = self.parse_or()
+        if self.pos != len(self.tokens):
+            raise ValueError(f"Could not parse trigger {' '.join(self.tokens)}")
+        return value
+
+    def next_token(self):
+        """Consume the next token."""
+        token = self.tokens[self.pos] if self.pos < len(self.tokens) else None
+        self.pos += 1
+        return token
+
+    def peek(self):
+        """Get the next token without consuming it."""
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def parse_or(self):
+        """Parse a disjunction."""
+        value = self.parse_and()
+        while self.peek() in ("or", "OR", "||"):
+            self.next_token()
+            other = self.parse_and()
+            value = value or other
+        return value
+
+    def parse_and(self):
+        """Parse a conjunction."""
+        value = self.parse_not()
+        while self.peek() in ("and", "AND", "&&"):
+            self.next_token()
+            other = self.parse_not()
+            value = value and other
+        return value
+
+    def parse_not(self):
+        """Parse a negation, a parenthesis or a comparison."""
+        if self.peek() in ("not", "NOT", "!"):
+            self.next_token()
+            return not self.parse_not()
+        if self.peek() == "(":
+            self.next_token()
+            value = self.parse_or()
+            if self.next_token() != ")":
+                raise ValueError(f"Missing ) in trigger {' '.join(self.tokens)}")
+            return value
+        path = self.next_token()
+        if path is not None and ":" in path and self.peek() not in COMPARISONS:
+            # An event without a comparison is a trigger on the event being set
+            return self.get_state(self.node.resolve(path)) == SET
+        operator = self.next_token()
+        state = self.next_token()
+        if path is None or state is None or operator not in COMPARISONS:
+            raise ValueError(f"Could not parse trigger {' '.join(self.tokens)}")
+        equal = self.get_state(self.node.resolve(path)) == state
+        return equal if operator in ("==", "eq") else not equal
+
+
+def run_task(name, config_file, deode_home, variables, events=None):
+    """Run a task with the stand_alone template.
+
+    Args:
+        name (str): Task name
+        config_file (str): Config file
+        deode_home (str): Deode home
+        variables (dict): Suite variables of the task
+        events (Connection, optional): Where the events set by the task are
+                                       sent. Defaults to None.
+
+    """
+    from surfexp.events import set_event_handler
+    from surfexp.templates.stand_alone import stand_alone_main
+
+    if events is not None:
+        set_event_handler(events.send)
+
+    stand_alone_main(name, config_file, deode_home, variables=variables)
+
+
+class LocalSuite:
+    """Run the tasks of a suite definition in local processes."""
+
+    def __init__(self, suites, config_file, deode_home, jobs=None):
+        """Construct the local suite.
+
+        Args:
+            suites (list): Top level nodes
+            config_file (str): Config file
+            deode_home (str): Deode home
+            jobs (int, optional): Maximum number of concurrent tasks.
+                                  Defaults to the number of CPUs.
+
+        """
+        self.config_file = config_file
+        self.deode_home = deode_home
+        if jobs is None:
+            jobs = os.cpu_count() or 1
+        self.jobs = jobs
+        self.nodes = {}
+        self.tasks = []
+        self.family_tasks = {}
+        for suite in suites:
+            self.add_node(suite)
+        self.family_states = {}
+        self.trigger_values = {}
+        self.states = {}
+        self.events = set()
+        for task in self.tasks:
+            state = QUEUED
+            for node in task.ancestors():
+                if node.defstatus == COMPLETE:
+                    state = COMPLETE
+            self.states.update({task.path: state})
+        self.triggers = {
+            path: TriggerExpression(node.trigger, node, self.get_state)
+            for path, node in self.nodes.items()
+            if node.trigger is not None
+        }
+
+    def add_node(self, node):
+        """Add a node and its children.
+
+        Args:
+            node (SuiteNode): Node
+
+        """
+        self.nodes.update({node.path: node})
+        if node.kind == "task":
+            self.tasks.append(node)
+            for family in node.ancestors()[:-1]:
+                self.family_tasks.setdefault(family.path, []).append(node.path)
+        else:
+            self.family_tasks.setdefault(node.path, [])
+        for child in node.children:
+            self.add_node(child)
+
+    def get_state(self, path):
+        """Get the state of a node.
+
+        A family is aborted if a task in it is aborted, complete if all its
+        tasks are complete and active if any task has started. The state of
+        an event (task:event) is set or clear.
+
+        Args:
+            path (str): Absolute path
+
+        Returns:
+            str: State
+
+        """
+        if path in self.states:
+            return self.states[path]
+        if ":" in path:
+            return SET if path in self.events else CLEAR
+        if path not in self.family_tasks:
+            logger.warning("Trigger on unknown node {}", path)
+            return None
+        if path not in self.family_states:
+            states = {self.states[task] for task in self.family_tasks[path]}
+            if ABORTED in states:
+                state = ABORTED
+            elif states <= {COMPLETE}:
+                state = COMPLETE
+            elif states == {QUEUED}:
+                state = QUEUED
+            else:
+                state = ACTIVE
+            self.family_states.update({path: state})
+        return self.family_states[path]
+
+    def set_state(self, task, state):
+        """Set the state of a task.
+
+        Args:
+            task (SuiteNode): Task
+            state (str): State
+
+        """
+        self.states.update({task.path: state})
+        self.family_states.clear()
+        self.trigger_values.clear()
+
+    def set_event(self, task, name):
+        """Set an event of a task.
+
+        Args:
+            task (SuiteNode): Task
+            name (str): Event name
+
+        """
+        self.events.add(f"{task.path}:{name}")
+        self.trigger_values.clear()
+
+    def receive_events(self, task, receiver):
+        """Set the events sent by a running task.
+
+        Args:
+            task (SuiteNode): Task
+            receiver (Connection): Receiving end of the events of the task
+
+        Returns:
+            bool: False if the task can not send more events
+
+        """
+        while receiver.poll():
+            try:
+                name = receiver.recv()
+            except EOFError:
+                return False
+            logger.info("Set {}:{}", task.path, name)
+            self.set_event(task, name)
+        return True
+
+    def can_run(self, task):
+        """Check if a task is queued and the triggers of it and its families hold.
+
+        Args:
+            task (SuiteNode): Task
+
+        Returns:
+            bool: True if the task can be started
+
+        """
+        if self.states[task.path] != QUEUED:
+            return False
+        for node in task.ancestors():
+            trigger = self.triggers.get(node.path)
+            if trigger is None:
+                continue
+            if node.path not in self.trigger_values:
+                self.trigger_values.update({node.path: trigger.evaluate()})
+            if not self.trigger_values[node.path]:
+                return False
+        return True
+
+    def task_variables(self, task):
+        """Get the variables of a task as inherited from its families.
+
+        Args:
+            task (SuiteNode): Task
+
+        Returns:
+            dict: Variables
+
+        """
+        variables = {}
+        for node in task.ancestors():
+            for name in TASK_VARIABLES:
+                if name in node.variables:
+                    variables.update({name: node.variables[name]})
+        return variables
+
+    def run(self):
+        """Run the suite.
+
+        Tasks depending on an aborted task are not run.
+
+        Returns:
+            list: Paths of the tasks that did not complete
+
+        """
+        running = {}
+        receivers = {}
+        while True:
+            for task in self.tasks:
+                if len(running) >= self.jobs:
+                    break
+                if not self.can_run(task):
+                    continue
+                variables = self.task_variables(task)
+                logger.info("Start {} {}", task.path, variables)
+                receiver, sender = multiprocessing.Pipe(duplex=False)
+                process = multiprocessing.Process(
+                    target=run_task,
+                    args=(task.name, self.config_file, self.deode_home, variables),
+                    kwargs={"events": sender},
+                    name=task.path,
+                )
+                process.start()
+                sender.close()
+                running.update({process.sentinel: (task, process, receiver)})
+                receivers.update({receiver: task})
+                self.set_state(task, ACTIVE)
+            if not running:
+                break
+            ready = multiprocessing.connection.wait(list(running) + list(receivers))
+            for receiver in [item for item in ready if item in receivers]:
+                if not self.receive_events(receivers[receiver], receiver):
+                    del receivers[receiver]
+            for sentinel in [item for item in ready if item in running]:
+                task, process, receiver = running.pop(sentinel)
+                process.join()
+                # Events sent just before the task ended
+                if receiver in receivers:
+                    self.receive_events(task, receiver)
+                    del receivers[receiver]
+                receiver.close()
+                if process.exitcode == 0:
+                    state = COMPLETE
+                    logger.info("Complete {}", task.path)
+                else:
+                    state = ABORTED
+                    logger.error("Aborted {} ({})", task.path, process.exitcode)
+                self.set_state(task, state)
+        return [path for path, state in self.states.items() if state != COMPLETE]
+
+
+def write_suite_definition(config_file, deode_home, def_file):
+    """Write the ecflow definition of the suite of a config.
+
+    Args:
+        config_file (str): Config file
+        deode_home (str): Deode home
+        def_file (str): Definition file to write
+
+    """
+    from deode.derived_variables import set_times
+
+    from surfexp.config_snapshot import load_config
+    from surfexp.suites.offline import SurfexSuiteDefinition
+
+    config = load_config(config_file)
+    config = config.copy(update=set_times(config))
+    config = config.copy(update={"platform": {"deode_home": deode_home}})
+    SurfexSuiteDefinition(config, dry_run=True).save_as_defs(def_file)
+
+
+def run_local_suite(argv=None):
+    """Run a suite locally.
+
+    Args:
+        argv (list, optional): Arguments. Defaults to None.
+
+    """
+    if argv is None:
+        argv = sys.argv[1:]
+    parser = argparse.ArgumentParser(description="Run a suite without ecflow")
+    parser.add_argument("config_file", help="Config file")
+    parser.add_argument(
+        "--deode-home",
+        dest="deode_home",
+        default=os.environ.get("DEODE_HOME"),
+        help="Deode home. Defaults to $DEODE_HOME",
+    )
+    parser.add_argument(
+        "--def-file",
+        dest="def_file",
+        default=None,
+        help="Existing suite definition. Created from the config if not given.",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=None,
+        help="Number of concurrent tasks. Defaults to the number of CPUs.",
+    )
+    args = parser.parse_args(argv)
+    if args.deode_home is None:
+        parser.error("No deode home given and DEODE_HOME is not set")
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        def_file = args.def_file
+        if def_file is None:
+            def_file = f"{tmpdir}/suite.def"
+            write_suite_definition(args.config_file, args.deode_home, def_file)
+        suites = read_suite_definition(def_file)
+
+    failed = LocalSuite(suites, args.config_file, args.deode_home, jobs=args.jobs).run()
+    if failed:
+        logger.error("{} tasks did not complete: {}", len(failed), failed)
+        sys.exit(1)
+    logger.info("Suite complete")
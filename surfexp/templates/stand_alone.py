@@ -1,35 +1,71 @@
 """NoSchedulerTemplate."""
 
 import os
+import time
 
-from deode.config_parser import ConfigParserDefaults, ParsedConfig
 from deode.derived_variables import derived_variables, set_times
 from deode.logs import logger  # Use deode's own configs for logger
 from deode.submission import ProcessorLayout, TaskSettings
 from deode.tasks.discover_task import get_task
 
+from surfexp.config_snapshot import load_config
+
 logger.enable("deode")
 
 
-def stand_alone_main(task, config, deode_home):
+def parse_task_args(args):
+    """Convert task arguments to a dict.
+
+    Args:
+        args (str): Arguments as key=value separated by ;
+
+    Returns:
+        dict: Arguments
+    """
+    args_dict = {}
+    if args:
+        for arg in args.split(";"):
+            parts = arg.split("=")
+            if len(parts) == 2:
+                args_dict.update({parts[0]: parts[1]})
+            elif arg != "":
+                logger.warning("Could not convert ARGS:{} to dict, skip it", arg)
+    return args_dict
+
+
+def stand_alone_main(task, config, deode_home, variables=None):
     """Execute default main.
 
     Args:
         task (str): Task name
         config (str): Config file
         deode_home(str): Deode home path
+        variables (dict, optional): Suite variables BASETIME, VALIDTIME and ARGS
+                                    of the task. Defaults to None.
     """
-    config = ParsedConfig.from_file(
-        config, json_schema=ConfigParserDefaults.MAIN_CONFIG_JSON_SCHEMA
-    )
-    config = config.copy(update=set_times(config))
+    start = time.time()
+    if variables is None:
+        variables = {}
+    config = load_config(config)
+    basetime = variables.get("BASETIME")
+    if basetime is None:
+        config = config.copy(update=set_times(config))
+    else:
+        validtime = variables.get("VALIDTIME", basetime)
+        config = config.copy(
+            update={"general": {"times": {"basetime": basetime, "validtime": validtime}}}
+        )
     config = config.copy(update={"platform": {"deode_home": deode_home}})
+    if "ARGS" in variables:
+        args = parse_task_args(variables["ARGS"])
+        config = config.copy(update={"task": {"args": args}})
 
     task_settings = TaskSettings(config).get_task_settings(task)
     processor_layout = ProcessorLayout(task_settings)
     update = derived_variables(config, processor_layout=processor_layout)
     config = config.copy(update=update)
 
+    logger.info("Task startup took {:.3f} s", time.time() - start)
     logger.info("Running task {}", task)
     get_task(task, config).run()
     logger.info("Finished task {}", task)
@@ -0,0 +1,353 @@
+"""Persistent task worker serving ecflow jobs over a Unix socket.
+
+The worker imports the task modules and loads the configs once. Each task is
+then run in a forked copy of the warm interpreter, so a job only pays for a
+socket round trip instead of the Python and import startup. The job sends the
+same variables as default_main gets together with its environment, working
+directory and output streams. The forked task reports to ecflow through
+EcflowClient as a normal job does, and the job exits with the exit code of
+the task. Only the user running the worker can submit jobs to it.
+
+"""
+import argparse
+import contextlib
+import importlib
+import json
+import os
+import select
+import signal
+import socket
+import struct
+import sys
+import traceback
+
+# Environment variable with the socket of the worker for a job
+WORKER_SOCKET = "SURFEXP_WORKER_SOCKET"
+# Modules imported before any task is served
+PRELOAD = [
+    "deode.derived_variables",
+    "deode.scheduler",
+    "deode.submission",
+    "deode.tasks.discover_task",
+    "pysurfex.geo",
+    "surfexp.tasks.compilation",
+    "surfexp.tasks.forcing",
+    "surfexp.tasks.gmtedsoil",
+    "surfexp.tasks.surfex_binary_task",
+    "surfexp.tasks.tasks",
+    "surfexp.templates.ecflow.default",
+    "netCDF4",
+    "pysurfex.forcing",
+    "pysurfex.titan",
+]
+HEADER = struct.Struct("!Q")
+# Process id, user id and group id of the peer of a Unix socket
+PEER_CREDENTIALS = struct.Struct("3i")
+# Seconds between checks of a running task
+POLL_INTERVAL = 1.0
+
+
+def recv_exactly(conn, size):
+    """Receive a number of bytes.
+
+    Args:
+        conn (socket.socket): Connection
+        size (int): Number of bytes
+
+    Raises:
+        ConnectionError: Connection closed before all bytes were received
+
+    Returns:
+        bytes: Data
+
+    """
+    data = bytearray()
+    while len(data) < size:
+        chunk = conn.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("Connection closed by peer")
+        data.extend(chunk)
+    return bytes(data)
+
+
+def send_request(conn, request, fds):
+    """Send a task request together with file descriptors.
+
+    Args:
+        conn (socket.socket): Connection
+        request (dict): Request
+        fds (list): File descriptors for stdin, stdout and stderr
+
+    """
+    body = json.dumps(request).encode("utf-8")
+    socket.send_fds(conn, [HEADER.pack(len(body))], fds)
+    conn.sendall(body)
+
+
+def recv_request(conn):
+    """Receive a task request together with file descriptors.
+
+    Args:
+        conn (socket.socket): Connection
+
+    Raises:
+        ConnectionError: No file descriptors were received
+
+    Returns:
+        tuple: Request and file descriptors
+
+    """
+    header, fds, __, __ = socket.recv_fds(conn, HEADER.size, 3)
+    if len(fds) != 3:
+        for fd in fds:
+            os.close(fd)
+        raise ConnectionError("Expected three file descriptors")
+    if len(header) < HEADER.size:
+        header = header + recv_exactly(conn, HEADER.size - len(header))
+    (size,) = HEADER.unpack(header)
+    return json.loads(recv_exactly(conn, size)), fds
+
+
+def submit_task(socket_path, kwargs):
+    """Run a task in a worker.
+
+    Args:
+        socket_path (str): Socket of the worker
+        kwargs (dict): Variables for default_main
+
+    Returns:
+        int: Exit code of the task, or None if no worker is listening
+
+    """
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        try:
+            conn.connect(socket_path)
+        except (FileNotFoundError, ConnectionRefusedError):
+            return None
+        request = {"kwargs": kwargs, "cwd": os.getcwd(), "environ": dict(os.environ)}
+        send_request(conn, request, [0, 1, 2])
+        reply = bytearray()
+        while True:
+            chunk = conn.recv(4096)
+            if not chunk:
+                break
+            reply.extend(chunk)
+    finally:
+        conn.close()
+    if not reply:
+        return 1
+    return json.loads(reply)["exit_code"]
+
+
+def run_request(request, fds):
+    """Run a task request in the current process.
+
+    Args:
+        request (dict): Request
+        fds (list): File descriptors for stdin, stdout and stderr
+
+    Returns:
+        int: Exit code
+
+    """
+    for target, fd in enumerate(fds):
+        os.dup2(fd, target)
+        os.close(fd)
+    os.environ.clear()
+    os.environ.update(request["environ"])
+    os.chdir(request["cwd"])
+
+    from surfexp.templates.ecflow.default import default_main
+
+    try:
+        default_main(**request["kwargs"])
+    except SystemExit as exc:
+        if exc.code is None:
+            return 0
+        return exc.code if isinstance(exc.code, int) else 1
+    except BaseException:  # noqa: BLE001
+        traceback.print_exc()
+        return 1
+    return 0
+
+
+def handle_connection(conn):
+    """Serve one job.
+
+    The task runs in a child process. If the job goes away, e.g. when the
+    task is killed from ecflow, the task is terminated.
+
+    Args:
+        conn (socket.socket): Connection
+
+    Returns:
+        int: Exit code
+
+    """
+    request, fds = recv_request(conn)
+    pid = os.fork()
+    if pid == 0:
+        conn.close()
+        exit_code = 1
+        try:
+            exit_code = run_request(request, fds)
+        finally:
+            with contextlib.suppress(BaseException):
+                sys.stdout.flush()
+                sys.stderr.flush()
+            os._exit(exit_code)
+    for fd in fds:
+        os.close(fd)
+
+    while True:
+        done, status = os.waitpid(pid, os.WNOHANG)
+        if done:
+            break
+        readable, __, __ = select.select([conn], [], [], POLL_INTERVAL)
+        if readable and not conn.recv(1):
+            os.kill(pid, signal.SIGTERM)
+            __, status = os.waitpid(pid, 0)
+            return os.waitstatus_to_exitcode(status)
+    exit_code = os.waitstatus_to_exitcode(status)
+    conn.sendall(json.dumps({"exit_code": exit_code}).encode("utf-8"))
+    return exit_code
+
+
+def listen(socket_path):
+    """Listen on a Unix socket only the user of this process can connect to.
+
+    Jobs run as the user of the worker, so nobody else may submit them.
+
+    Args:
+        socket_path (str): Socket
+
+    Returns:
+        socket.socket: Listening socket
+
+    """
+    with contextlib.suppress(FileNotFoundError):
+        os.unlink(socket_path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    umask = os.umask(0o177)
+    try:
+        server.bind(socket_path)
+    finally:
+        os.umask(umask)
+    os.chmod(socket_path, 0o600)
+    server.listen()
+    return server
+
+
+def peer_uid(conn):
+    """Get the user id of the peer of a Unix socket.
+
+    Args:
+        conn (socket.socket): Connection
+
+    Returns:
+        int: User id
+
+    """
+    credentials = conn.getsockopt(
+        socket.SOL_SOCKET, socket.SO_PEERCRED, PEER_CREDENTIALS.size
+    )
+    return PEER_CREDENTIALS.unpack(credentials)[1]
+
+
+class TaskWorker:
+    """Warm interpreter running ecflow tasks."""
+
+    def __init__(self, socket_path, config_files=None, preload=None):
+        """Construct the worker.
+
+        Args:
+            socket_path (str): Socket to listen on
+            config_files (list, optional): Configs to load. Defaults to None.
+            preload (list, optional): Modules to import. Defaults to PRELOAD.
+
+        """
+        self.socket_path = socket_path
+        self.config_files = config_files or []
+        if preload is None:
+            preload = PRELOAD
+        self.preload = preload
+
+    def warm_up(self):
+        """Import the modules and load the configs and geometries."""
+        from deode.logs import logger
+
+        from surfexp.config_snapshot import load_config
+        from surfexp.context import TaskContext
+
+        for module in self.preload:
+            try:
+                importlib.import_module(module)
+            except ImportError as exc:  # noqa: PERF203
+                logger.warning("Could not preload {}: {}", module, exc)
+        for config_file in self.config_files:
+            config = load_config(config_file)
+            try:
+                geo = TaskContext(config, None, None).geo
+            except KeyError:
+                logger.warning("No domain in {}", config_file)
+            else:
+                logger.info("Loaded geometry with {} points", geo.npoints)
+
+    def serve_forever(self):
+        """Serve jobs until the worker is terminated."""
+        from deode.logs import logger
+
+        self.warm_up()
+        server = listen(self.socket_path)
+        # Handlers are not waited for
+        signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+        logger.info("Worker listening on {}", self.socket_path)
+        try:
+            while True:
+                conn, __ = server.accept()
+                uid = peer_uid(conn)
+                if uid != os.getuid():
+                    logger.error("Refused job from user {}", uid)
+                    conn.close()
+                    continue
+                if os.fork() == 0:
+                    server.close()
+                    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+                    exit_code = 1
+                    try:
+                        exit_code = handle_connection(conn)
+                    except BaseException:  # noqa: BLE001
+                        traceback.print_exc()
+                    finally:
+                        os._exit(exit_code)
+                conn.close()
+        finally:
+            server.close()
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(self.socket_path)
+
+
+def task_worker(argv=None):
+    """Start a task worker.
+
+    Args:
+        argv (list, optional): Arguments. Defaults to None.
+
+    """
+    if argv is None:
+        argv = sys.argv[1:]
+    parser = argparse.ArgumentParser(description="Run ecflow tasks in a warm worker")
+    parser.add_argument(
+        "--socket",
+        dest="socket_path",
+        default=os.environ.get(WORKER_SOCKET),
+        help=f"Socket to listen on. Defaults to ${WORKER_SOCKET}",
+    )
+    parser.add_argument(
+        "--config", dest="config_files", nargs="*", default=[], help="Configs to load"
+    )
+    args = parser.parse_args(argv)
+    if args.socket_path is None:
+        parser.error(f"No socket given and {WORKER_SOCKET} is not set")
+    TaskWorker(args.socket_path, config_files=args.config_files).serve_forever()
@@ -1,3 +1,5 @@
+import datetime
+import importlib
 import os
 import sys
 
@@ -36,3 +38,36 @@ def fixture_mock_deode(session_mocker, tmp_directory):
     sys.modules["deode.__main__"] = deode.submodule
 
     session_mocker.patch("surfexp.cli.main", new=new_main)
+
+
+class NoLogger:
+    """Logger ignoring all messages."""
+
+    def __getattr__(self, name):
+        return lambda *_, **__: None
+
+
+def as_timedelta(seconds=0):
+    return datetime.timedelta(seconds=seconds)
+
+
+@pytest.fixture(name="import_fresh")
+def fixture_import_fresh(monkeypatch):
+    """Import modules with a no-op deode logger and time deltas for one test."""
+    logs = type(sys)("deode.logs")
+    logs.logger = NoLogger()
+    monkeypatch.setitem(sys.modules, "deode.logs", logs)
+    datetime_utils = type(sys)("deode.datetime_utils")
+    datetime_utils.as_timedelta = as_timedelta
+    monkeypatch.setitem(sys.modules, "deode.datetime_utils", datetime_utils)
+
+    def import_fresh(*names):
+        modules = []
+        for name in names:
+            # Restored when the test is done
+            monkeypatch.setitem(sys.modules, name, None)
+            del sys.modules[name]
+            modules.append(importlib.import_module(name))
+        return modules
+
+    return import_fresh
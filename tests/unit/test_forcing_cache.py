@@ -0,0 +1,110 @@
+"""Test the forcing input cache."""
+import functools
+import http.server
+import os
+import threading
+import time
+
+import pytest
+
+
+@pytest.fixture(name="cache_module")
+def fixture_cache_module(import_fresh):
+    return import_fresh("surfexp.cache")[0]
+
+
+@pytest.fixture(name="server")
+def fixture_server(tmp_path):
+    remote = tmp_path / "remote"
+    for hour in range(3):
+        path = remote / "2024" / f"input_{hour:02d}.nc"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(bytes(1000 * (hour + 1)))
+    handler = functools.partial(
+        http.server.SimpleHTTPRequestHandler, directory=remote.as_posix()
+    )
+    httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_is_remote(cache_module):
+    is_remote = cache_module.is_remote
+    assert is_remote("https://thredds.met.no/thredds/dodsC/@YYYY@/file.nc")
+    assert not is_remote("/lustre/@YYYY@/file.nc")
+
+
+def test_fetch_and_local_pattern(tmp_path, server, cache_module):
+    pattern = f"{server}/@YYYY@/input_@HH@.nc"
+    cache = cache_module.ForcingInputCache(
+        (tmp_path / "cache").as_posix(), pattern, workers=2
+    )
+    urls = [f"{server}/2024/input_{hour:02d}.nc" for hour in range(3)]
+    cache.fetch_all(urls)
+    local_pattern = cache.local_pattern()
+    for hour in range(3):
+        local_file = local_pattern.replace("@YYYY@", "2024").replace(
+            "@HH@", f"{hour:02d}"
+        )
+        assert os.path.getsize(local_file) == 1000 * (hour + 1)
+    assert sorted(cache.entries()) == sorted(cache.local_file(url) for url in urls)
+
+
+def test_fetch_missing(tmp_path, server, cache_module):
+    cache = cache_module.ForcingInputCache(
+        (tmp_path / "cache").as_posix(), f"{server}/@HH@.nc"
+    )
+    cache.fetch_all([f"{server}/missing.nc"], required=False)
+    with pytest.raises(RuntimeError):
+        cache.fetch_all([f"{server}/missing.nc"])
+    assert cache.entries() == []
+
+
+def test_evict_least_recently_used(tmp_path, server, cache_module):
+    pattern = f"{server}/@YYYY@/input_@HH@.nc"
+    cache = cache_module.ForcingInputCache(
+        (tmp_path / "cache").as_posix(), pattern, max_size=5000
+    )
+    urls = [f"{server}/2024/input_{hour:02d}.nc" for hour in range(3)]
+    for age, url in enumerate(urls):
+        local_file = cache.fetch(url)
+        os.utime(local_file, (1000 + age, 1000 + age))
+    # Using the oldest file keeps it in the cache
+    cache.fetch(urls[0])
+    cache.evict()
+    assert sorted(cache.entries()) == sorted(
+        [cache.local_file(urls[0]), cache.local_file(urls[2])]
+    )
+
+
+def test_evict_keeps_leased(tmp_path, server, cache_module):
+    pattern = f"{server}/@YYYY@/input_@HH@.nc"
+    cache = cache_module.ForcingInputCache(
+        (tmp_path / "cache").as_posix(), pattern, max_size=0
+    )
+    other = cache_module.ForcingInputCache(
+        (tmp_path / "cache").as_posix(), pattern, max_size=0
+    )
+    urls = [f"{server}/2024/input_{hour:02d}.nc" for hour in range(3)]
+    old = cache.fetch(urls[0])
+    os.utime(old, (1000, 1000))
+    other.acquire()
+    # Fetched by a running task, but not read yet
+    os.utime(other.lease, (time.time() - 10, time.time() - 10))
+    fetched = other.fetch(urls[1])
+    assert cache.evict() == [old]
+    assert cache.entries() == [fetched]
+    other.release()
+    assert cache.evict() == [fetched]
+
+
+def test_evict_removed_by_others(tmp_path, cache_module):
+    entries = [(tmp_path / f"{index}.nc").as_posix() for index in range(2)]
+    for entry in entries:
+        with open(entry, mode="wb") as fhandler:
+            fhandler.write(bytes(100))
+    os.unlink(entries[0])
+    assert cache_module.evict_lru(entries, 0) == [entries[1]]
@@ -0,0 +1,93 @@
+"""Test the in-place modification of forcing files."""
+import shutil
+
+import numpy as np
+import pytest
+
+netcdf4 = pytest.importorskip("netCDF4")
+pytest.importorskip("pysurfex.forcing")
+
+NTIMES = 4
+NPOINTS = 5
+FORMATS = ["NETCDF3_CLASSIC", "NETCDF3_64BIT_OFFSET", "NETCDF4_CLASSIC", "NETCDF4"]
+
+
+@pytest.fixture(name="forcing")
+def fixture_forcing(import_fresh):
+    return import_fresh("surfexp.forcing")[0]
+
+
+def write_forcing(filename, fmt, record, variables, seed):
+    """Write a small forcing file with random values."""
+    rng = np.random.default_rng(seed)
+    with netcdf4.Dataset(filename, "w", format=fmt) as ncf:
+        ncf.createDimension("time", None if record else NTIMES)
+        ncf.createDimension("Number_of_points", NPOINTS)
+        zs_var = ncf.createVariable("ZS", "f4", ("Number_of_points",))
+        zs_var[:] = rng.uniform(0.0, 1000.0, NPOINTS)
+        for name, dtype in variables.items():
+            var = ncf.createVariable(name, dtype, ("time", "Number_of_points"))
+            if np.dtype(dtype).kind == "f":
+                var.units = "K"
+                var[...] = rng.uniform(250.0, 300.0, (NTIMES, NPOINTS))
+            else:
+                var[...] = rng.integers(-100, 100, (NTIMES, NPOINTS))
+
+
+def read_all(filename):
+    with netcdf4.Dataset(filename, "r") as ncf:
+        ncf.set_auto_maskandscale(False)
+        return {name: np.array(var[...]) for name, var in ncf.variables.items()}
+
+
+@pytest.mark.parametrize("fmt", FORMATS)
+@pytest.mark.parametrize("record", [True, False])
+@pytest.mark.parametrize(
+    "variables",
+    [
+        {"Tair": "f4"},
+        # Several record variables, one of them padded to four bytes
+        {"Tair": "f4", "Qair": "f8", "Flag": "i2"},
+    ],
+)
+def test_modify_time_steps(tmp_path, forcing, fmt, record, variables):
+    input_file = (tmp_path / "input.nc").as_posix()
+    expected_file = (tmp_path / "expected.nc").as_posix()
+    output_file = (tmp_path / "output.nc").as_posix()
+    write_forcing(input_file, fmt, record, variables, 1)
+    write_forcing(expected_file, fmt, record, variables, 2)
+    shutil.copy(expected_file, output_file)
+    classic = fmt.startswith("NETCDF3")
+    assert (forcing.read_classic_layout(output_file) is not None) == classic
+
+    from pysurfex.forcing import modify_forcing
+
+    modify_forcing(
+        input_file=input_file,
+        output_file=expected_file,
+        time_step=-1,
+        variables=list(variables),
+    )
+    forcing.modify_time_steps(input_file, output_file, list(variables))
+
+    original = read_all(input_file)
+    expected = read_all(expected_file)
+    modified = read_all(output_file)
+    assert modified.keys() == expected.keys()
+    for name, values in expected.items():
+        np.testing.assert_array_equal(modified[name], values)
+    for name in variables:
+        np.testing.assert_array_equal(modified[name][0], original[name][-1])
+
+
+def test_read_time_step(tmp_path, forcing):
+    filename = (tmp_path / "forcing.nc").as_posix()
+    write_forcing(filename, "NETCDF3_64BIT_OFFSET", True, {"Tair": "f4"}, 1)
+    values = read_all(filename)["Tair"]
+    for time_step in (0, 2, -1):
+        np.testing.assert_array_equal(
+            forcing.read_time_step(filename, "Tair", time_step), values[time_step]
+        )
+    layout = forcing.read_classic_layout(filename)
+    with pytest.raises(IndexError):
+        forcing.map_time_step(filename, layout, "Tair", NTIMES)
@@ -0,0 +1,155 @@
+"""Test the batched and parallel forcing time loops."""
+import datetime
+import os
+
+import numpy as np
+import pytest
+
+netcdf4 = pytest.importorskip("netCDF4")
+pysurfex_forcing = pytest.importorskip("pysurfex.forcing")
+
+VARIABLES = ["TA", "QA", "PS", "DIR_SW", "SCA_SW", "LW", "RAIN", "SNOW", "WIND"]
+VARIABLES += ["WIND_DIR", "CO2"]
+ATTRIBUTES = ["ZS", "ZREF", "UREF"]
+START = datetime.datetime(2024, 1, 1, 0)
+CYCLE = datetime.timedelta(hours=6)
+NCYCLES = 3
+
+
+class Geometry:
+    """Small output geometry."""
+
+    nlons = 3
+    nlats = 2
+    npoints = 6
+    lons, lats = np.meshgrid(np.linspace(10.0, 11.0, 3), np.linspace(60.0, 61.0, 2))
+
+
+class SyntheticVariable:
+    """Input variable with values depending on the time and the point."""
+
+    def __init__(self, var_name, offset):
+        self.var_name = var_name
+        self.offset = offset
+        self.times = []
+
+    def read_time_step(self, this_time, cache):  # noqa: ARG002
+        # Only the reads in this process are seen by the test
+        self.times.append(this_time)
+        hours = (this_time - START).total_seconds() / 3600.0
+        return self.offset + hours + 0.01 * np.arange(Geometry.npoints, dtype="f8")
+
+
+def options(output_file=None, start=START, stop=START + CYCLE):
+    return {
+        "start": start,
+        "stop": stop,
+        "timestep": 3600,
+        "cache_interval": 3600,
+        "output_format": "netcdf",
+        "output_file": output_file,
+        "geo_out": Geometry(),
+        "force": False,
+        "diskless_write": False,
+    }
+
+
+def input_variables():
+    var_objs = [SyntheticVariable(name, 10.0 * ind) for ind, name in enumerate(VARIABLES)]
+    att_objs = [
+        SyntheticVariable(name, 100.0 * ind) for ind, name in enumerate(ATTRIBUTES)
+    ]
+    return var_objs, att_objs
+
+
+def cycles(directory):
+    return [
+        (
+            START + CYCLE * icycle,
+            START + CYCLE * (icycle + 1),
+            (directory / f"FORCING_{icycle}.nc").as_posix(),
+        )
+        for icycle in range(NCYCLES)
+    ]
+
+
+def read_all(filename):
+    with netcdf4.Dataset(filename, "r") as ncf:
+        return {name: np.array(var[...]) for name, var in ncf.variables.items()}
+
+
+@pytest.fixture(name="forcing")
+def fixture_forcing(import_fresh):
+    return import_fresh("surfexp.forcing")[0]
+
+
+@pytest.fixture(name="expected")
+def fixture_expected(tmp_path):
+    expected = []
+    for start, stop, output_file in cycles(tmp_path / "expected"):
+        os.makedirs(os.path.dirname(output_file), exist_ok=True)
+        var_objs, att_objs = input_variables()
+        pysurfex_forcing.run_time_loop(
+            options(output_file, start, stop), var_objs, att_objs
+        )
+        expected.append(read_all(output_file))
+    return expected
+
+
+@pytest.mark.parametrize(("processes", "window"), [(1, None), (3, 2), (2, None)])
+def test_batched_time_loop(tmp_path, forcing, expected, processes, window):
+    output_dir = tmp_path / "batched"
+    output_dir.mkdir()
+    var_objs, att_objs = input_variables()
+    started = []
+    finished = []
+    forcing.run_batched_time_loop(
+        options(),
+        var_objs,
+        att_objs,
+        cycles(output_dir),
+        processes=processes,
+        window=window,
+        started=lambda: started.append(True),
+        finished=finished.append,
+    )
+    assert started == [True]
+    assert finished == list(range(NCYCLES))
+    for (__, __, output_file), values in zip(cycles(output_dir), expected):
+        written = read_all(output_file)
+        assert written.keys() == values.keys()
+        for name in values:
+            np.testing.assert_array_equal(written[name], values[name])
+    # Each time step is read once, and only the first one in this process if
+    # the others are read by the workers
+    times = [START + datetime.timedelta(hours=hour) for hour in range(NCYCLES * 6 + 1)]
+    if processes > 1:
+        times = times[:1]
+    assert all(var_obj.times == times for var_obj in var_objs)
+
+
+def test_batched_time_loop_existing_output(tmp_path, forcing, expected):
+    output_dir = tmp_path / "batched"
+    output_dir.mkdir()
+    existing = cycles(output_dir)[1][2]
+    with open(existing, mode="w", encoding="utf-8") as fhandler:
+        fhandler.write("existing")
+    var_objs, att_objs = input_variables()
+    finished = []
+    forcing.run_batched_time_loop(
+        options(),
+        var_objs,
+        att_objs,
+        cycles(output_dir),
+        processes=2,
+        window=2,
+        finished=finished.append,
+    )
+    assert sorted(finished) == list(range(NCYCLES))
+    assert finished[0] == 1
+    with open(existing, mode="r", encoding="utf-8") as fhandler:
+        assert fhandler.read() == "existing"
+    for icycle in (0, 2):
+        written = read_all(cycles(output_dir)[icycle][2])
+        for name, values in expected[icycle].items():
+            np.testing.assert_array_equal(written[name], values)
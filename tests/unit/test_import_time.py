@@ -0,0 +1,113 @@
+"""Import cost of the execute_task entry point."""
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+# Modules only the tasks using them should import
+HEAVY_MODULES = ["osgeo", "netCDF4", "pysurfex.titan", "pysurfex.forcing"]
+TASK_MODULES = [
+    "surfexp.tasks.compilation",
+    "surfexp.tasks.forcing",
+    "surfexp.tasks.gmtedsoil",
+    "surfexp.tasks.surfex_binary_task",
+    "surfexp.tasks.tasks",
+]
+# Number of imported modules recorded for each entry
+BASELINE_FILE = os.path.join(os.path.dirname(__file__), "import_baseline.json")
+# Relative growth allowed over the baseline
+MARGIN = 0.1
+# Set to record the baseline instead of checking it
+RECORD = "SURFEXP_RECORD_IMPORT_BASELINE"
+
+
+def imported_modules(modules):
+    """Import modules in a new interpreter with -X importtime.
+
+    Args:
+        modules (list): Modules to import
+
+    Returns:
+        set: Modules imported in addition to the interpreter startup
+
+    """
+
+    def run(code):
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", code],  # noqa: S603
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        imported = set()
+        for line in result.stderr.splitlines():
+            if not line.startswith("import time:"):
+                continue
+            __, cumulative, name = line[len("import time:") :].split("|")
+            if cumulative.strip().isdigit():
+                imported.add(name.strip())
+        return imported
+
+    return run("; ".join(f"import {module}" for module in modules)) - run("pass")
+
+
+def can_import(modules):
+    """Check if modules can be imported in a new interpreter.
+
+    Args:
+        modules (list): Modules to import
+
+    Returns:
+        bool: True if all modules could be imported
+
+    """
+    code = "; ".join(f"import {module}" for module in modules)
+    result = subprocess.run(
+        [sys.executable, "-c", code],  # noqa: S603
+        capture_output=True,
+        check=False,
+    )
+    return result.returncode == 0
+
+
+def check_baseline(name, imported):
+    """Compare the number of imported modules with the recorded baseline.
+
+    Args:
+        name (str): Baseline entry
+        imported (set): Imported modules
+
+    """
+    baseline = {}
+    if os.path.exists(BASELINE_FILE):
+        with open(BASELINE_FILE, mode="r", encoding="utf-8") as fhandler:
+            baseline = json.load(fhandler)
+    if os.environ.get(RECORD):
+        baseline[name] = len(imported)
+        with open(BASELINE_FILE, mode="w", encoding="utf-8") as fhandler:
+            json.dump(baseline, fhandler, indent=2, sort_keys=True)
+            fhandler.write("\n")
+        return
+    if name not in baseline:
+        pytest.skip(f"No import baseline for {name}. Record it with {RECORD}=1")
+    assert len(imported) <= baseline[name] * (1 + MARGIN)
+
+
+@pytest.mark.skipif(not can_import(["surfexp"]), reason="surfexp is not installed")
+def test_execute_task_import():
+    imported = imported_modules(["surfexp.templates.cli"])
+    for module in ["deode", "pysurfex", "numpy"]:
+        assert module not in imported
+    check_baseline("surfexp.templates.cli", imported)
+
+
+@pytest.mark.skipif(
+    not can_import(["deode", "pysurfex"]), reason="deode and pysurfex are needed"
+)
+def test_task_modules_import():
+    imported = imported_modules(TASK_MODULES)
+    for module in HEAVY_MODULES:
+        assert module not in imported
+    check_baseline("task_modules", imported)
@@ -0,0 +1,47 @@
+"""Test the local suite runner."""
+import pytest
+
+SUITE = """suite suite
+  family cycle0
+    task Forcing
+      event forcing_0
+      event forcing_1
+    family Prediction
+      trigger Forcing:forcing_0 == set
+      task OfflineForecast
+    endfamily
+  endfamily
+  family cycle1
+    task OfflineForecast
+      trigger /suite/cycle0/Forcing:forcing_1
+  endfamily
+endsuite
+"""
+
+
+@pytest.fixture(name="local_suite")
+def fixture_local_suite(tmp_path, import_fresh):
+    local_suite = import_fresh("surfexp.templates.local_suite")[0]
+    def_file = tmp_path / "suite.def"
+    def_file.write_text(SUITE)
+    suites = local_suite.read_suite_definition(def_file.as_posix())
+    return local_suite.LocalSuite(suites, "config.toml", "deode_home")
+
+
+def test_event_triggers(local_suite):
+    forcing = local_suite.nodes["/suite/cycle0/Forcing"]
+    forecasts = [
+        local_suite.nodes[path]
+        for path in (
+            "/suite/cycle0/Prediction/OfflineForecast",
+            "/suite/cycle1/OfflineForecast",
+        )
+    ]
+    assert local_suite.can_run(forcing)
+    local_suite.set_state(forcing, "active")
+    assert not any(local_suite.can_run(forecast) for forecast in forecasts)
+    local_suite.set_event(forcing, "forcing_0")
+    assert local_suite.can_run(forecasts[0])
+    assert not local_suite.can_run(forecasts[1])
+    local_suite.set_event(forcing, "forcing_1")
+    assert local_suite.can_run(forecasts[1])
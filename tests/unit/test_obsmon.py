@@ -0,0 +1,33 @@
+"""Test the obsmon writer."""
+import datetime
+import sqlite3
+
+import pytest
+
+
+@pytest.fixture(name="obsmon")
+def fixture_obsmon(import_fresh):
+    pytest.importorskip("pysurfex.titan")
+    __, obsmon = import_fresh("surfexp.qc", "surfexp.obsmon")
+    return obsmon
+
+
+def test_empty_dataset(tmp_path, obsmon):
+    from pysurfex.titan import QCDataSet
+
+    an_time = datetime.datetime(2024, 1, 1, 6)
+    observations = QCDataSet(an_time, [], [], [], [])
+    dbname = (tmp_path / "ecma.db").as_posix()
+    with obsmon.ObsmonWriter(dbname) as writer:
+        writer.add(2024010106, "t2m", observations)
+
+    with sqlite3.connect(dbname) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM usage").fetchone()[0] == 0
+        row = conn.execute("SELECT nobs_total, fg_bias_total FROM obsmon").fetchone()
+    assert row == (0.0, None)
+
+
+def test_nullable_statistic(obsmon):
+    assert obsmon.nullable_statistic("NULL") is None
+    assert obsmon.nullable_statistic(float("nan")) is None
+    assert obsmon.nullable_statistic(1) == 1.0
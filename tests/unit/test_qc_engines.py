@@ -0,0 +1,129 @@
+"""Test that the QC engines flag the same observations."""
+import datetime
+
+import numpy as np
+import pytest
+
+pytest.importorskip("titanlib")
+pysurfex_titan = pytest.importorskip("pysurfex.titan")
+
+from pysurfex.obs import ObservationSet  # noqa: E402
+from pysurfex.observation import Observation  # noqa: E402
+
+AN_TIME = datetime.datetime(2024, 1, 1, 6)
+TESTS = ["nometa", "plausibility", "blacklist", "redundancy"]
+BLACKLIST = {"lons": [10.3], "lats": [60.3], "stids": ["blk"]}
+SETTINGS = {
+    "do_test": True,
+    "plausibility": {"minval": 200.0, "maxval": 350.0},
+    "sets": {
+        "synop": {"tests": {}},
+        "netatmo": {
+            "tests": {
+                "nometa": {"do_test": False},
+                "plausibility": {"minval": 250.0},
+            }
+        },
+    },
+}
+
+
+def observation(minutes, lon, lat, value, elev=100.0, stid="NA"):
+    return Observation(
+        AN_TIME + datetime.timedelta(minutes=minutes),
+        lon,
+        lat,
+        value,
+        elev=elev,
+        stid=stid,
+        varname="air_temperature_2m",
+    )
+
+
+def datasources():
+    synop = [
+        observation(0, 10.0, 60.0, 270.0, stid="1"),
+        # No elevation
+        observation(0, 10.5, 60.5, 271.0, elev=np.nan, stid="2"),
+        # Implausible values, the second one without elevation
+        observation(0, 11.0, 61.0, 400.0, stid="3"),
+        observation(0, 11.5, 61.5, 150.0, elev=np.nan),
+        # Blacklisted station and position
+        observation(0, 10.2, 60.2, 272.0, stid="blk"),
+        observation(0, 10.3, 60.3, 273.0),
+        # Redundant with the first observation, further from the analysis time
+        observation(-60, 10.0, 60.0, 274.0, stid="5"),
+        # Redundant with the one after, which is closer to the analysis time
+        observation(-40, 10.6, 60.6, 275.0),
+        observation(10, 10.6, 60.6, 276.0),
+    ]
+    netatmo = [
+        # Implausible with the settings of this set only
+        observation(0, 12.0, 62.0, 240.0),
+        # No elevation, but nometa is not done for this set
+        observation(0, 12.5, 62.5, 277.0, elev=np.nan),
+        # Redundant with each other and with the first synop observation
+        observation(-30, 12.4, 62.4, 278.0),
+        observation(0, 12.4, 62.4, 279.0),
+        observation(0, 10.0, 60.0, 280.0),
+        # Blacklisted position in the other set
+        observation(-10, 10.3, 60.3, 281.0),
+    ]
+    return [
+        ObservationSet(synop, label="synop"),
+        ObservationSet(netatmo, label="netatmo"),
+    ]
+
+
+@pytest.fixture(name="qc")
+def fixture_qc(import_fresh):
+    return import_fresh("surfexp.qc")[0]
+
+
+def run_engine(qc, engine, tests, test_flags=None):
+    # The tests keep their input, so each engine gets its own
+    tests = pysurfex_titan.define_quality_control(
+        tests, SETTINGS, AN_TIME, blacklist=BLACKLIST
+    )
+    data_set = qc.qc_data_set(
+        engine,
+        "air_temperature_2m",
+        SETTINGS,
+        tests,
+        datasources(),
+        AN_TIME,
+        test_flags=test_flags,
+    )
+    data_set.perform_tests()
+    return data_set
+
+
+@pytest.mark.parametrize(
+    "tests", [[test] for test in TESTS] + [TESTS, list(reversed(TESTS))]
+)
+def test_engines(qc, tests):
+    titan = run_engine(qc, "titan", tests)
+    vectorized = run_engine(qc, "vectorized", tests)
+    for name in tests:
+        # Every test flags something
+        assert name in vectorized.timings["tests"]
+        assert vectorized.timings["tests"][name]["bad"] > 0
+    np.testing.assert_array_equal(vectorized.flags, np.asarray(titan.flags))
+    assert vectorized.passed_tests == titan.passed_tests
+    np.testing.assert_array_equal(
+        np.asarray(vectorized.titan_dataset.flags),
+        np.asarray(titan.titan_dataset.flags),
+    )
+
+
+def test_engines_test_flags(qc):
+    test_flags = {"nometa": 1, "plausibility": 2, "blacklist": 3, "redundancy": 4}
+    titan = run_engine(qc, "titan", TESTS, test_flags=test_flags)
+    vectorized = run_engine(qc, "vectorized", TESTS, test_flags=test_flags)
+    np.testing.assert_array_equal(vectorized.flags, np.asarray(titan.flags))
+    assert set(vectorized.flags[vectorized.flags != 0]) == set(test_flags.values())
+
+
+def test_unknown_engine(qc):
+    with pytest.raises(NotImplementedError):
+        run_engine(qc, "unknown", TESTS)
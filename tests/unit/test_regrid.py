@@ -0,0 +1,78 @@
+"""Test the regridding with cached interpolation weights."""
+import numpy as np
+import pytest
+
+pytest.importorskip("scipy")
+
+
+@pytest.fixture(name="regrid")
+def fixture_regrid(import_fresh):
+    return import_fresh("surfexp.regrid")[0]
+
+
+@pytest.fixture(name="source")
+def fixture_source():
+    i_ind, j_ind = np.meshgrid(np.arange(12), np.arange(10), indexing="ij")
+    # Slightly skewed, so the cells are not rectangles
+    lons = 5.0 + 0.5 * i_ind + 0.05 * j_ind
+    lats = 58.0 + 0.4 * j_ind + 0.03 * i_ind
+    return lons, lats
+
+
+def linear(lons, lats):
+    return 3.0 * lons - 2.0 * lats + 1.0
+
+
+def test_bilinear_reproduces_linear_field(regrid, source):
+    src_lons, src_lats = source
+    rng = np.random.default_rng(1)
+    dst_lons = rng.uniform(5.5, 10.0, 50)
+    dst_lats = rng.uniform(58.5, 61.5, 50)
+    index, weights = regrid.compute_weights(src_lons, src_lats, dst_lons, dst_lats)
+    np.testing.assert_allclose(weights.sum(axis=1), 1.0)
+    values = regrid.regrid(linear(src_lons, src_lats), index, weights)
+    np.testing.assert_allclose(values, linear(dst_lons, dst_lats), atol=1.0e-10)
+
+
+def test_nearest_outside_source_grid(regrid, source):
+    src_lons, src_lats = source
+    dst_lons = np.array([3.0, 7.0])
+    dst_lats = np.array([58.0, 65.0])
+    index, weights = regrid.compute_weights(src_lons, src_lats, dst_lons, dst_lats)
+    nearest = regrid.nearest_neighbours(src_lons, src_lats, dst_lons, dst_lats)
+    np.testing.assert_array_equal(index[:, 0], nearest)
+    np.testing.assert_array_equal(weights, [[1.0, 0.0, 0.0, 0.0]] * 2)
+    assert np.unravel_index(nearest[0], src_lons.shape) == (0, 0)
+
+
+def test_weight_cache(tmp_path, regrid, source):
+    src_lons, src_lats = source
+    dst_lons = np.array([[6.1, 7.2], [8.3, 9.4]])
+    dst_lats = np.array([[59.0, 59.5], [60.0, 60.5]])
+    field = linear(src_lons, src_lats)
+    cache = regrid.WeightCache((tmp_path / "weights").as_posix())
+    values = cache.regrid(field, src_lons, src_lats, dst_lons, dst_lats)
+    entry = cache.entry(src_lons, src_lats, dst_lons, dst_lats, "bilinear")
+    assert (tmp_path / "weights").joinpath(entry.split("/")[-1], "index.npy").exists()
+
+    # Read from disk by another cache
+    index, weights = regrid.WeightCache((tmp_path / "weights").as_posix()).get(
+        src_lons, src_lats, dst_lons, dst_lats
+    )
+    assert isinstance(weights, np.memmap)
+    np.testing.assert_allclose(regrid.regrid(field, index, weights), values)
+    np.testing.assert_allclose(values, linear(dst_lons, dst_lats).ravel(), atol=1.0e-10)
+
+
+def test_regrid_fields(tmp_path, regrid, source):
+    src_lons, src_lats = source
+    dst_lons = np.array([6.1, 7.2, 8.3])
+    dst_lats = np.array([59.0, 59.5, 60.0])
+    fields = [linear(src_lons, src_lats), src_lons * src_lats, np.ones_like(src_lons)]
+    cache = regrid.WeightCache((tmp_path / "weights").as_posix())
+    values = cache.regrid_fields(fields, src_lons, src_lats, dst_lons, dst_lats)
+    assert values.shape == (3, 3)
+    for field, field_values in zip(fields, values):
+        np.testing.assert_array_equal(
+            field_values, cache.regrid(field, src_lons, src_lats, dst_lons, dst_lats)
+        )
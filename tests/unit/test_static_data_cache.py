@@ -0,0 +1,35 @@
+"""Test the static data cache."""
+import os
+
+import pytest
+
+
+@pytest.fixture(name="cache")
+def fixture_cache(tmp_path, import_fresh):
+    cache_module = import_fresh("surfexp.cache")[0]
+    return cache_module.StaticDataCache((tmp_path / "cache").as_posix())
+
+
+def test_digest_is_independent_of_path(tmp_path, cache):
+    files = []
+    for experiment in ("exp1", "exp2"):
+        path = tmp_path / experiment / "climate" / "gmted2010.dir"
+        path.parent.mkdir(parents=True)
+        path.write_bytes(bytes(range(256)) * 10)
+        files.append(path.as_posix())
+    assert cache.digest(files[0]) == cache.digest(files[1])
+    assert cache.key({"data": cache.digest(files[0])}) == cache.key(
+        {"data": cache.digest(files[1])}
+    )
+
+
+def test_digest_follows_content(tmp_path, cache):
+    path = tmp_path / "PGD.bin"
+    path.write_bytes(b"first")
+    first = cache.digest(path.as_posix())
+    # Remembered for the same modification time and size
+    assert cache.digest(path.as_posix()) == first
+    path.write_bytes(b"other")
+    os.utime(path, ns=(1, 1))
+    assert cache.digest(path.as_posix()) != first
+    assert cache.entries() == []
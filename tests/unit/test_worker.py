@@ -0,0 +1,25 @@
+"""Test the task worker."""
+import os
+import socket
+import stat
+
+from surfexp.templates.worker import listen, peer_uid
+
+
+def test_socket_is_private(tmp_path):
+    socket_path = (tmp_path / "worker.sock").as_posix()
+    umask = os.umask(0o002)
+    try:
+        server = listen(socket_path)
+    finally:
+        os.umask(umask)
+    try:
+        assert stat.S_IMODE(os.stat(socket_path).st_mode) == 0o600
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        client.connect(socket_path)
+        conn, __ = server.accept()
+        assert peer_uid(conn) == os.getuid()
+        conn.close()
+        client.close()
+    finally:
+        server.close()